@@ -0,0 +1,92 @@
+"""
+The ``DATABASES`` setting, configured from the environment.
+
+``DJANGO_DB_ENGINE`` picks "sqlite", the default, or "postgresql". Both
+keep connections open for ``DJANGO_DB_CONN_MAX_AGE`` seconds, checked
+before reuse, or "none" to keep them for good.
+
+SQLite databases are tuned for concurrent requests when connections are
+created: write-ahead logging lets readers run alongside the writer,
+``synchronous=NORMAL`` syncs at checkpoints rather than every commit,
+reads are memory-mapped up to ``DJANGO_DB_MMAP_SIZE`` bytes,
+writers wait up to ``DJANGO_DB_BUSY_TIMEOUT`` seconds for the lock rather
+than failing with "database is locked", and transactions take the write
+lock when they begin, so a transaction that reads and then writes
+cannot fail to upgrade its lock midway.
+
+PostgreSQL connections are pooled by psycopg's pool with
+``DJANGO_DB_POOL=1``; pooled connections are returned to the pool after
+every request, so ``CONN_MAX_AGE`` does not apply.
+"""
+
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+}
+
+
+def _int(environ, name, default):
+    value = environ.get(name)
+    return default if value in (None, "") else int(value)
+
+
+def conn_max_age(environ):
+    value = environ.get("DJANGO_DB_CONN_MAX_AGE", "60")
+    return None if value.lower() == "none" else int(value)
+
+
+def sqlite(environ, base_dir):
+    pragmas = {
+        **SQLITE_PRAGMAS,
+        "mmap_size": _int(environ, "DJANGO_DB_MMAP_SIZE", SQLITE_PRAGMAS["mmap_size"]),
+    }
+    return {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": environ.get("DJANGO_DB_NAME") or base_dir / "db.sqlite3",
+        "CONN_MAX_AGE": conn_max_age(environ),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            "timeout": _int(environ, "DJANGO_DB_BUSY_TIMEOUT", 20),
+            "transaction_mode": "IMMEDIATE",
+            "init_command": "".join(
+                f"PRAGMA {name}={value};" for name, value in pragmas.items()
+            ),
+        },
+    }
+
+
+def postgresql(environ):
+    config = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": environ.get("DJANGO_DB_NAME", "todos"),
+        "USER": environ.get("DJANGO_DB_USER", ""),
+        "PASSWORD": environ.get("DJANGO_DB_PASSWORD", ""),
+        "HOST": environ.get("DJANGO_DB_HOST", ""),
+        "PORT": environ.get("DJANGO_DB_PORT", ""),
+        "CONN_MAX_AGE": conn_max_age(environ),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {},
+    }
+    if environ.get("DJANGO_DB_POOL") == "1":
+        config["CONN_MAX_AGE"] = 0
+        config["OPTIONS"]["pool"] = {
+            "min_size": _int(environ, "DJANGO_DB_POOL_MIN_SIZE", 2),
+            "max_size": _int(environ, "DJANGO_DB_POOL_MAX_SIZE", 20),
+            "timeout": _int(environ, "DJANGO_DB_POOL_TIMEOUT", 10),
+        }
+    return config
+
+
+def databases(environ=os.environ, base_dir=None):
+    """Return the ``DATABASES`` setting ``environ`` describes."""
+    engine = environ.get("DJANGO_DB_ENGINE", "sqlite")
+    if engine == "sqlite":
+        return {"default": sqlite(environ, base_dir)}
+    if engine == "postgresql":
+        return {"default": postgresql(environ)}
+    raise ImproperlyConfigured(f"Unknown DJANGO_DB_ENGINE {engine!r}.")
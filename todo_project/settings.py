@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from .database import databases
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -45,9 +48,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "todos.instrumentation.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
+    "django.middleware.http.ConditionalGetMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
@@ -74,10 +79,110 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "todo_project.wsgi.application"
 REST_FRAMEWORK = {
+    "DEFAULT_AUTHENTICATION_CLASSES": [
+        "todos.authentication.SessionAuthentication",
+        "todos.authentication.CachedTokenAuthentication",
+        "rest_framework.authentication.BasicAuthentication",
+    ],
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 10,
 }
+# Activity log entries are buffered and written in batches, see todos.activity.
+ACTIVITY_LOG_BATCH_SIZE = 500
+ACTIVITY_LOG_FLUSH_INTERVAL = 1.0  # seconds, None disables the timed flush
+
+# Seconds project membership checks are cached for in the default cache, see
+# todos.membership. A cache shared by all processes evicts changed memberships
+# everywhere; per-process caches, such as LocMemCache, keep a removed member's
+# access in the other processes until timeout.
+PROJECT_MEMBERSHIP_CACHE_TIMEOUT = 60
+
+# Responses of read-heavy endpoints are cached in their own LRU cache, see
+# todos.response_cache. Any Django cache backend can be used instead.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "responses": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "responses",
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    },
+    "tokens": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "tokens",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+RESPONSE_CACHE_ALIAS = "responses"
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Authentication tokens and their users are cached, see
+# todos.authentication.TokenCache. A cache shared by all processes evicts
+# logged out tokens everywhere; per-process caches keep them until timeout.
+TOKEN_CACHE_ALIAS = "tokens"
+TOKEN_CACHE_TIMEOUT = 60
+
+# Occurrences of recurring tasks are materialized as todos this many days
+# ahead by `manage.py run_scheduler`, see todos.scheduler.
+RECURRING_TASK_HORIZON_DAYS = 7
+RECURRING_TASK_BATCH_SIZE = 500
+RECURRING_TASK_POLL_INTERVAL = 60  # seconds
+
+# Rows read per server-side cursor fetch and written per chunk by the
+# streaming exports, see todos.export.
+EXPORT_CHUNK_SIZE = 2000
+
+# Incremental exports leave the rows changed in the last this many seconds
+# to the next extract, so rows whose transactions commit after their
+# updated_at was set, or their id was taken, are not skipped. It must exceed
+# ACTIVITY_LOG_FLUSH_INTERVAL, see todos.export.
+EXPORT_WATERMARK_LAG = 60
+
+# Imports of todo files run in a background thread, in chunks of this many
+# rows, see todos.importer. A running import whose progress has not moved
+# for IMPORT_STALE_AFTER seconds may be resumed by another worker.
+IMPORT_IN_BACKGROUND = True
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_MAX_ERRORS = 1000
+IMPORT_STALE_AFTER = 300  # seconds
+
+# Levels of subtasks /todos/{id}/tree/ shows; its rollups cover one more
+# level and leave deeper subtasks out, see todos.tree.
+TODO_TREE_MAX_DEPTH = 100
+
+# Change feeds of /projects/{id}/events/, see todos.feed. The in-process
+# broker only reaches clients of the same process; serve the feed from one
+# ASGI process or plug in a broker shared by all of them.
+FEED_BROKER = "todos.feed.InProcessBroker"
+FEED_HISTORY = 1000  # events kept per project for reconnecting clients
+FEED_QUEUE_SIZE = 1000  # events a client may fall behind before it is dropped
+FEED_HEARTBEAT = 15  # seconds
+FEED_RETRY = 3000  # milliseconds clients wait before reconnecting
+
+# Changes returned per /sync/ response, see todos.sync.
+SYNC_PAGE_SIZE = 500
+
+# Attachments are uploaded in at most UPLOAD_MAX_PARTS parts of at most
+# UPLOAD_MAX_PART_SIZE bytes, streamed to storage, and stored once per content
+# digest, see todos.uploads.
+UPLOAD_MAX_PART_SIZE = 64 * 1024 * 1024
+UPLOAD_MAX_PARTS = 10000
+
+# Todo and project reads are served by coroutines, see todos.async_views.
+# todo_project.asgi turns them on; WSGI servers keep the sync views.
+ASYNC_READ_VIEWS = os.environ.get("DJANGO_ASYNC_READ_VIEWS") == "1"
+
+# Requests are measured per route and exposed at /metrics, see
+# todos.instrumentation. Metrics are kept per process; /metrics is served to
+# staff users and scrapers sending "Authorization: Bearer <METRICS_TOKEN>".
+METRICS_TOKEN = os.environ.get("DJANGO_METRICS_TOKEN")
+INSTRUMENTATION_REPEATED_QUERIES = 10  # identical queries per request logged as N+1
+INSTRUMENTATION_PROFILE_RATE = 0.0  # share of requests run under cProfile
+INSTRUMENTATION_PROFILE_THRESHOLD = 1.0  # seconds, profiles of slower requests are kept
+INSTRUMENTATION_PROFILE_DIR = None  # where .prof files go, logged when None
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "Task Management API",
     "DESCRIPTION": "A HATEOAS-compliant API for managing tasks, projects, and related entities",
@@ -88,12 +193,10 @@ SPECTACULAR_SETTINGS = {
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
-    }
-}
+# Configured from the DJANGO_DB_* environment variables: SQLite in WAL mode
+# by default, PostgreSQL with DJANGO_DB_ENGINE=postgresql, pooled with
+# DJANGO_DB_POOL=1. See todo_project.database.
+DATABASES = databases(os.environ, BASE_DIR)
 
 
 # Password validation
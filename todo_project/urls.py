@@ -16,8 +16,10 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from todos.instrumentation import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path("api/v1/", include("todos.urls"))
+    path("api/v1/", include("todos.urls")),
+    path('metrics', metrics_view, name='metrics')
 ]
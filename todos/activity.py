@@ -0,0 +1,125 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.utils import timezone
+
+from .models import ActivityLog
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityLogWriter:
+    """
+    Buffers ``ActivityLog`` rows in memory and writes them with ``bulk_create``.
+
+    Entries recorded inside a transaction are only buffered once it commits,
+    so rolled back work never shows up in the log, and are written to the
+    database of that transaction. The buffer is written when it holds
+    ``ACTIVITY_LOG_BATCH_SIZE`` entries, every ``ACTIVITY_LOG_FLUSH_INTERVAL``
+    seconds by a background thread (``None`` disables the thread) and when
+    the process exits.
+    """
+
+    def __init__(self):
+        # Entries by the alias of the database they are written to.
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    @property
+    def batch_size(self):
+        return getattr(settings, "ACTIVITY_LOG_BATCH_SIZE", 500)
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, "ACTIVITY_LOG_FLUSH_INTERVAL", 1.0)
+
+    def entry(self, user_id, action, target):
+        return ActivityLog(
+            user_id=user_id,
+            action=action,
+            target=target[: ActivityLog._meta.get_field("target").max_length],
+            timestamp=timezone.now(),
+        )
+
+    def record(self, user_id, action, target, using=None):
+        self.record_many([self.entry(user_id, action, target)], using=using)
+
+    def record_many(self, entries, using=None):
+        """Buffer unsaved ``ActivityLog`` instances once the transaction commits."""
+        connection = transaction.get_connection(using)
+        if connection.in_atomic_block:
+            transaction.on_commit(
+                lambda: self._add(entries, connection.alias), using=using
+            )
+        else:
+            self._add(entries, connection.alias)
+
+    def _add(self, entries, using):
+        with self._lock:
+            self._pending.setdefault(using, []).extend(entries)
+            full = sum(map(len, self._pending.values())) >= self.batch_size
+        if full:
+            self.flush()
+        elif self.flush_interval is not None:
+            self._start()
+
+    def flush(self):
+        """Write all buffered entries now."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for using, entries in pending.items():
+            self._write(entries, using)
+
+    def _write(self, entries, using):
+        logs = ActivityLog.objects.using(using)
+        try:
+            try:
+                logs.bulk_create(entries, batch_size=self.batch_size)
+            except IntegrityError:
+                # The users of some entries were deleted after they were recorded.
+                users = get_user_model().objects.using(using).filter(
+                    pk__in={entry.user_id for entry in entries}
+                )
+                existing = set(users.values_list("pk", flat=True))
+                logs.bulk_create(
+                    [entry for entry in entries if entry.user_id in existing],
+                    batch_size=self.batch_size,
+                )
+        except DatabaseError:
+            logger.exception("Dropped %d activity log entries", len(entries))
+
+    def close(self):
+        """Stop the background thread and drain the buffer."""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._wakeup.set()
+            thread.join()
+            self._wakeup.clear()
+        self.flush()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="activity-log-writer", daemon=True
+            )
+        self._thread.start()
+
+    def _run(self):
+        current = threading.current_thread()
+        while self._thread is current:
+            self._wakeup.wait(self.flush_interval or 1.0)
+            if self._thread is current:
+                self.flush()
+                connections.close_all()
+
+
+activity_log = ActivityLogWriter()
+atexit.register(activity_log.close)
@@ -0,0 +1,173 @@
+from functools import update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from rest_framework import exceptions, permissions
+from rest_framework.response import Response
+
+# Permissions reading the request only, checked on the event loop as is.
+LOOP_SAFE_PERMISSIONS = (
+    permissions.AllowAny,
+    permissions.IsAuthenticated,
+    permissions.IsAuthenticatedOrReadOnly,
+    permissions.IsAdminUser,
+)
+
+
+async def _check(permission, method, *args):
+    """
+    Call the ``a<method>`` coroutine of ``permission`` or, for permissions
+    without one that may query the database, ``method`` in a thread.
+    """
+    check = getattr(permission, f"a{method}", None)
+    if check is not None:
+        return await check(*args)
+    if isinstance(permission, LOOP_SAFE_PERMISSIONS):
+        return getattr(permission, method)(*args)
+    return await sync_to_async(getattr(permission, method))(*args)
+
+
+class AsyncReadMixin:
+    """
+    Serves ``list`` and ``retrieve`` with coroutines on viewsets setting
+    ``async_read``, when ``ASYNC_READ_VIEWS`` is on.
+
+    Under ASGI the request is then authenticated with the authenticators'
+    ``aauthenticate``, checked with the permissions' ``ahas_permission`` and
+    ``ahas_object_permission`` and answered with ``alist``/``aretrieve``,
+    on the event loop, so no thread is held while the client, the cache or
+    the authentication are waited on. Queries run through the async ORM,
+    which runs them in the request's thread. ``HEAD``, the other actions and
+    WSGI deployments, where coroutine views would each need an event loop,
+    keep the sync views.
+    """
+
+    async_read = False
+    async_actions = {"list": "alist", "retrieve": "aretrieve"}
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        enabled = cls.async_read and getattr(settings, "ASYNC_READ_VIEWS", False)
+        if not enabled or actions.get("get") not in cls.async_actions:
+            return view
+        sync_view = sync_to_async(view)
+
+        async def async_view(request, *args, **kwargs):
+            if request.method != "GET":
+                return await sync_view(request, *args, **kwargs)
+            self = cls(**initkwargs)
+            self.action_map = actions
+            for method, action in actions.items():
+                setattr(self, method, getattr(self, action))
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+            return await self.adispatch(request, *args, **kwargs)
+
+        # Keeps the attributes DRF and Django read from views: cls, actions,
+        # initkwargs and csrf_exempt.
+        return update_wrapper(async_view, view)
+
+    async def adispatch(self, request, *args, **kwargs):
+        """``dispatch`` of the async actions."""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await self.ainitial(request, *args, **kwargs)
+            handler = getattr(self, self.async_actions[self.action])
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = await self.afinalize_response(
+            request, response, *args, **kwargs
+        )
+        return self.response
+
+    async def afinalize_response(self, request, response, *args, **kwargs):
+        return self.finalize_response(request, response, *args, **kwargs)
+
+    async def ainitial(self, request, *args, **kwargs):
+        self.format_kwarg = self.get_format_suffix(**kwargs)
+        negotiated = self.perform_content_negotiation(request)
+        request.accepted_renderer, request.accepted_media_type = negotiated
+        version, scheme = self.determine_version(request, *args, **kwargs)
+        request.version, request.versioning_scheme = version, scheme
+        await self.aperform_authentication(request)
+        await self.acheck_permissions(request)
+        self.check_throttles(request)
+
+    async def aperform_authentication(self, request):
+        """
+        Authenticate ``request`` with the first authenticator accepting it,
+        awaiting ``aauthenticate`` or running ``authenticate`` in a thread.
+        """
+        for authenticator in request.authenticators:
+            authenticate = getattr(authenticator, "aauthenticate", None)
+            try:
+                if authenticate is not None:
+                    user_auth = await authenticate(request)
+                else:
+                    user_auth = await sync_to_async(authenticator.authenticate)(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+            if user_auth is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth
+                return
+        request._not_authenticated()
+
+    async def acheck_permissions(self, request):
+        for permission in self.get_permissions():
+            if not await _check(permission, "has_permission", request, self):
+                self.permission_denied(
+                    request,
+                    message=getattr(permission, "message", None),
+                    code=getattr(permission, "code", None),
+                )
+
+    async def acheck_object_permissions(self, request, obj):
+        for permission in self.get_permissions():
+            if not await _check(
+                permission, "has_object_permission", request, self, obj
+            ):
+                self.permission_denied(
+                    request,
+                    message=getattr(permission, "message", None),
+                    code=getattr(permission, "code", None),
+                )
+
+    async def aget_object(self):
+        # Filtersets validate their parameters against the database.
+        queryset = await sync_to_async(self.filter_queryset)(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            )
+        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404
+        await self.acheck_object_permissions(self.request, obj)
+        return obj
+
+    def fetch_page(self):
+        """Filter and paginate the list, the sync part of ``alist``."""
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        return (list(queryset), False) if page is None else (page, True)
+
+    async def alist(self, request, *args, **kwargs):
+        objs, paginated = await sync_to_async(self.fetch_page)()
+        # Planned querysets fetch what the serializer reads up front.
+        data = self.get_serializer(objs, many=True).data
+        return self.get_paginated_response(data) if paginated else Response(data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        obj = await self.aget_object()
+        return Response(self.get_serializer(obj).data)
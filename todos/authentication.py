@@ -0,0 +1,163 @@
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import authentication, exceptions
+
+
+class SessionAuthentication(authentication.SessionAuthentication):
+    """Session authentication, with ``aauthenticate`` for async views."""
+
+    async def aauthenticate(self, request):
+        # ``request.user`` is a lazy object loading the session synchronously.
+        user = await request._request.auser()
+        if not user or not user.is_active:
+            return None
+        self.enforce_csrf(request)
+        return (user, None)
+
+
+class TokenAuthentication(authentication.TokenAuthentication):
+    """Token authentication, with ``aauthenticate`` for async views."""
+
+    def get_key(self, request):
+        """Return the token key of the ``Authorization`` header, if any."""
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 1:
+            msg = _("Invalid token header. No credentials provided.")
+            raise exceptions.AuthenticationFailed(msg)
+        if len(auth) > 2:
+            msg = _("Invalid token header. Token string should not contain spaces.")
+            raise exceptions.AuthenticationFailed(msg)
+        try:
+            return auth[1].decode()
+        except UnicodeError:
+            msg = _(
+                "Invalid token header. "
+                "Token string should not contain invalid characters."
+            )
+            raise exceptions.AuthenticationFailed(msg)
+
+    def authenticate(self, request):
+        key = self.get_key(request)
+        return None if key is None else self.authenticate_credentials(key)
+
+    async def aauthenticate(self, request):
+        key = self.get_key(request)
+        return None if key is None else await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        model = self.get_model()
+        try:
+            token = await model.objects.select_related("user").aget(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        return self.check_user(token)
+
+    def check_user(self, token):
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+        return (token.user, token)
+
+
+class TokenCache:
+    """
+    Caches tokens, with their user, in the ``TOKEN_CACHE_ALIAS`` cache for
+    ``TOKEN_CACHE_TIMEOUT`` seconds, keyed on a digest of the token key.
+
+    The handlers in ``todos.signals`` evict a user's token when it is deleted
+    and when the user is saved, so logouts, password changes and
+    deactivations apply at once; changes made without signals, such as
+    ``QuerySet.update()``, apply once the entry expires. Hits and misses are
+    counted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, "TOKEN_CACHE_ALIAS", "default")]
+
+    @property
+    def timeout(self):
+        return getattr(settings, "TOKEN_CACHE_TIMEOUT", 60)
+
+    def _key(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return f"todos:token:{digest}"
+
+    def _count(self, token):
+        with self._lock:
+            if token is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return token
+
+    def get(self, key):
+        return self._count(self.cache.get(self._key(key)))
+
+    async def aget(self, key):
+        return self._count(await self.cache.aget(self._key(key)))
+
+    def set(self, token):
+        self.cache.set(self._key(token.key), token, self.timeout)
+
+    async def aset(self, token):
+        await self.cache.aset(self._key(token.key), token, self.timeout)
+
+    def forget(self, keys, using=None):
+        """
+        Evict the tokens ``keys``, again once the current transaction commits
+        so concurrent requests cannot cache the pre-commit state.
+        """
+        keys = [self._key(key) for key in keys]
+        if keys:
+            self.cache.delete_many(keys)
+            transaction.on_commit(lambda: self.cache.delete_many(keys), using=using)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication looking tokens up in ``token_cache`` first."""
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related("user").get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_("Invalid token."))
+            token_cache.set(token)
+        return self.check_user(token)
+
+    async def aauthenticate_credentials(self, key):
+        token = await token_cache.aget(key)
+        if token is None:
+            model = self.get_model()
+            try:
+                token = await model.objects.select_related("user").aget(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_("Invalid token."))
+            await token_cache.aset(token)
+        return self.check_user(token)
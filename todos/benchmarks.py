@@ -0,0 +1,1256 @@
+import asyncio
+import io
+import json
+import random
+import statistics
+import string
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.files.base import ContentFile
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.urls import include, path
+from django.utils import timezone
+from rest_framework import filters, renderers
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.routers import DefaultRouter
+
+from .activity import activity_log
+from .compact import CompactJSONRenderer, CompactSerializer
+from .importer import TodoImporter
+from .inbox import PRIORITY_RANKS, Buckets, rebuild
+from .instrumentation import metrics
+from .models import (
+    ActivityLog,
+    Attachment,
+    Category,
+    Comment,
+    ImportJob,
+    Milestone,
+    Project,
+    RecurringTask,
+    Tag,
+    Todo,
+    Upload,
+)
+from .pagination import KeysetPagination
+from .planner import plan_queryset
+from .response_cache import response_cache
+from .scheduler import RecurringTaskScheduler
+from .search import FullTextSearchFilter, get_backend
+from .serializers import TodoSerializer, TodoTreeSerializer
+from .signals import todos_bulk_created
+from .tree import assemble, subtree
+from .uploads import complete_upload, store_part
+from .urls import router
+from .views import ActivityLogViewSet, AttachmentViewSet, InboxView, TodoViewSet
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    """Register a benchmark runnable with ``manage.py benchmark <name>``."""
+
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+
+    return register
+
+
+def timed(func, repeat):
+    """Return the median wall time of ``func`` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+@scenario("pagination")
+def pagination(rows, pages, repeat, stdout, **options):
+    """Compare page N latency of page number and keyset pagination."""
+    user = User.objects.create_user("benchmark")
+    batch = []
+    for i in range(rows):
+        batch.append(ActivityLog(user=user, action="created", target=f"Todo: {i}"))
+        if len(batch) == 10000:
+            ActivityLog.objects.bulk_create(batch)
+            batch = []
+    ActivityLog.objects.bulk_create(batch)
+    queryset = ActivityLog.objects.order_by("-timestamp")
+    view = ActivityLogViewSet()
+    factory = RequestFactory()
+
+    def fetch(query):
+        request = Request(factory.get("/api/v1/activity-logs/", query))
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(queryset, request, view)
+        return paginator, page
+
+    stdout.write(f"{rows} activity logs, page size {KeysetPagination.page_size}")
+    stdout.write(f"{'page':>8} {'page number ms':>16} {'keyset ms':>12}")
+    cursor_url, current = None, 1
+    for page in sorted(pages):
+        # Walk the cursor chain up to the requested page.
+        while current < page:
+            paginator, _ = fetch(
+                {"cursor": cursor_url} if cursor_url else {"pagination": "cursor"}
+            )
+            next_link = paginator.get_next_link()
+            if next_link is None:
+                break
+            cursor_url = Request(factory.get(next_link)).query_params["cursor"]
+            current += 1
+        if current < page:
+            break
+        keyset_query = (
+            {"cursor": cursor_url} if cursor_url else {"pagination": "cursor"}
+        )
+        offset_ms = timed(lambda: fetch({"page": page}), repeat)
+        keyset_ms = timed(lambda: fetch(keyset_query), repeat)
+        stdout.write(f"{page:>8} {offset_ms:>16.2f} {keyset_ms:>12.2f}")
+
+
+@scenario("search")
+def search(rows, repeat, stdout, **options):
+    """Compare ``SearchFilter`` (LIKE scans) with the full-text index."""
+    user = User.objects.create_user("benchmark")
+    project = Project.objects.create(name="Benchmark", owner=user)
+    rng = random.Random(0)
+    vocabulary = [
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9)))
+        for _ in range(5000)
+    ]
+    # Word frequencies follow Zipf's law, as in natural language.
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    batch = []
+    for i in range(rows):
+        words = rng.choices(vocabulary, weights, k=16)
+        batch.append(
+            Todo(
+                title=" ".join(words[:4]),
+                description=" ".join(words[4:]),
+                user=user,
+                project=project,
+            )
+        )
+        if len(batch) == 10000:
+            Todo.objects.bulk_create(batch)
+            batch = []
+    Todo.objects.bulk_create(batch)
+    # bulk_create bypasses the signals that keep the index in sync.
+    get_backend(connection.alias).rebuild(Todo, connection.alias)
+
+    view = TodoViewSet()
+    factory = RequestFactory()
+
+    def fetch(backend, query):
+        """Count and first page, as the paginated list endpoint does."""
+        request = Request(factory.get("/api/v1/todos/", {"search": query}))
+        queryset = backend().filter_queryset(request, Todo.objects.all(), view)
+        return queryset.count(), list(queryset.values_list("pk", flat=True)[:10])
+
+    stdout.write(f"{rows} todos, count and first page of 10 results")
+    stdout.write(f"{'query':>24} {'matches':>8} {'LIKE ms':>10} {'full-text ms':>14}")
+    queries = [
+        vocabulary[0],
+        vocabulary[2000],
+        vocabulary[10][:3],
+        f"{vocabulary[1]} {vocabulary[300]}",
+    ]
+    for query in queries:
+        matches = fetch(FullTextSearchFilter, query)[0]
+        like_ms = timed(lambda: fetch(filters.SearchFilter, query), repeat)
+        fts_ms = timed(lambda: fetch(FullTextSearchFilter, query), repeat)
+        stdout.write(f"{query:>24} {matches:>8} {like_ms:>10.2f} {fts_ms:>14.2f}")
+
+
+@scenario("scheduler")
+def scheduler(rows, repeat, stdout, **options):
+    """Materialize a day of occurrences of ``rows`` recurring tasks."""
+    user = User.objects.create_user("benchmark")
+    project = Project.objects.create(name="Benchmark", owner=user)
+    now = timezone.now()
+    frequencies = [choice for choice, label in RecurringTask.FREQUENCY_CHOICES]
+    for offset in range(0, rows, 10000):
+        count = min(10000, rows - offset)
+        templates = Todo.objects.bulk_create(
+            Todo(title=f"Recurring {offset + i}", user=user, project=project)
+            for i in range(count)
+        )
+        tasks = []
+        for i, template in enumerate(templates):
+            # Start dates spread over the coming week.
+            start = now + timedelta(minutes=(offset + i) % (7 * 24 * 60))
+            tasks.append(
+                RecurringTask(
+                    todo=template,
+                    frequency=frequencies[i % len(frequencies)],
+                    start_date=start,
+                    next_run_at=start,
+                )
+            )
+        RecurringTask.objects.bulk_create(tasks)
+
+    scheduler = RecurringTaskScheduler(horizon=timedelta(days=1))
+    stdout.write(f"{rows} recurring tasks, one day horizon")
+    start = time.perf_counter()
+    created = scheduler.tick(now)
+    elapsed = time.perf_counter() - start
+    stdout.write(
+        f"first tick: {created} todos in {elapsed * 1000:.0f} ms "
+        f"({created / elapsed:.0f} todos/s)"
+    )
+    idle_ms = timed(lambda: scheduler.tick(now), repeat)
+    stdout.write(f"idle tick: {idle_ms:.2f} ms")
+    hour = now + timedelta(hours=1)
+    created = scheduler.tick(hour)
+    hourly_ms = timed(lambda: scheduler.tick(hour), 1)
+    stdout.write(f"an hour later: {created} todos, then idle {hourly_ms:.2f} ms")
+
+
+@scenario("tree")
+def tree(rows, repeat, stdout, **options):
+    """Read a subtask tree of ``rows`` todos, ten children per node."""
+    user = User.objects.create_user("benchmark")
+    project = Project.objects.create(name="Benchmark", owner=user)
+    (root,) = Todo.objects.bulk_create([Todo(title="Root", user=user, project=project)])
+    level, count = [root], 1
+    while count < rows:
+        children = [
+            Todo(title="Node", user=user, project=project, parent_task=parent)
+            for parent in level
+            for _ in range(10)
+        ][: rows - count]
+        level = Todo.objects.bulk_create(children)
+        count += len(level)
+    request = Request(RequestFactory().get("/"))
+
+    def walk():
+        """One query per node, as clients following subtask links do."""
+        pending = [root.pk]
+        while pending:
+            pending.extend(
+                Todo.objects.filter(parent_task=pending.pop()).values_list(
+                    "pk", flat=True
+                )
+            )
+
+    def render():
+        nodes = subtree(root.pk, 100)
+        node = assemble(nodes, root.pk, 100)
+        return TodoTreeSerializer(node, context={"request": request}).data
+
+    stdout.write(f"tree of {count} todos")
+    stdout.write(f"per node queries: {timed(walk, 1):.0f} ms")
+    query_ms = timed(lambda: subtree(root.pk, 100), repeat)
+    stdout.write(f"recursive CTE: {query_ms:.0f} ms")
+    stdout.write(f"CTE, rollups and serialization: {timed(render, repeat):.0f} ms")
+
+
+@scenario("export")
+def export(rows, repeat, stdout, **options):
+    """Compare paging through ``/todos/`` with the streaming export."""
+    user = User.objects.create_user("benchmark")
+    project = Project.objects.create(name="Benchmark", owner=user)
+    for offset in range(0, rows, 10000):
+        Todo.objects.bulk_create(
+            Todo(title=f"Todo {i}", user=user, project=project)
+            for i in range(offset, min(offset + 10000, rows))
+        )
+    factory = RequestFactory()
+    list_view = TodoViewSet.as_view({"get": "list"})
+    export_view = TodoViewSet.as_view(
+        {"get": "export"}, basename="todo", **TodoViewSet.export.kwargs
+    )
+
+    # The project routes no "user-detail", which hyperlinks to users need.
+    fields = ",".join(name for name in TodoViewSet.export_fields if name != "user")
+
+    def page(number):
+        request = factory.get("/api/v1/todos/", {"page": number, "fields": fields})
+        request.user = user
+        list_view(request).render()
+
+    def stream(format):
+        request = factory.get("/api/v1/todos/export/", {"format": format})
+        request.user = user
+        for chunk in export_view(request).streaming_content:
+            pass
+
+    pages = 100
+    start = time.perf_counter()
+    for number in range(1, pages + 1):
+        page(number)
+    per_page = (time.perf_counter() - start) / pages
+    stdout.write(f"{rows} todos")
+    stdout.write(
+        f"paging by {KeysetPagination.page_size}: {per_page * 1000:.1f} ms per "
+        f"page, ~{per_page * rows / KeysetPagination.page_size:.0f} s in total"
+    )
+    for format in ["ndjson", "csv"]:
+        elapsed = timed(lambda: stream(format), repeat)
+        tracemalloc.start()
+        stream(format)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        stdout.write(
+            f"{format} export: {elapsed / 1000:.2f} s, peak {peak / 2**20:.1f} MiB"
+        )
+
+
+@scenario("import")
+def import_(rows, repeat, stdout, **options):
+    """Import NDJSON files of growing size; peak memory should stay flat."""
+    user = User.objects.create_user("benchmark")
+    project = Project.objects.create(name="Benchmark", owner=user)
+    tags = [f"tag{i}" for i in range(20)]
+
+    def lines(count):
+        for i in range(count):
+            row = {"title": f"Todo {i}", "tags": random.sample(tags, 2)}
+            if i % 3:
+                row["category"] = f"Category {i % 10}"
+            yield json.dumps(row) + "\n"
+
+    def run(content):
+        job = ImportJob(project=project, user=user, format="ndjson")
+        job.file.save("todos.ndjson", content)
+        TodoImporter(job).run()
+
+    # DEBUG would keep the SQL of the last 9000 queries in memory, and the
+    # activity log flushing thread would lock the in-memory test database.
+    with tempfile.TemporaryDirectory() as media, override_settings(
+        MEDIA_ROOT=media, DEBUG=False, ACTIVITY_LOG_FLUSH_INTERVAL=None
+    ):
+        for count in [rows // 10, rows]:
+            content = ContentFile("".join(lines(count)))
+            start = time.perf_counter()
+            run(content)
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            run(content)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            stdout.write(
+                f"{count} rows: {elapsed:.2f} s ({count / elapsed:.0f} rows/s), "
+                f"peak {peak / 2**20:.1f} MiB"
+            )
+
+
+def api_urlconf(async_read):
+    """The API URLconf, with its views built with ``ASYNC_READ_VIEWS`` set."""
+    module = types.ModuleType(f"todos.benchmarks.urls_{int(async_read)}")
+    with override_settings(ASYNC_READ_VIEWS=async_read):
+        api_router = DefaultRouter()
+        for prefix, viewset, basename in router.registry:
+            api_router.register(prefix, viewset, basename)
+        module.urlpatterns = [
+            path("api/v1/", include(api_router.urls)),
+            # The project routes no "user-detail", which hyperlinks to users need.
+            path(
+                "users/<int:pk>/",
+                lambda request, pk: HttpResponse(),
+                name="user-detail",
+            ),
+        ]
+    return module
+
+
+def wsgi_load(app, requests, concurrency):
+    """Send ``(path, query, headers)`` requests from ``concurrency`` threads."""
+
+    def send(request):
+        path, query, headers = request
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "SERVER_NAME": "testserver",
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "HTTP_HOST": "testserver",
+            "wsgi.input": io.BytesIO(),
+            "wsgi.url_scheme": "http",
+            **{f"HTTP_{name.upper()}": value for name, value in headers.items()},
+        }
+        statuses = []
+        start = time.perf_counter()
+        body = app(environ, lambda status, headers: statuses.append(status))
+        b"".join(body)
+        body.close()
+        assert statuses[0].startswith("200"), statuses
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        return list(executor.map(send, requests))
+
+
+def asgi_load(app, requests, concurrency):
+    """Send ``(path, query, headers)`` requests from ``concurrency`` tasks."""
+
+    async def send(request):
+        path, query, headers = request
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "server": ("testserver", 80),
+            "client": ("127.0.0.1", 50000),
+            "headers": [(b"host", b"testserver")]
+            + [(name.encode(), value.encode()) for name, value in headers.items()],
+        }
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+        statuses = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # The client stays connected.
+            await asyncio.Future()
+
+        async def respond(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+
+        start = time.perf_counter()
+        await app(scope, receive, respond)
+        assert statuses == [200], statuses
+        return time.perf_counter() - start
+
+    async def client(queue, latencies):
+        while queue:
+            latencies.append(await send(queue.pop()))
+
+    async def run():
+        queue, latencies = list(reversed(requests)), []
+        await asyncio.gather(*(client(queue, latencies) for _ in range(concurrency)))
+        return latencies
+
+    return asyncio.run(run())
+
+
+@scenario("asgi")
+def asgi(rows, repeat, stdout, concurrency, **options):
+    """
+    Compare throughput and latency of the todo reads under WSGI, and under
+    ASGI with the sync and the async views, with concurrent clients.
+    """
+    user = User.objects.create_user("benchmark")
+    project = Project.objects.create(name="Benchmark", owner=user)
+    project.members.add(user)
+    for offset in range(0, rows, 10000):
+        Todo.objects.bulk_create(
+            Todo(title=f"Todo {i}", user=user, project=project)
+            for i in range(offset, min(offset + 10000, rows))
+        )
+    ids = list(Todo.objects.values_list("id", flat=True)[:1000])
+    headers = {"authorization": f"Token {Token.objects.create(user=user).key}"}
+    fields = "fields=id,title,completed,project,priority,due_date"
+    requests = [
+        (
+            ("/api/v1/todos/", f"page={i % 10 + 1}&{fields}", headers)
+            if i % 2
+            else (f"/api/v1/todos/{random.choice(ids)}/", fields, headers)
+        )
+        for i in range(200 * repeat)
+    ]
+    deployments = [
+        ("WSGI", wsgi_load, get_wsgi_application(), False),
+        ("ASGI, sync views", asgi_load, get_asgi_application(), False),
+        ("ASGI, async views", asgi_load, get_asgi_application(), True),
+    ]
+
+    stdout.write(f"{rows} todos, {len(requests)} requests, half lists, half details")
+    stdout.write(
+        f"{'deployment':<20} {'clients':>8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}"
+    )
+    # The activity log flushing thread would lock the in-memory test database.
+    with override_settings(DEBUG=False, ACTIVITY_LOG_FLUSH_INTERVAL=None):
+        for name, load, app, async_read in deployments:
+            with override_settings(ROOT_URLCONF=api_urlconf(async_read)):
+                for clients in concurrency:
+                    start = time.perf_counter()
+                    latencies = sorted(load(app, requests, clients))
+                    elapsed = time.perf_counter() - start
+                    p50 = latencies[len(latencies) // 2] * 1000
+                    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+                    stdout.write(
+                        f"{name:<20} {clients:>8} {len(latencies) / elapsed:>8.0f} "
+                        f"{p50:>8.1f} {p99:>8.1f}"
+                    )
+
+
+@scenario("serialization")
+def serialization(rows, repeat, stdout, **options):
+    """
+    Compare serializing and rendering todos with ``TodoSerializer`` and the
+    ``JSONRenderer`` to the compact format's serializer and renderer.
+    """
+    user = User.objects.create_user("benchmark")
+    project = Project.objects.create(name="Benchmark", owner=user)
+    tags = Tag.objects.bulk_create(Tag(name=f"tag{i}") for i in range(10))
+    for offset in range(0, rows, 10000):
+        todos = Todo.objects.bulk_create(
+            Todo(title=f"Todo {i}", user=user, project=project)
+            for i in range(offset, min(offset + 10000, rows))
+        )
+        Todo.tags.through.objects.bulk_create(
+            Todo.tags.through(todo_id=todo.pk, tag_id=tags[i % 10].pk)
+            for i, todo in enumerate(todos)
+        )
+        Comment.objects.bulk_create(
+            Comment(todo=todo, user=user, content="Looks good") for todo in todos[::2]
+        )
+    request = Request(RequestFactory().get("/api/v1/todos/"))
+    context = {"request": request}
+
+    def regular(queryset):
+        serializer = TodoSerializer(context=context)
+        queryset = plan_queryset(queryset, serializer)
+        data = TodoSerializer(queryset, many=True, context=context).data
+        return renderers.JSONRenderer().render(data)
+
+    def compact(queryset):
+        serializer = CompactSerializer(TodoSerializer(context=context))
+        data = serializer.to_representation(serializer.values(queryset))
+        return CompactJSONRenderer().render(data)
+
+    stdout.write(
+        f"{'todos':>8} {'serializer ms':>14} {'compact ms':>11} {'speedup':>8}"
+    )
+    # DEBUG would keep the SQL of every query in memory.
+    with override_settings(ROOT_URLCONF=api_urlconf(False), DEBUG=False):
+        for count in [rows // 10, rows]:
+            queryset = Todo.objects.order_by("pk")[:count]
+            assert json.loads(regular(queryset)) == json.loads(compact(queryset))
+            slow = timed(lambda: regular(queryset), repeat)
+            fast = timed(lambda: compact(queryset), repeat)
+            stdout.write(f"{count:>8} {slow:>14.0f} {fast:>11.0f} {slow / fast:>7.1f}x")
+
+
+@scenario("attachments")
+def attachments(rows, stdout, **options):
+    """
+    Upload a file of ``rows`` KiB in 8 MiB parts, complete it twice, the
+    second time deduplicated, and download it whole and by range; peak
+    memory should not grow with the file.
+    """
+    user = User.objects.create_user("benchmark")
+    project = Project.objects.create(name="Benchmark", owner=user)
+    todo = Todo.objects.create(title="Benchmark", user=user, project=project)
+    size = rows * 1024
+    part_size = 8 * 2**20
+    factory = RequestFactory()
+    download_view = AttachmentViewSet.as_view(
+        {"get": "download"}, basename="attachment", **AttachmentViewSet.download.kwargs
+    )
+
+    def measure(label, func, length=size):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        stdout.write(
+            f"{label:<18} {elapsed:>7.2f} s {length / 2**20 / elapsed:>8.0f} MiB/s "
+            f"peak {peak / 2**20:.1f} MiB"
+        )
+        return result
+
+    def upload(source):
+        upload = Upload.objects.create(todo=todo, user=user, filename="big.bin")
+        for number, offset in enumerate(range(0, size, part_size), 1):
+            source.seek(offset)
+            store_part(upload, number, _Limited(source, min(part_size, size - offset)))
+        return upload
+
+    def download(**headers):
+        request = factory.get("/api/v1/attachments/", headers=headers)
+        request.user = user
+        response = download_view(request, pk=attachment.pk)
+        for chunk in response.streaming_content:
+            pass
+        response.close()
+
+    with tempfile.TemporaryDirectory() as media, tempfile.TemporaryFile() as source, (
+        override_settings(
+            MEDIA_ROOT=media, DEBUG=False, ACTIVITY_LOG_FLUSH_INTERVAL=None
+        )
+    ):
+        for _ in range(size // 2**16):
+            source.write(random.randbytes(2**16))
+        stdout.write(f"{size / 2**20:.0f} MiB file, {-(-size // part_size)} parts")
+        first = measure("parts", lambda: upload(source))
+        attachment = measure("complete", lambda: complete_upload(first))
+        second = upload(source)
+        measure("complete (dedup)", lambda: complete_upload(second))
+        measure("download", download)
+        measure(
+            "download (range)",
+            lambda: download(Range=f"bytes={size // 2}-"),
+            size - size // 2,
+        )
+
+
+class _Limited(io.RawIOBase):
+    """Reads at most ``length`` bytes of ``stream``."""
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.length = length
+
+    def read(self, size=-1):
+        size = self.length if size is None or size < 0 else min(size, self.length)
+        data = self.stream.read(size)
+        self.length -= len(data)
+        return data
+
+
+@scenario("inbox")
+def inbox(rows, repeat, stdout, **options):
+    """
+    Compare ranking a user's open todos by due date and priority from
+    ``Todo``, as clients of ``/todos/?user=`` do, to reading the inbox.
+    """
+    user = User.objects.create_user("benchmark")
+    project = Project.objects.create(name="Benchmark", owner=user)
+    now = timezone.now()
+    priorities = list(PRIORITY_RANKS)
+    for offset in range(0, rows, 10000):
+        Todo.objects.bulk_create(
+            Todo(
+                title=f"Todo {i}",
+                user=user,
+                project=project,
+                completed=i % 5 == 0,
+                priority=random.choice(priorities),
+                due_date=(
+                    now + timedelta(hours=random.randint(-2000, 2000))
+                    if i % 10
+                    else None
+                ),
+            )
+            for i in range(offset, min(offset + 10000, rows))
+        )
+    rebuild([user.pk])
+    factory = RequestFactory()
+    inbox_view = InboxView.as_view()
+
+    def ranked():
+        todos = Todo.objects.filter(user=user, completed=False).order_by("due_date")
+        todos = list(todos.values("pk", "due_date", "priority"))
+        todos.sort(
+            key=lambda todo: (
+                todo["due_date"] is None,
+                todo["due_date"] or now,
+                -PRIORITY_RANKS[todo["priority"]],
+            )
+        )
+        return todos[: KeysetPagination.page_size]
+
+    def page(**params):
+        request = factory.get("/api/v1/me/inbox/", params)
+        request.user = user
+        inbox_view(request).render()
+
+    buckets = Buckets()
+    assert [todo["pk"] for todo in ranked()] == [
+        entry.pk for entry in buckets.entries(user)[: KeysetPagination.page_size]
+    ]
+    # DEBUG would keep the SQL of every query in memory.
+    with override_settings(ROOT_URLCONF=api_urlconf(False), DEBUG=False):
+        stdout.write(f"{rows} todos of one user")
+        stdout.write(f"ranked from todos: {timed(ranked, repeat):.1f} ms")
+        first = timed(lambda: list(buckets.entries(user)[:10]), repeat)
+        stdout.write(f"inbox entries:     {first:.1f} ms")
+        counts = timed(lambda: buckets.counts(user), repeat)
+        stdout.write(f"bucket counts:     {counts:.1f} ms")
+        stdout.write(f"/me/inbox/ page:   {timed(page, repeat):.1f} ms")
+        today = timed(lambda: page(bucket="today", pagination="cursor"), repeat)
+        stdout.write(f"today, by cursor:  {today:.1f} ms")
+
+
+@scenario("instrumentation")
+def instrumentation(rows, repeat, stdout, **options):
+    """
+    Compare the latency of todo reads without ``InstrumentationMiddleware``,
+    with it, and with every request run under cProfile.
+    """
+    user = User.objects.create_user("benchmark")
+    project = Project.objects.create(name="Benchmark", owner=user)
+    for offset in range(0, rows, 10000):
+        Todo.objects.bulk_create(
+            Todo(title=f"Todo {i}", user=user, project=project)
+            for i in range(offset, min(offset + 10000, rows))
+        )
+    ids = list(Todo.objects.values_list("id", flat=True)[:1000])
+    headers = {"authorization": f"Token {Token.objects.create(user=user).key}"}
+    requests = [
+        (
+            ("/api/v1/todos/", f"page={i % 10 + 1}", headers)
+            if i % 2
+            else (f"/api/v1/todos/{random.choice(ids)}/", "", headers)
+        )
+        for i in range(200 * repeat)
+    ]
+    instrumented = "todos.instrumentation.InstrumentationMiddleware"
+    middleware = [name for name in settings.MIDDLEWARE if name != instrumented]
+    setups = [
+        ("off", {"MIDDLEWARE": middleware}),
+        ("on", {}),
+        ("on, profiled", {"INSTRUMENTATION_PROFILE_RATE": 1.0}),
+    ]
+
+    stdout.write(f"{rows} todos, {len(requests)} requests, half lists, half details")
+    stdout.write(f"{'instrumentation':<16} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8}")
+    with override_settings(
+        ROOT_URLCONF=api_urlconf(False),
+        DEBUG=False,
+        ACTIVITY_LOG_FLUSH_INTERVAL=None,
+        INSTRUMENTATION_PROFILE_THRESHOLD=3600,
+    ):
+        for name, overrides in setups:
+            with override_settings(**overrides):
+                app = get_wsgi_application()
+                latencies = sorted(wsgi_load(app, requests, 1))
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[int(len(latencies) * 0.99)] * 1000
+            mean = statistics.mean(latencies) * 1000
+            stdout.write(f"{name:<16} {p50:>8.2f} {p99:>8.2f} {mean:>8.2f}")
+
+
+WORDS = (
+    "deploy review release schema invoice report backup migrate refactor audit "
+    "design budget launch index cache onboarding feedback roadmap support sprint"
+).split()
+
+
+def generate(
+    users=10,
+    projects=10,
+    members=5,
+    todos=10000,
+    depth=2,
+    comments=2,
+    tags=20,
+    seed=0,
+    batch_size=5000,
+):
+    """
+    Fill the database with synthetic data, the same for the same arguments.
+
+    ``projects`` projects of ``members`` users each, milestones and
+    categories, ``tags`` tags and ``todos`` todos spread over ``depth``
+    levels of subtasks below the top level, with ``comments`` comments
+    each, and some attachments, recurring tasks, imports and uploads.
+    Rows are written with ``bulk_create``, and ``todos_bulk_created``
+    fills the tables derived from todos. The first user, a member of every
+    project, owns the imports and uploads and is returned.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    password = make_password("benchmark")
+    people = User.objects.bulk_create(
+        User(username=f"user{i}", password=password) for i in range(max(users, 1))
+    )
+    owner = people[0]
+    boards = Project.objects.bulk_create(
+        Project(
+            name=f"Project {i} {rng.choice(WORDS)}",
+            description=" ".join(rng.choices(WORDS, k=8)),
+            owner=people[i % len(people)],
+        )
+        for i in range(max(projects, 1))
+    )
+    teams = {
+        project.pk: [owner, *rng.sample(people[1:], min(members, len(people)) - 1)]
+        for project in boards
+    }
+    Project.members.through.objects.bulk_create(
+        Project.members.through(project_id=project_id, user_id=user.pk)
+        for project_id, team in teams.items()
+        for user in team
+    )
+    milestones = Milestone.objects.bulk_create(
+        Milestone(
+            project=project, name=f"Milestone {i}", due_date=(now + timedelta(i)).date()
+        )
+        for project in boards
+        for i in range(2)
+    )
+    categories = Category.objects.bulk_create(
+        Category(project=project, name=f"Category {i} {rng.choice(WORDS)}")
+        for project in boards
+        for i in range(2)
+    )
+    labels = Tag.objects.bulk_create(Tag(name=f"tag{i}") for i in range(max(tags, 1)))
+
+    def todo(i, parent):
+        project = parent.project if parent else boards[i % len(boards)]
+        return Todo(
+            title=f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS)} {i}",
+            description=" ".join(rng.choices(WORDS, k=12)),
+            completed=i % 5 == 0,
+            user=rng.choice(teams[project.pk]),
+            project=project,
+            category=rng.choice([None, *categories]),
+            milestone=rng.choice([None, *milestones]),
+            priority=rng.choice(list(PRIORITY_RANKS)),
+            due_date=rng.choice([None, now + timedelta(hours=rng.randint(-720, 720))]),
+            parent_task=parent,
+        )
+
+    levels = [
+        todos // (depth + 1) + (level < todos % (depth + 1))
+        for level in range(depth + 1)
+    ]
+    created, parents = [], [None]
+    for size in levels:
+        level = []
+        for offset in range(0, size, batch_size):
+            batch = Todo.objects.bulk_create(
+                todo(
+                    len(created) + len(level) + i, parents[(offset + i) % len(parents)]
+                )
+                for i in range(min(batch_size, size - offset))
+            )
+            Todo.tags.through.objects.bulk_create(
+                Todo.tags.through(todo_id=item.pk, tag_id=tag.pk)
+                for item in batch
+                for tag in rng.sample(labels, min(2, len(labels)))
+            )
+            todos_bulk_created(batch)
+            Comment.objects.bulk_create(
+                Comment(
+                    todo=item, user=rng.choice(teams[item.project_id]), content=text
+                )
+                for item in batch
+                for text in [" ".join(rng.choices(WORDS, k=6)) for _ in range(comments)]
+            )
+            level.extend(batch)
+        created.extend(level)
+        parents = level or parents
+
+    Attachment.objects.bulk_create(
+        Attachment(todo=item, uploaded_by=item.user, file="attachments/notes.txt")
+        for item in created[::10]
+    )
+    RecurringTask.objects.bulk_create(
+        RecurringTask(todo=item, frequency="WEEKLY", start_date=now)
+        for item in created[5::100]
+    )
+    ImportJob.objects.bulk_create(
+        ImportJob(
+            project=boards[i % len(boards)],
+            user=owner,
+            file="imports/todos.csv",
+            format="csv",
+            status="COMPLETED",
+        )
+        for i in range(20)
+    )
+    Upload.objects.bulk_create(
+        Upload(todo=item, user=owner, filename="notes.txt") for item in created[:20]
+    )
+    activity_log.flush()
+    return owner
+
+
+def percentile(samples, share):
+    """Return the ``share`` percentile of the sorted ``samples``."""
+    return samples[min(int(len(samples) * share), len(samples) - 1)]
+
+
+def api_requests(user, count, rng):
+    """
+    Return ``(name, [(method, path, query, body, content type)])``
+    operations exercising every endpoint of ``todos.urls.router`` as
+    ``user``: list, filter, search, order and detail reads, and creates,
+    ``count`` requests each.
+    """
+    first = {
+        model: model.objects.order_by("pk").first() for model in [Project, Todo, Tag]
+    }
+    links = {
+        model: f"/api/v1/{prefix}/{first[model].pk}/"
+        for model, prefix in [(Project, "projects"), (Todo, "todos"), (Tag, "tags")]
+    }
+    # Recurring tasks take a todo of their own each.
+    free = iter(
+        Todo.objects.filter(recurringtask__isnull=True)
+        .order_by("-pk")
+        .values_list("pk", flat=True)[: count * 2]
+    )
+    bodies = {
+        "projects": lambda i: {
+            "name": f"Benchmark {i}",
+            "owner": f"/users/{user.pk}/",
+            "members": [f"/users/{user.pk}/"],
+        },
+        "milestones": lambda i: {
+            "project": links[Project],
+            "name": f"Benchmark {i}",
+            "due_date": "2031-01-01",
+        },
+        "categories": lambda i: {"project": links[Project], "name": f"Benchmark {i}"},
+        "tags": lambda i: {"name": f"benchmark{i}"},
+        "todos": lambda i: {
+            "title": f"Benchmark {i}",
+            "user": f"/users/{user.pk}/",
+            "project": links[Project],
+            "tags": [links[Tag]],
+            "priority": "HIGH",
+        },
+        "comments": lambda i: {
+            "todo": links[Todo],
+            "user": f"/users/{user.pk}/",
+            "content": f"Benchmark {i}",
+        },
+        "attachments": lambda i: {
+            "todo": links[Todo],
+            "uploaded_by": f"/users/{user.pk}/",
+            "file": ContentFile(b"benchmark", name=f"benchmark{i}.txt"),
+        },
+        "recurring-tasks": lambda i: {
+            "todo": f"/api/v1/todos/{next(free)}/",
+            "frequency": "DAILY",
+            "start_date": "2031-01-01T00:00:00Z",
+        },
+        "imports": lambda i: {
+            "project": links[Project],
+            "file": ContentFile(
+                json.dumps({"title": f"Imported {i}"}).encode(),
+                name=f"benchmark{i}.ndjson",
+            ),
+        },
+        "uploads": lambda i: {"todo": links[Todo], "filename": f"benchmark{i}.txt"},
+    }
+
+    def encode(data):
+        if any(hasattr(value, "read") for value in data.values()):
+            return encode_multipart(BOUNDARY, data), MULTIPART_CONTENT
+        return json.dumps(data).encode(), "application/json"
+
+    operations = []
+    for prefix, viewset, basename in router.registry:
+        model = viewset.queryset.model
+        path = f"/api/v1/{prefix}/"
+        sample = model._default_manager.order_by("pk").first()
+        pks = list(
+            model._default_manager.order_by("pk").values_list("pk", flat=True)[:1000]
+        )
+        backends = viewset.filter_backends
+        reads = [("list", "")]
+        if getattr(viewset, "filterset_fields", None):
+            name = viewset.filterset_fields[0]
+            field = model._meta.get_field(name)
+            if field.many_to_many:
+                value = getattr(sample, name).values_list("pk", flat=True).first()
+            else:
+                value = field.value_from_object(sample)
+            reads.append(("filter", urlencode({name: value})))
+        if {filters.SearchFilter, FullTextSearchFilter} & set(backends):
+            term = str(getattr(sample, viewset.search_fields[0])).split()[0]
+            reads.append(("search", urlencode({"search": term})))
+        if filters.OrderingFilter in backends and getattr(
+            viewset, "ordering_fields", None
+        ):
+            reads.append(("order", f"ordering=-{viewset.ordering_fields[0]}"))
+        for name, query in reads:
+            operations.append(
+                (f"{prefix} {name}", [("GET", path, query, b"", None)] * count)
+            )
+        operations.append(
+            (
+                f"{prefix} detail",
+                [
+                    ("GET", f"{path}{rng.choice(pks)}/", "", b"", None)
+                    for _ in range(count)
+                ],
+            )
+        )
+        if hasattr(viewset, "create"):
+            if prefix not in bodies:
+                raise ValueError(f"The api scenario has no body to create {prefix}.")
+            operations.append(
+                (
+                    f"{prefix} create",
+                    [
+                        ("POST", path, "", *encode(bodies[prefix](i)))
+                        for i in range(count)
+                    ],
+                )
+            )
+    return operations
+
+
+def client_load(headers):
+    """Return a load sending requests through Django's test client."""
+    local = threading.local()
+
+    def send(request):
+        method, path, query, body, content_type = request
+        if not hasattr(local, "client"):
+            local.client = Client(headers=headers)
+        start = time.perf_counter()
+        response = local.client.generic(
+            method, f"{path}?{query}", body, content_type or "application/octet-stream"
+        )
+        elapsed = time.perf_counter() - start
+        if response.status_code >= 400:
+            raise ValueError(
+                f"{method} {path}?{query}: {response.status_code} "
+                f"{response.content[:500]!r}"
+            )
+        return elapsed
+
+    def load(requests, concurrency):
+        with ThreadPoolExecutor(concurrency) as executor:
+            return list(executor.map(send, requests))
+
+    return load
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def live_load(headers):
+    """Serve the API from a local threaded server and return a load for it."""
+    server = ThreadedWSGIServer(("127.0.0.1", 0), _QuietHandler)
+    server.set_app(get_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+
+    def send(request):
+        method, path, query, body, content_type = request
+        url = f"http://{host}:{port}{path}?{query}"
+        request = urllib.request.Request(
+            url, data=body or None, headers=dict(headers), method=method
+        )
+        if content_type:
+            request.add_header("Content-Type", content_type)
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+        except urllib.error.HTTPError as exc:
+            raise ValueError(
+                f"{method} {path}?{query}: {exc.code} {exc.read()[:500]!r}"
+            )
+        return time.perf_counter() - start
+
+    def load(requests, concurrency):
+        with ThreadPoolExecutor(concurrency) as executor:
+            return list(executor.map(send, requests))
+
+    try:
+        yield load
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def regressions(results, baseline, tolerance):
+    """
+    Return what got worse in ``results`` than in ``baseline``: more than
+    half a query more per request, or a p95 latency or throughput worse by
+    more than the ``tolerance`` share, when it is not None.
+    """
+    found = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result["queries"] > before["queries"] + 0.5:
+            found.append(
+                f"{name}: {result['queries']:.1f} queries per request, "
+                f"{before['queries']:.1f} before"
+            )
+        if tolerance is None:
+            continue
+        if result["p95"] > before["p95"] * (1 + tolerance):
+            found.append(
+                f"{name}: p95 {result['p95']:.1f} ms, {before['p95']:.1f} ms before"
+            )
+        if result["rps"] < before["rps"] / (1 + tolerance):
+            found.append(
+                f"{name}: {result['rps']:.0f} req/s, {before['rps']:.0f} before"
+            )
+    return found
+
+
+def measure(load, requests, clients):
+    """
+    Send ``requests`` from ``clients`` with ``load`` and return their
+    throughput, latency percentiles, queries per request and the share of
+    response cache lookups hit, None without lookups.
+    """
+    lookups = response_cache.stats().values()
+    before = [
+        sum(counts[result] for counts in lookups) for result in ["hits", "misses"]
+    ]
+    metrics.reset()
+    start = time.perf_counter()
+    latencies = sorted(load(requests, clients))
+    elapsed = time.perf_counter() - start
+    series = metrics.queries.series.values()
+    counted = sum(sum(counts) for counts, total in series)
+    lookups = response_cache.stats().values()
+    hits, misses = [
+        sum(counts[result] for counts in lookups) - count
+        for result, count in zip(["hits", "misses"], before)
+    ]
+    return {
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50": round(percentile(latencies, 0.5) * 1000, 2),
+        "p95": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99": round(percentile(latencies, 0.99) * 1000, 2),
+        "queries": round(sum(t for c, t in series) / counted, 2),
+        "hits": round(hits / (hits + misses), 2) if hits + misses else None,
+    }
+
+
+@scenario("api")
+def api(rows, repeat, stdout, concurrency, **options):
+    """
+    Load ``rows`` todos and their projects, users, comments and tags with
+    ``generate`` and measure every router endpoint with ``api_requests``,
+    through the test client or, with ``--live``, a local server.
+
+    Throughput, p50/p95/p99 latency and queries per request are reported
+    per operation and number of clients; creates run from one client, as
+    SQLite serializes writes. Reads are measured with the response cache
+    bypassed, then, as "cached", with it and the share of lookups it hit.
+    ``--save-baseline`` writes the results to a file and ``--baseline``
+    compares them to one measured with the same data and repeat, failing on
+    regressions, see ``regressions``.
+    benchmarks/api.json is the baseline of ``--rows 10000 --repeat 2
+    --concurrency 1``.
+    """
+    data = {
+        "users": options["users"],
+        "projects": options["projects"],
+        "members": options["members"],
+        "todos": rows,
+        "depth": options["depth"],
+        "comments": options["comments"],
+        "tags": options["tags"],
+    }
+    setup = {"data": data, "repeat": repeat}
+    baseline = None
+    if options["baseline"]:
+        with open(options["baseline"]) as file:
+            baseline = json.load(file)
+        if baseline["setup"] != setup:
+            raise ValueError(f"The baseline was measured with {baseline['setup']}.")
+
+    start = time.perf_counter()
+    user = generate(**data)
+    stdout.write(
+        f"{Todo.objects.count()} todos, {Comment.objects.count()} comments, "
+        f"{Project.objects.count()} projects generated in "
+        f"{time.perf_counter() - start:.1f} s"
+    )
+    headers = {"authorization": f"Token {Token.objects.create(user=user).key}"}
+    operations = api_requests(user, 20 * repeat, random.Random(0))
+
+    results = {}
+    stdout.write(
+        f"{'operation':<31} {'clients':>7} {'req/s':>8} {'p50 ms':>8} "
+        f"{'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'hits':>6}"
+    )
+    media = tempfile.TemporaryDirectory()
+    with ExitStack() as stack:
+        stack.enter_context(media)
+        stack.enter_context(
+            override_settings(
+                ROOT_URLCONF=api_urlconf(False),
+                DEBUG=False,
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "127.0.0.1"],
+                CACHES={
+                    **settings.CACHES,
+                    "benchmark-bypass": {
+                        "BACKEND": "django.core.cache.backends.dummy.DummyCache"
+                    },
+                },
+                MEDIA_ROOT=media.name,
+                IMPORT_IN_BACKGROUND=False,
+                # The flushing thread would lock the in-memory test database.
+                ACTIVITY_LOG_FLUSH_INTERVAL=None,
+            )
+        )
+        if options["live"]:
+            load = stack.enter_context(live_load(headers))
+        else:
+            load = client_load(headers)
+        for name, requests in operations:
+            writes = requests[0][0] != "GET"
+            for clients in [1] if writes else concurrency:
+                # Repeated reads would be answered by the response cache
+                # after the first: measure them without it, then with it.
+                runs = [(f"{name} x{clients}", "benchmark-bypass")]
+                if not writes:
+                    alias = getattr(settings, "RESPONSE_CACHE_ALIAS", "default")
+                    runs.append((f"{name} cached x{clients}", alias))
+                for label, alias in runs:
+                    with override_settings(RESPONSE_CACHE_ALIAS=alias):
+                        if not writes:
+                            # Warm the caches, which later requests of the run hit.
+                            load(requests[:5], 1)
+                        result = measure(load, requests, clients)
+                    if alias != "benchmark-bypass" and result["hits"] is None:
+                        # The endpoint does not cache its responses.
+                        continue
+                    results[label] = result
+                    hits = "-" if result["hits"] is None else f"{result['hits']:.0%}"
+                    stdout.write(
+                        f"{label:<31} {clients:>7} {result['rps']:>8.0f} "
+                        f"{result['p50']:>8.1f} {result['p95']:>8.1f} "
+                        f"{result['p99']:>8.1f} {result['queries']:>8.1f} "
+                        f"{hits:>6}"
+                    )
+        metrics.reset()
+
+    if options["save_baseline"]:
+        with open(options["save_baseline"], "w") as file:
+            json.dump({"setup": setup, "results": results}, file, indent=2)
+            file.write("\n")
+    if baseline is not None:
+        found = regressions(results, baseline["results"], options["tolerance"])
+        if found:
+            raise ValueError("Regressions against the baseline:\n" + "\n".join(found))
+        stdout.write("No regressions against the baseline.")
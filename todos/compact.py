@@ -0,0 +1,348 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models import F
+from django.urls import NoReverseMatch
+from rest_framework import negotiation, renderers, serializers
+from rest_framework.fields import empty
+from rest_framework.generics import get_object_or_404
+from rest_framework.relations import ManyRelatedField
+from rest_framework.response import Response
+from rest_framework.utils import encoders
+from rest_framework.utils.field_mapping import ClassLookupDict
+
+from .export import _converter
+from .instrumentation import serializing
+from .planner import _get_relation
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The serializer field ``ModelSerializer`` builds for each model field.
+_field_mapping = ClassLookupDict(serializers.ModelSerializer.serializer_field_mapping)
+
+
+class CompactJSONRenderer(renderers.BaseRenderer):
+    """
+    JSON for ``?format=compact`` and ``Accept: application/json;
+    profile=compact`` requests, encoded with orjson when it is installed.
+    """
+
+    media_type = "application/json; profile=compact"
+    format = "compact"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if orjson is None:
+            return json.dumps(
+                data,
+                cls=encoders.JSONEncoder,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            ).encode()
+        # Dates and times not rendered by serializer fields are formatted as
+        # ``JSONRenderer`` does.
+        return orjson.dumps(
+            data,
+            default=encoders.JSONEncoder().default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+        )
+
+
+class CompactContentNegotiation(negotiation.DefaultContentNegotiation):
+    """
+    Content negotiation selecting ``CompactJSONRenderer`` for the compact
+    format suffix or query parameter, which ``Accept: */*`` would not match.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        format = format_suffix or request.query_params.get(
+            self.settings.URL_FORMAT_OVERRIDE
+        )
+        if format == CompactJSONRenderer.format:
+            for renderer in renderers:
+                if isinstance(renderer, CompactJSONRenderer):
+                    return renderer, renderer.media_type
+        return super().select_renderer(request, renderers, format_suffix)
+
+
+class Unsupported(Exception):
+    """A serializer field ``CompactSerializer`` cannot reproduce."""
+
+
+class CompactSerializer:
+    """
+    Renders the representation of a bound ``HyperlinkedModelSerializer``
+    from ``values()`` rows, without model instances or field objects per row.
+
+    Hyperlinks are formatted from URL templates reversed once. To-many
+    hyperlinks and nested lists are read with one query per field for all
+    rows. Fields it cannot reproduce, such as method fields and dotted
+    sources, raise ``Unsupported``.
+    """
+
+    placeholder = "__lookup__"
+
+    def __init__(self, serializer, annotations=()):
+        self.model = serializer.Meta.model
+        self.request = serializer.context.get("request")
+        self.format = serializer.context.get("format")
+        self.annotations = annotations
+        self.columns = [field.attname for field in self.model._meta.concrete_fields]
+        self.pk = self.model._meta.pk.attname
+        self.fields = []
+        self.relations = []
+        for name, field in serializer.fields.items():
+            if not field.write_only:
+                getter = self.compile(name, field)
+                if getter is not None:
+                    self.fields.append((name, getter))
+
+    def compile(self, name, field):
+        """Return a function of ``(row, related)`` returning the field's value."""
+        if isinstance(field, serializers.HyperlinkedIdentityField):
+            column = self.attname(field.lookup_field, name)
+            link = self.link(field)
+            return lambda row, related: link(row[column])
+        if len(field.source_attrs) != 1:
+            raise Unsupported(name)
+        source = field.source_attrs[0]
+        try:
+            relation = _get_relation(self.model, source)
+        except FieldDoesNotExist:
+            if source in self.annotations or hasattr(self.model, source):
+                raise Unsupported(name)
+            if field.default is empty and not field.allow_null and not field.required:
+                # Serializers skip read-only fields missing from the object.
+                return None
+            raise Unsupported(name)
+
+        if isinstance(field, (ManyRelatedField, serializers.ListSerializer)):
+            self.relations.append((name, self.compile_many(name, field, relation)))
+            return lambda row, related: related[name].get(row[self.pk], [])
+        if isinstance(field, serializers.HyperlinkedRelatedField):
+            if not relation.concrete or not relation.target_field.primary_key:
+                raise Unsupported(name)
+            if field.lookup_field != "pk":
+                raise Unsupported(name)
+            column = relation.attname
+            link = self.link(field)
+            return lambda row, related: link(row[column])
+        if relation.is_relation or type(field) is not self.field_class(relation):
+            raise Unsupported(name)
+        column = relation.attname
+        if isinstance(relation, models.FileField):
+            convert = self.file_url(field, relation.storage)
+        else:
+            convert = _converter(relation)
+        if convert is None:
+            return lambda row, related: row[column]
+        return lambda row, related: (
+            None if row[column] is None else convert(row[column])
+        )
+
+    def compile_many(self, name, field, relation):
+        """Return a function fetching ``{row id: [values]}`` for ``ids``."""
+        if relation.many_to_many and relation.concrete:
+            query = relation.related_query_name()
+        elif relation.one_to_many or relation.many_to_many:
+            query = relation.field.name
+        else:
+            raise Unsupported(name)
+        manager = relation.related_model._default_manager
+
+        if isinstance(field, ManyRelatedField):
+            child = field.child_relation
+            if not isinstance(child, serializers.HyperlinkedRelatedField):
+                raise Unsupported(name)
+            if child.lookup_field != "pk":
+                raise Unsupported(name)
+            link = self.link(child)
+
+            def fetch(ids, using):
+                groups = {}
+                rows = manager.using(using).filter(**{f"{query}__in": ids})
+                for parent, pk in rows.values_list(query, "pk"):
+                    groups.setdefault(parent, []).append(link(pk))
+                return groups
+
+            return fetch
+
+        if not isinstance(field.child, serializers.ModelSerializer):
+            raise Unsupported(name)
+        nested = CompactSerializer(field.child)
+
+        def fetch(ids, using):
+            rows = list(
+                manager.using(using)
+                .filter(**{f"{query}__in": ids})
+                .values(*nested.columns, compact_parent=F(query))
+            )
+            groups = {}
+            for row, data in zip(rows, nested.to_representation(rows, using)):
+                groups.setdefault(row["compact_parent"], []).append(data)
+            return groups
+
+        return fetch
+
+    def attname(self, name, field_name):
+        if name == "pk":
+            return self.model._meta.pk.attname
+        try:
+            field = self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise Unsupported(field_name)
+        if not field.concrete:
+            raise Unsupported(field_name)
+        return field.attname
+
+    def field_class(self, model_field):
+        if model_field.choices:
+            return serializers.ChoiceField
+        try:
+            return _field_mapping[model_field]
+        except KeyError:
+            return None
+
+    def link(self, field):
+        """Return a function formatting the URL of ``field`` for a lookup value."""
+        format = self.format
+        if format and field.format and field.format != format:
+            format = field.format
+
+        def reverse(value):
+            return field.reverse(
+                field.view_name,
+                kwargs={field.lookup_url_kwarg: value},
+                request=self.request,
+                format=format,
+            )
+
+        try:
+            url = reverse(self.placeholder)
+        except NoReverseMatch:
+            # Patterns such as ``<int:pk>`` reject the placeholder.
+            return lambda value: None if value is None else reverse(value)
+        prefix, _, suffix = url.partition(self.placeholder)
+        return lambda value: None if value is None else f"{prefix}{value}{suffix}"
+
+    def file_url(self, field, storage):
+        use_url = getattr(field, "use_url", True)
+
+        def convert(name):
+            if not name:
+                return None
+            if not use_url:
+                return name
+            url = storage.url(name)
+            if self.request is None:
+                return url
+            return self.request.build_absolute_uri(url)
+
+        return convert
+
+    def values(self, queryset):
+        """Return ``queryset`` as the ``values()`` rows ``to_representation`` takes."""
+        return queryset.prefetch_related(None).values(*self.columns)
+
+    def instance(self, row, using):
+        """Build the model instance of ``row``, for object permissions."""
+        return self.model.from_db(using, list(row), [row[name] for name in row])
+
+    def to_representation(self, rows, using=None):
+        rows = list(rows)
+        ids = [row[self.pk] for row in rows]
+        with serializing():
+            related = {}
+            if ids:
+                for name, fetch in self.relations:
+                    related[name] = fetch(ids, using)
+            return [
+                {name: getter(row, related) for name, getter in self.fields}
+                for row in rows
+            ]
+
+
+class CompactMixin:
+    """
+    Serves ``list`` and ``retrieve`` in the compact format from ``values()``
+    rows with ``CompactSerializer``, rendered by ``CompactJSONRenderer``.
+
+    The compact format has the regular representation, ``?fields=``
+    included; it skips building model instances and reversing URLs per
+    object. ``?expand=`` requests and serializers ``CompactSerializer``
+    cannot reproduce are served by the regular serializer, still encoded
+    with the compact renderer.
+    """
+
+    compact_actions = ("list", "retrieve")
+    content_negotiation_class = CompactContentNegotiation
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if getattr(self, "action", None) in self.compact_actions:
+            # First, as the JSON renderer matches the compact media type too.
+            renderers.insert(0, CompactJSONRenderer())
+        return renderers
+
+    def get_compact_serializer(self, request):
+        """Return the ``CompactSerializer`` serving ``request``, if any."""
+        renderer = getattr(request, "accepted_renderer", None)
+        if not isinstance(renderer, CompactJSONRenderer):
+            return None
+        if "expand" in request.query_params:
+            return None
+        try:
+            return CompactSerializer(
+                self.get_serializer(), self.queryset.query.annotations
+            )
+        except Unsupported:
+            return None
+
+    def compact_list(self, compact):
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = compact.values(queryset)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(compact.to_representation(rows, queryset.db))
+        return self.get_paginated_response(compact.to_representation(page, queryset.db))
+
+    def compact_retrieve(self, compact):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(
+            compact.values(queryset),
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]},
+        )
+        self.check_object_permissions(self.request, compact.instance(row, queryset.db))
+        return Response(compact.to_representation([row], queryset.db)[0])
+
+    def list(self, request, *args, **kwargs):
+        compact = self.get_compact_serializer(request)
+        if compact is None:
+            return super().list(request, *args, **kwargs)
+        return self.compact_list(compact)
+
+    def retrieve(self, request, *args, **kwargs):
+        compact = self.get_compact_serializer(request)
+        if compact is None:
+            return super().retrieve(request, *args, **kwargs)
+        return self.compact_retrieve(compact)
+
+    async def alist(self, request, *args, **kwargs):
+        compact = self.get_compact_serializer(request)
+        if compact is None:
+            return await super().alist(request, *args, **kwargs)
+        return await sync_to_async(self.compact_list)(compact)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        compact = self.get_compact_serializer(request)
+        if compact is None:
+            return await super().aretrieve(request, *args, **kwargs)
+        return await sync_to_async(self.compact_retrieve)(compact)
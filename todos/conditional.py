@@ -0,0 +1,189 @@
+import hashlib
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+from .response_cache import response_cache
+from .sync import SYNC_MODELS, record
+
+
+class _Touches(dict):
+    """Primary keys to touch per model, flushed by its first ``on_commit`` call."""
+
+    def __init__(self, using):
+        super().__init__()
+        self.using = using
+        self.flushed = False
+
+    def __call__(self):
+        if self.flushed:
+            return
+        self.flushed = True
+        now = timezone.now()
+        with transaction.atomic(using=self.using):
+            for model, pks in self.items():
+                rows = model._base_manager.using(self.using).filter(pk__in=pks)
+                rows.update(updated_at=now)
+                if model in SYNC_MODELS:
+                    # Synced objects carry updated_at: clients must refetch them.
+                    changes = [
+                        (pk, project_id, False)
+                        for pk, project_id in rows.values_list("pk", "project_id")
+                    ]
+                    record(model, changes, using=self.using)
+        response_cache.invalidate(self, using=self.using)
+
+
+def touch(model, pks, using=None):
+    """
+    Bump ``updated_at`` of the ``model`` rows in ``pks`` once the current
+    transaction commits, so validators of representations nesting them
+    change. Touches are merged into one ``UPDATE`` per model, and recorded
+    for sync for synced models.
+    """
+    pks = {pk for pk in pks if pk is not None}
+    if not pks:
+        return
+    connection = transaction.get_connection(using)
+    # The batch is only referenced by its on_commit callbacks: rolling back
+    # the transaction discards them and frees it, so the next transaction
+    # starts a batch of its own.
+    pending = getattr(connection, "_pending_touches", lambda: None)()
+    if pending is None or pending.flushed:
+        pending = _Touches(connection.alias)
+        connection._pending_touches = weakref.ref(pending)
+    pending.setdefault(model, set()).update(pks)
+    # Scheduled in the current savepoint too, so the batch still flushes when
+    # the savepoint that scheduled it first rolls back. Rows touched by
+    # rolled back work are touched anyway, which is harmless.
+    transaction.on_commit(pending, using=connection.alias)
+
+
+class ConditionalGetMixin:
+    """
+    Adds validators driven by ``conditional_field`` to list and detail
+    responses.
+
+    Validators are computed with a cheap query before serialization: an
+    ``ETag`` and ``Last-Modified`` from the object's timestamp for details,
+    an ``ETag`` from the maximum timestamp and the row count of the filtered
+    queryset for lists. Lists get no ``Last-Modified``: their maximum
+    timestamp does not move when a row is deleted or drops out of the
+    filter. ``If-None-Match``/``If-Modified-Since`` are answered with 304
+    and a failing ``If-Match`` on updates with 412.
+    Views of models without ``conditional_field`` and ``?expand=`` requests,
+    whose nested objects are not covered by the timestamp, are left alone.
+    """
+
+    conditional_field = "updated_at"
+
+    def conditional_enabled(self, request):
+        fields = {field.name for field in self.queryset.model._meta.concrete_fields}
+        return self.conditional_field in fields and "expand" not in request.query_params
+
+    def get_validator_queryset(self):
+        return self.filter_queryset(self.get_queryset()).prefetch_related(None)
+
+    def make_etag(self, request, *parts):
+        media_type = getattr(request, "accepted_media_type", "")
+        label = self.queryset.model._meta.label
+        digest = hashlib.md5(
+            repr((label, media_type) + parts).encode(), usedforsecurity=False
+        )
+        return quote_etag(digest.hexdigest())
+
+    def list_validators(self, request):
+        aggregate = self.get_validator_queryset().aggregate(
+            last_modified=Max(self.conditional_field), count=Count("pk")
+        )
+        etag = self.make_etag(request, aggregate["last_modified"], aggregate["count"])
+        return etag, None
+
+    def detail_validators(self, request):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = (
+            self.get_validator_queryset()
+            .filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+            .values_list("pk", self.conditional_field)
+            .first()
+        )
+        if row is None:
+            return None, None
+        return self.make_etag(request, *row), row[1]
+
+    def set_validators(self, response, validators):
+        etag, last_modified = validators
+        if etag is not None:
+            response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified.timestamp())
+        return response
+
+    def evaluate_preconditions(self, request, validators):
+        """Return a 304/412 response when the request's preconditions say so."""
+        etag, last_modified = validators
+        if etag is None:
+            return None
+        response = get_conditional_response(
+            request._request,
+            etag=etag,
+            last_modified=last_modified.timestamp() if last_modified else None,
+        )
+        if response is not None and response.status_code == 304:
+            self.set_validators(response, validators)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if not self.conditional_enabled(request):
+            return super().list(request, *args, **kwargs)
+        validators = self.list_validators(request)
+        response = self.evaluate_preconditions(request, validators)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+            self.set_validators(response, validators)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.conditional_enabled(request):
+            return super().retrieve(request, *args, **kwargs)
+        validators = self.detail_validators(request)
+        response = self.evaluate_preconditions(request, validators)
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+            self.set_validators(response, validators)
+        return response
+
+    async def alist(self, request, *args, **kwargs):
+        if not self.conditional_enabled(request):
+            return await super().alist(request, *args, **kwargs)
+        validators = await sync_to_async(self.list_validators)(request)
+        response = self.evaluate_preconditions(request, validators)
+        if response is None:
+            response = await super().alist(request, *args, **kwargs)
+            self.set_validators(response, validators)
+        return response
+
+    async def aretrieve(self, request, *args, **kwargs):
+        if not self.conditional_enabled(request):
+            return await super().aretrieve(request, *args, **kwargs)
+        validators = await sync_to_async(self.detail_validators)(request)
+        response = self.evaluate_preconditions(request, validators)
+        if response is None:
+            response = await super().aretrieve(request, *args, **kwargs)
+            self.set_validators(response, validators)
+        return response
+
+    def update(self, request, *args, **kwargs):
+        if not self.conditional_enabled(request):
+            return super().update(request, *args, **kwargs)
+        response = self.evaluate_preconditions(request, self.detail_validators(request))
+        if response is None:
+            response = super().update(request, *args, **kwargs)
+            if response.status_code == 200:
+                self.set_validators(response, self.detail_validators(request))
+        return response
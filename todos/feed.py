@@ -0,0 +1,333 @@
+import asyncio
+import collections
+import json
+import re
+import secrets
+import threading
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+from rest_framework import renderers
+
+from .export import _converter
+from .membership import project_id_of
+from .models import Attachment, Comment, Milestone, Todo
+
+# Fields sent with the events of each model, keyed by the event's prefix.
+FEED_MODELS = {
+    Todo: (
+        "todo",
+        [
+            "id",
+            "title",
+            "completed",
+            "user",
+            "project",
+            "category",
+            "milestone",
+            "parent_task",
+            "priority",
+            "due_date",
+            "updated_at",
+        ],
+    ),
+    Comment: ("comment", ["id", "todo", "user", "content", "created_at"]),
+    Attachment: ("attachment", ["id", "todo", "uploaded_by", "file", "uploaded_at"]),
+    Milestone: ("milestone", ["id", "project", "name", "due_date"]),
+}
+
+
+def snapshot(instance, fields):
+    """Return the JSON-compatible values of ``fields``, relations as keys."""
+    data = {}
+    for name in fields:
+        field = instance._meta.get_field(name)
+        value = getattr(instance, field.attname)
+        if field.get_internal_type() == "FileField":
+            value = value.name or None
+        else:
+            # Values assigned before the save, such as a date as a string,
+            # are not converted by it.
+            value = field.to_python(value)
+        convert = _converter(field)
+        data[name] = convert(value) if convert and value is not None else value
+    return data
+
+
+class Subscription:
+    """
+    The events of one project for one client, in order.
+
+    Events are delivered from the publishing threads and consumed with
+    ``wait`` by a thread or with ``wait_async`` by an event loop. A client
+    falling ``FEED_QUEUE_SIZE`` events behind is marked ``overflowed`` and
+    should reconnect, resuming from its last event.
+    """
+
+    def __init__(self, project_id, maxsize):
+        self.project_id = project_id
+        self.maxsize = maxsize
+        self.overflowed = False
+        self._events = collections.deque()
+        self._ready = threading.Condition()
+        self._loop = self._wakeup = None
+
+    def bind_loop(self):
+        """Wake the running event loop on new events, for ``wait_async``."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
+    def deliver(self, event):
+        with self._ready:
+            if len(self._events) >= self.maxsize:
+                self.overflowed = True
+            else:
+                self._events.append(event)
+            self._ready.notify()
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                # The loop closed with its client.
+                pass
+
+    def drain(self):
+        with self._ready:
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+    def wait(self, timeout):
+        """Return the pending events, waiting up to ``timeout`` for one."""
+        with self._ready:
+            self._ready.wait_for(lambda: self._events or self.overflowed, timeout)
+        return self.drain()
+
+    async def wait_async(self, timeout):
+        # Events delivered before the loop was bound, or since the last
+        # wakeup, are pending without waking it again.
+        self._wakeup.clear()
+        events = self.drain()
+        if events or self.overflowed:
+            return events
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.drain()
+
+
+class InProcessBroker:
+    """
+    Fans events out to the subscribers of their project in this process.
+
+    Events get ids ``<epoch>-<sequence>``, increasing within the process,
+    and the last ``FEED_HISTORY`` events of each project are kept so that
+    reconnecting clients are sent what they missed. An id from another
+    process or older than the history cannot be resumed from.
+    """
+
+    def __init__(self):
+        self.epoch = secrets.token_hex(4)
+        self._sequence = 0
+        self._history = {}
+        # Sequence of the newest event each project's history dropped.
+        self._trimmed = {}
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    @property
+    def history_size(self):
+        return getattr(settings, "FEED_HISTORY", 1000)
+
+    @property
+    def queue_size(self):
+        return getattr(settings, "FEED_QUEUE_SIZE", 1000)
+
+    def publish(self, project_id, type, data):
+        with self._lock:
+            self._sequence += 1
+            event = (self._sequence, f"{self.epoch}-{self._sequence}", type, data)
+            history = self._history.get(project_id)
+            if history is None:
+                history = self._history[project_id] = collections.deque(
+                    maxlen=self.history_size
+                )
+            if len(history) == history.maxlen:
+                self._trimmed[project_id] = history[0][0]
+            history.append(event)
+            for subscription in self._subscribers.get(project_id, ()):
+                subscription.deliver(event[1:])
+
+    def subscribe(self, project_id, last_event_id=None):
+        """
+        Return a ``Subscription`` to the events of ``project_id`` and the
+        events after ``last_event_id``, or None when they are not all known.
+        """
+        subscription = Subscription(project_id, self.queue_size)
+        with self._lock:
+            missed = []
+            if last_event_id:
+                epoch, _, sequence = last_event_id.partition("-")
+                if (
+                    epoch != self.epoch
+                    or not re.fullmatch(r"[0-9]+", sequence)
+                    or int(sequence) > self._sequence
+                    or int(sequence) < self._trimmed.get(project_id, 0)
+                ):
+                    missed = None
+                else:
+                    missed = [
+                        event[1:]
+                        for event in self._history.get(project_id, ())
+                        if event[0] > int(sequence)
+                    ]
+            self._subscribers.setdefault(project_id, set()).add(subscription)
+        return subscription, missed
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.project_id, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.project_id, None)
+
+
+broker = SimpleLazyObject(
+    lambda: import_string(
+        getattr(settings, "FEED_BROKER", "todos.feed.InProcessBroker")
+    )()
+)
+
+
+def publish(instance, action, project_ids=None, using=None):
+    """
+    Publish the ``action`` ("created", "updated" or "deleted") of a model
+    instance to the feeds of ``project_ids``, by default its project's, once
+    the current transaction commits.
+    """
+    projects = None if project_ids is None else [project_ids]
+    publish_many(type(instance), [instance], action, projects, using=using)
+
+
+def publish_many(model, instances, action, projects=None, using=None):
+    """``publish`` for many instances; ``projects`` holds their project ids."""
+    prefix, fields = FEED_MODELS[model]
+    if projects is None:
+        projects = [{project_id_of(instance)} for instance in instances]
+    type = f"{prefix}.{action}"
+    events = [
+        (project_ids, snapshot(instance, fields))
+        for instance, project_ids in zip(instances, projects)
+    ]
+
+    def send():
+        for project_ids, data in events:
+            for project_id in project_ids:
+                broker.publish(project_id, type, data)
+
+    transaction.on_commit(send, using=using)
+
+
+def sse(id=None, event=None, data=None, comment=None, retry=None):
+    """Format one Server-Sent Events message."""
+    lines = []
+    if comment is not None:
+        lines.append(f": {comment}")
+    if retry is not None:
+        lines.append(f"retry: {retry}")
+    if id is not None:
+        lines.append(f"id: {id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    if data is not None:
+        lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+class EventStreamRenderer(renderers.BaseRenderer):
+    """Server-Sent Events. Feeds stream their events; this renders errors."""
+
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return sse(event="error", data=data).encode()
+
+
+class EventFeed:
+    """
+    Streams the events of a project to one client as Server-Sent Events.
+
+    The stream opens with the events after ``last_event_id``, or with a
+    ``reset`` event when they cannot be replayed and the client should
+    refetch. A comment is sent every ``FEED_HEARTBEAT`` seconds without
+    events so proxies keep the connection open. The stream ends when the
+    client falls too far behind; ``EventSource`` then reconnects with the
+    ``Last-Event-ID`` header and resumes.
+    """
+
+    def __init__(self, project_id, last_event_id=None):
+        self.project_id = project_id
+        self.last_event_id = last_event_id
+
+    @property
+    def heartbeat(self):
+        return getattr(settings, "FEED_HEARTBEAT", 15)
+
+    def opening(self, missed):
+        yield sse(retry=getattr(settings, "FEED_RETRY", 3000), comment="feed")
+        if missed is None:
+            yield sse(event="reset", data={"project": self.project_id})
+        else:
+            yield from self.messages(missed)
+
+    def messages(self, events):
+        for id, type, data in events:
+            yield sse(id=id, event=type, data=data)
+
+    def __iter__(self):
+        subscription, missed = broker.subscribe(self.project_id, self.last_event_id)
+        try:
+            yield from self.opening(missed)
+            while not subscription.overflowed:
+                events = subscription.wait(self.heartbeat)
+                yield "".join(self.messages(events)) or sse(comment="heartbeat")
+        finally:
+            broker.unsubscribe(subscription)
+
+    async def __aiter__(self):
+        subscription, missed = broker.subscribe(self.project_id, self.last_event_id)
+        try:
+            subscription.bind_loop()
+            for message in self.opening(missed):
+                yield message
+            while not subscription.overflowed:
+                events = await subscription.wait_async(self.heartbeat)
+                yield "".join(self.messages(events)) or sse(comment="heartbeat")
+        finally:
+            broker.unsubscribe(subscription)
+
+
+def feed_response(request, project_id):
+    """
+    Return a streaming response of the feed of ``project_id``, served from
+    the event loop under ASGI and from the request's thread under WSGI.
+    """
+    last_event_id = request.META.get("HTTP_LAST_EVENT_ID") or request.GET.get(
+        "last_event_id"
+    )
+    feed = EventFeed(project_id, last_event_id)
+    stream = aiter(feed) if isinstance(request, ASGIRequest) else iter(feed)
+    response = StreamingHttpResponse(
+        stream, content_type=f"{EventStreamRenderer.media_type}; charset=utf-8"
+    )
+    response["Cache-Control"] = "no-cache"
+    # Keeps nginx from buffering the stream.
+    response["X-Accel-Buffering"] = "no"
+    return response
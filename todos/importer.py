@@ -0,0 +1,305 @@
+import codecs
+import csv
+import itertools
+import json
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework import serializers
+
+from .activity import activity_log
+from .models import Category, ImportJob, Milestone, Tag, Todo
+from .serializers import TodoImportRowSerializer
+from .signals import containers_bulk_created, todos_bulk_created
+
+logger = logging.getLogger(__name__)
+
+
+def decoded_lines(file):
+    """
+    Yield the lines of the binary ``file`` decoded as UTF-8, bytes that are
+    not escaped as lone surrogates, so one bad byte spoils only its row.
+    """
+    for number, line in enumerate(iter(file.readline, b"")):
+        if number == 0 and line.startswith(codecs.BOM_UTF8):
+            line = line[len(codecs.BOM_UTF8) :]
+        yield line.decode("utf-8", "surrogateescape")
+
+
+def is_valid_text(*texts):
+    try:
+        for text in texts:
+            text.encode("utf-8")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def read_rows(file, format):
+    """
+    Yield the rows of the binary ``file`` as dicts, one at a time, and a
+    ``ValueError`` in place of each unreadable row.
+    """
+    lines = decoded_lines(file)
+    if format == "csv":
+        for row in csv.DictReader(lines):
+            # Empty cells stand for absent values.
+            row = {
+                name: value
+                for name, value in row.items()
+                if name is not None and value not in ("", None)
+            }
+            valid = is_valid_text(*row, *row.values())
+            yield row if valid else ValueError("Invalid UTF-8.")
+        return
+    for line in lines:
+        if not line.strip():
+            continue
+        if not is_valid_text(line):
+            yield ValueError("Invalid UTF-8.")
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield ValueError(f"Invalid JSON: {exc}")
+            continue
+        yield row if isinstance(row, dict) else ValueError("Expected a JSON object.")
+
+
+class Superseded(Exception):
+    """Another worker claimed the job after this one."""
+
+
+def claimable(now=None):
+    """
+    The jobs ``claim`` may take: those not completed and not run by another
+    worker, which bumps ``updated_at`` with every chunk.
+    """
+    now = now or timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, "IMPORT_STALE_AFTER", 300))
+    return Q(status__in=["PENDING", "FAILED"]) | Q(
+        status="RUNNING", updated_at__lt=stale
+    )
+
+
+def claim(job):
+    """
+    Mark ``job`` as running if it is ``claimable``. Return whether it was
+    claimed.
+
+    Every claim bumps ``attempt``, so a worker whose claim went stale and was
+    taken over can no longer write progress, see ``update_job``.
+    """
+    now = timezone.now()
+    claimed = ImportJob.objects.filter(claimable(now), pk=job.pk).update(
+        status="RUNNING", failure="", attempt=F("attempt") + 1, updated_at=now
+    )
+    return claimed == 1
+
+
+def update_job(job, fields):
+    """
+    Write ``fields`` of ``job`` unless another worker claimed it since, in
+    which case raise ``Superseded``; in a transaction, the work written
+    with the progress is rolled back.
+    """
+    job.updated_at = timezone.now()
+    values = {name: getattr(job, name) for name in [*fields, "updated_at"]}
+    updated = ImportJob.objects.filter(pk=job.pk, attempt=job.attempt).update(**values)
+    if not updated:
+        raise Superseded(f"Import {job.pk} was claimed by another worker.")
+
+
+class TodoImporter:
+    """
+    Imports the rows of an ``ImportJob`` file into its project.
+
+    The file is streamed and handled in chunks of ``IMPORT_CHUNK_SIZE`` rows:
+    rows are validated together, categories, milestones and tags are
+    resolved by name through in-memory lookup tables (missing ones are
+    created in bulk) and the valid todos and their tags are inserted with
+    ``bulk_create``. Each chunk commits together with the job's progress, so
+    an interrupted import resumes after the last committed chunk. Invalid
+    rows are counted and the first ``IMPORT_MAX_ERRORS`` are reported with
+    their row number.
+    """
+
+    def __init__(self, job, chunk_size=None):
+        self.job = job
+        self.chunk_size = chunk_size or getattr(settings, "IMPORT_CHUNK_SIZE", 1000)
+        self.max_errors = getattr(settings, "IMPORT_MAX_ERRORS", 1000)
+        # One bound serializer validates every row, its fields built once.
+        self.serializer = TodoImportRowSerializer()
+
+    def run(self):
+        """
+        Import the rows not processed yet; False if the job was not claimed,
+        or was claimed by another worker midway.
+        """
+        if not claim(self.job):
+            return False
+        self.job.refresh_from_db()
+        # Lookup tables of names to primary keys, filled as names come up.
+        project = self.job.project_id
+        self.tags = {}
+        self.categories = dict(
+            Category.objects.filter(project=project).values_list("name", "pk")
+        )
+        self.milestones = dict(
+            Milestone.objects.filter(project=project).values_list("name", "pk")
+        )
+        try:
+            with self.job.file.open("rb") as file:
+                rows = read_rows(file, self.job.format)
+                skipped = self.job.rows_processed
+                numbered = enumerate(itertools.islice(rows, skipped, None), skipped + 1)
+                while chunk := list(itertools.islice(numbered, self.chunk_size)):
+                    self.import_chunk(chunk)
+            self.job.status = "COMPLETED"
+            update_job(self.job, ["status"])
+        except Superseded:
+            logger.warning("Import %s was taken over by another worker", self.job.pk)
+            return False
+        except Exception as exc:
+            logger.exception("Import %s failed", self.job.pk)
+            self.job.status, self.job.failure = "FAILED", str(exc)
+            try:
+                update_job(self.job, ["status", "failure"])
+            except Superseded:
+                return False
+            return True
+        activity_log.record(self.job.user_id, "imported", f"ImportJob: {self.job.pk}")
+        return True
+
+    def import_chunk(self, chunk):
+        errors, valid = [], []
+        for number, row in chunk:
+            if isinstance(row, ValueError):
+                errors.append({"row": number, "errors": [str(row)]})
+                continue
+            try:
+                valid.append((number, self.serializer.run_validation(row)))
+            except serializers.ValidationError as exc:
+                errors.append({"row": number, "errors": exc.detail})
+
+        with transaction.atomic():
+            valid = self.resolve(valid, errors)
+            todos = [
+                Todo(user_id=self.job.user_id, project_id=self.job.project_id, **attrs)
+                for _, attrs, _ in valid
+            ]
+            Todo.objects.bulk_create(todos)
+            Through = Todo.tags.through
+            Through.objects.bulk_create(
+                Through(todo_id=todo.pk, tag_id=tag)
+                for todo, (_, _, tags) in zip(todos, valid)
+                for tag in tags
+            )
+            todos_bulk_created(todos)
+            errors.sort(key=lambda error: error["row"])
+            job = self.job
+            job.rows_processed += len(chunk)
+            job.created_count += len(todos)
+            job.error_count += len(errors)
+            job.errors.extend(errors[: max(self.max_errors - len(job.errors), 0)])
+            update_job(
+                job, ["rows_processed", "created_count", "error_count", "errors"]
+            )
+
+    def resolve(self, valid, errors):
+        """
+        Replace names by primary keys, creating missing objects, and return
+        ``(row number, todo attributes, tag ids)`` of the rows still valid.
+        """
+        project = self.job.project_id
+        new_categories = {
+            attrs["category"]
+            for _, attrs in valid
+            if "category" in attrs and attrs["category"] not in self.categories
+        }
+        created = Category.objects.bulk_create(
+            Category(name=name, project_id=project) for name in sorted(new_categories)
+        )
+        self.categories.update((category.name, category.pk) for category in created)
+        containers_bulk_created(Category, created)
+
+        new_milestones = {}
+        for _, attrs in valid:
+            name = attrs.get("milestone")
+            if name in self.milestones or "milestone_due_date" not in attrs:
+                continue
+            if name is not None:
+                new_milestones.setdefault(name, attrs["milestone_due_date"])
+        created = Milestone.objects.bulk_create(
+            Milestone(name=name, due_date=due_date, project_id=project)
+            for name, due_date in sorted(new_milestones.items())
+        )
+        self.milestones.update((milestone.name, milestone.pk) for milestone in created)
+        containers_bulk_created(Milestone, created)
+
+        names = {name for _, attrs in valid for name in attrs["tags"]}
+        missing = names - set(self.tags)
+        if missing:
+            for pk, name in Tag.objects.filter(name__in=missing).values_list(
+                "pk", "name"
+            ):
+                self.tags.setdefault(name, pk)
+            created = Tag.objects.bulk_create(
+                Tag(name=name) for name in sorted(missing - set(self.tags))
+            )
+            self.tags.update((tag.name, tag.pk) for tag in created)
+
+        resolved = []
+        for number, attrs in valid:
+            attrs = dict(attrs)
+            attrs.pop("milestone_due_date", None)
+            tags = {self.tags[name] for name in attrs.pop("tags")}
+            if "category" in attrs:
+                attrs["category_id"] = self.categories[attrs.pop("category")]
+            if "milestone" in attrs:
+                name = attrs.pop("milestone")
+                if name not in self.milestones:
+                    errors.append(
+                        {
+                            "row": number,
+                            "errors": {
+                                "milestone": [
+                                    f"Unknown milestone {name!r}; give "
+                                    "milestone_due_date to create it."
+                                ]
+                            },
+                        }
+                    )
+                    continue
+                attrs["milestone_id"] = self.milestones[name]
+            resolved.append((number, attrs, sorted(tags)))
+        return resolved
+
+
+def start_import(job):
+    """
+    Run ``job`` in a background thread once the current transaction commits,
+    or right away when ``IMPORT_IN_BACKGROUND`` is False.
+    """
+    if not getattr(settings, "IMPORT_IN_BACKGROUND", True):
+        TodoImporter(job).run()
+        return
+
+    def run():
+        try:
+            TodoImporter(ImportJob.objects.get(pk=job.pk)).run()
+        except Exception:
+            logger.exception("Import %s failed", job.pk)
+        finally:
+            connection.close()
+
+    transaction.on_commit(
+        lambda: threading.Thread(
+            target=run, name=f"import-{job.pk}", daemon=True
+        ).start()
+    )
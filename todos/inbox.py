@@ -0,0 +1,120 @@
+import itertools
+from datetime import datetime, time, timedelta
+
+from django.db import router
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import InboxEntry, Todo
+
+# Numbers ordering priorities, most urgent highest.
+PRIORITY_RANKS = {"LOW": 1, "MEDIUM": 2, "HIGH": 3, "URGENT": 4}
+BUCKETS = ["overdue", "today", "upcoming", "someday"]
+ORDERING = ["someday", "due_date", "-priority", "todo"]
+# Todo columns an inbox entry is built from.
+TRACKED = ["user_id", "completed", "priority", "due_date"]
+
+
+def _changed(todo, created):
+    if created:
+        return True
+    return any(
+        todo.loaded_value(name, getattr(todo, name)) != getattr(todo, name)
+        for name in TRACKED
+    )
+
+
+def entry(todo):
+    return InboxEntry(
+        todo_id=todo.pk,
+        user_id=todo.user_id,
+        due_date=todo.due_date,
+        someday=todo.due_date is None,
+        priority=PRIORITY_RANKS.get(todo.priority, 0),
+    )
+
+
+def record(todos, created=False, using=None):
+    """
+    Bring the inbox entries of saved ``todos`` in line with them: open todos
+    have one in their user's inbox, completed todos none. Todos whose
+    tracked values did not change cost no query, others one ``DELETE`` or
+    upsert for all of them. Deleted todos take their entries along.
+    """
+    todos = [todo for todo in todos if _changed(todo, created)]
+    if not todos:
+        return
+    using = using or router.db_for_write(InboxEntry)
+    entries = InboxEntry._base_manager.using(using)
+    completed = [todo.pk for todo in todos if todo.completed]
+    if completed and not created:
+        entries.filter(pk__in=completed).delete()
+    entries.bulk_create(
+        [entry(todo) for todo in todos if not todo.completed],
+        update_conflicts=True,
+        unique_fields=["todo"],
+        update_fields=["user", "due_date", "someday", "priority"],
+    )
+
+
+def rebuild(users=None, using=None, batch_size=1000):
+    """
+    Recreate the inbox entries of the ``users`` ids, of every user if None,
+    from their open todos, for todos changed without signals.
+    """
+    using = using or router.db_for_write(InboxEntry)
+    entries = InboxEntry._base_manager.using(using)
+    todos = Todo._base_manager.using(using).filter(completed=False)
+    if users is not None:
+        entries = entries.filter(user__in=users)
+        todos = todos.filter(user__in=users)
+    entries.delete()
+    rows = todos.only("pk", *TRACKED).order_by("pk").iterator(chunk_size=batch_size)
+    count = 0
+    while batch := [entry(todo) for todo in itertools.islice(rows, batch_size)]:
+        count += len(InboxEntry._base_manager.using(using).bulk_create(batch))
+    return count
+
+
+class Buckets:
+    """
+    The bounds of the inbox buckets at ``now``: ``overdue`` todos were due
+    before now, ``today`` todos are due by midnight in ``tz``, ``upcoming``
+    todos later and ``someday`` todos have no due date.
+    """
+
+    def __init__(self, now=None, tz=None):
+        self.now = now or timezone.now()
+        tz = tz or timezone.get_current_timezone()
+        tomorrow = timezone.localtime(self.now, tz).date() + timedelta(days=1)
+        self.midnight = datetime.combine(tomorrow, time(), tzinfo=tz)
+
+    def filters(self):
+        return {
+            "overdue": Q(someday=False, due_date__lt=self.now),
+            "today": Q(
+                someday=False, due_date__gte=self.now, due_date__lt=self.midnight
+            ),
+            "upcoming": Q(someday=False, due_date__gte=self.midnight),
+            "someday": Q(someday=True),
+        }
+
+    def bucket(self, entry):
+        if entry.someday:
+            return "someday"
+        if entry.due_date < self.now:
+            return "overdue"
+        return "today" if entry.due_date < self.midnight else "upcoming"
+
+    def entries(self, user, bucket=None):
+        """Return the ordered entries of ``user``, of ``bucket`` if set."""
+        entries = InboxEntry.objects.filter(user=user)
+        if bucket is not None:
+            entries = entries.filter(self.filters()[bucket])
+        return entries.order_by(*ORDERING)
+
+    def counts(self, user):
+        """Return the number of entries of ``user`` per bucket, in one query."""
+        return InboxEntry.objects.filter(user=user).aggregate(
+            **{name: Count("pk", filter=q) for name, q in self.filters().items()}
+        )
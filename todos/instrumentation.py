@@ -0,0 +1,381 @@
+import bisect
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .authentication import token_cache
+from .response_cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (2**8, 2**10, 2**12, 2**14, 2**16, 2**18, 2**20, 2**22, 2**24)
+
+# The ``RequestStats`` of the request being handled, in its thread or task.
+_current = ContextVar("todos_request_stats", default=None)
+
+
+class RequestStats:
+    """What the handling of a request spent, collected while it runs."""
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.statements = Counter()
+        self.serializer_time = 0.0
+        self.serializing = False
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper, see ``connection.execute_wrapper``, counting and timing
+    the queries of the current request. ``todos.signals`` installs it on
+    every connection.
+    """
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - start
+        stats.statements[sql] += 1
+
+
+@contextmanager
+def serializing():
+    """Add the time spent in the block to the current request's serializer time."""
+    stats = _current.get()
+    if stats is None or stats.serializing:
+        # Nested serializers are timed by the outermost one.
+        yield
+        return
+    stats.serializing = True
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_time += time.perf_counter() - start
+        stats.serializing = False
+
+
+class SerializerTimingMixin:
+    """Counts the time serializers spend in ``to_representation`` per request."""
+
+    def to_representation(self, instance):
+        with serializing():
+            return super().to_representation(instance)
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _labels(labels, **extra):
+    pairs = [*labels, *extra.items()]
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+
+
+class CounterMetric:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.series = Counter()
+
+    def inc(self, labels, amount=1):
+        self.series[labels] += amount
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self.series.items()):
+            yield f"{self.name}{{{_labels(labels)}}} {value}"
+
+
+class HistogramMetric:
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0]
+        # Buckets count the values less than or equal to their bound.
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += count
+                yield f"{self.name}_bucket{{{_labels(labels, le=bound)}}} {cumulative}"
+            yield f"{self.name}_sum{{{_labels(labels)}}} {total}"
+            yield f"{self.name}_count{{{_labels(labels)}}} {cumulative}"
+
+
+class Metrics:
+    """
+    The request metrics of this process, per route and method, and the hit
+    counters of the response and token caches, exposed by ``metrics_view``
+    in the Prometheus text format. Every process exposes its own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = CounterMetric(
+                "todos_http_requests_total", "Requests handled."
+            )
+            self.latency = HistogramMetric(
+                "todos_http_request_duration_seconds",
+                "Time to handle a request.",
+                LATENCY_BUCKETS,
+            )
+            self.queries = HistogramMetric(
+                "todos_http_request_queries",
+                "Database queries run by a request.",
+                QUERY_BUCKETS,
+            )
+            self.query_time = HistogramMetric(
+                "todos_http_request_query_duration_seconds",
+                "Time a request spent in database queries.",
+                LATENCY_BUCKETS,
+            )
+            self.serializer_time = HistogramMetric(
+                "todos_http_request_serializer_duration_seconds",
+                "Time a request spent in serializers.",
+                LATENCY_BUCKETS,
+            )
+            self.response_size = HistogramMetric(
+                "todos_http_response_size_bytes",
+                "Size of response bodies of known length.",
+                SIZE_BUCKETS,
+            )
+            self.repeated_queries = CounterMetric(
+                "todos_http_repeated_queries_total",
+                "Requests running an identical query repeatedly, N+1 patterns.",
+            )
+            self.profiles = CounterMetric(
+                "todos_http_profiles_total", "Slow requests profiled."
+            )
+
+    def record(self, route, method, status, duration, stats, size=None):
+        labels = (("route", route), ("method", method))
+        with self._lock:
+            self.requests.inc((*labels, ("status", str(status))))
+            self.latency.observe(labels, duration)
+            self.queries.observe(labels, stats.queries)
+            self.query_time.observe(labels, stats.query_time)
+            self.serializer_time.observe(labels, stats.serializer_time)
+            if size is not None:
+                self.response_size.observe(labels, size)
+
+    def caches(self):
+        responses = CounterMetric(
+            "todos_response_cache_requests_total", "Response cache lookups."
+        )
+        for namespace, counts in response_cache.stats().items():
+            responses.inc((("namespace", namespace), ("result", "hit")), counts["hits"])
+            responses.inc(
+                (("namespace", namespace), ("result", "miss")), counts["misses"]
+            )
+        tokens = CounterMetric(
+            "todos_token_cache_requests_total", "Token cache lookups."
+        )
+        counts = token_cache.stats()
+        tokens.inc((("result", "hit"),), counts["hits"])
+        tokens.inc((("result", "miss"),), counts["misses"])
+        return [responses, tokens]
+
+    def expose(self):
+        with self._lock:
+            metrics = [
+                self.requests,
+                self.latency,
+                self.queries,
+                self.query_time,
+                self.serializer_time,
+                self.response_size,
+                self.repeated_queries,
+                self.profiles,
+            ]
+            lines = [line for metric in metrics for line in metric.expose()]
+        lines.extend(line for metric in self.caches() for line in metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def route_of(request):
+    """The name of the URL pattern ``request`` matched, its metrics label."""
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.view_name or match._func_path
+
+
+def response_size(response):
+    if response.has_header("Content-Length"):
+        return int(response["Content-Length"])
+    if response.streaming:
+        return None
+    return len(response.content)
+
+
+class InstrumentationMiddleware:
+    """
+    Records the latency, database queries and query time, serializer time
+    and response size of each request in ``metrics``, per route.
+
+    A query run ``INSTRUMENTATION_REPEATED_QUERIES`` times or more by one
+    request, the N+1 pattern, is logged with the route running it. Sync
+    requests are sampled at ``INSTRUMENTATION_PROFILE_RATE`` to run under
+    cProfile; the profiles of those slower than
+    ``INSTRUMENTATION_PROFILE_THRESHOLD`` seconds are written to
+    ``INSTRUMENTATION_PROFILE_DIR``, or logged when it is not set. Async
+    requests share the event loop's thread, so they are not profiled.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        profiler = self.start_profiler()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+            _current.reset(token)
+        self.finish(request, response, stats, duration, profiler)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            duration = time.perf_counter() - start
+            _current.reset(token)
+        self.finish(request, response, stats, duration)
+        return response
+
+    def start_profiler(self):
+        rate = getattr(settings, "INSTRUMENTATION_PROFILE_RATE", 0)
+        if not rate or random.random() >= rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active in this thread.
+            return None
+        return profiler
+
+    def finish(self, request, response, stats, duration, profiler=None):
+        route = route_of(request)
+        metrics.record(
+            route,
+            request.method,
+            response.status_code,
+            duration,
+            stats,
+            response_size(response),
+        )
+        threshold = getattr(settings, "INSTRUMENTATION_REPEATED_QUERIES", 10)
+        repeated = [
+            (sql, count)
+            for sql, count in stats.statements.items()
+            if threshold and count >= threshold
+        ]
+        if repeated:
+            metrics.repeated_queries.inc((("route", route), ("method", request.method)))
+        for sql, count in repeated:
+            logger.warning(
+                "%s %s (%s) ran a query %d times: %s",
+                request.method,
+                route,
+                request.path,
+                count,
+                sql,
+            )
+        slow = getattr(settings, "INSTRUMENTATION_PROFILE_THRESHOLD", 1.0)
+        if profiler is not None and duration >= slow:
+            self.save_profile(profiler, request, route, duration)
+
+    def save_profile(self, profiler, request, route, duration):
+        metrics.profiles.inc((("route", route), ("method", request.method)))
+        directory = getattr(settings, "INSTRUMENTATION_PROFILE_DIR", None)
+        if directory:
+            name = re.sub(r"[^\w.-]+", "_", f"{route}-{request.method}")
+            path = os.path.join(
+                directory, f"{time.strftime('%Y%m%dT%H%M%S')}-{name}-{os.getpid()}.prof"
+            )
+            profiler.dump_stats(path)
+            logger.info("Profiled %s %s in %s", request.method, route, path)
+            return
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(25)
+        logger.warning(
+            "Profile of %s %s (%s), %.0f ms:\n%s",
+            request.method,
+            route,
+            request.path,
+            duration * 1000,
+            out.getvalue(),
+        )
+
+
+def metrics_view(request):
+    """
+    ``metrics`` in the Prometheus text format, for staff users and requests
+    with an ``Authorization: Bearer <METRICS_TOKEN>`` header.
+    """
+    token = getattr(settings, "METRICS_TOKEN", None)
+    header = request.headers.get("Authorization", "")
+    authorized = token and hmac.compare_digest(header, f"Bearer {token}")
+    if not authorized and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        metrics.expose(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
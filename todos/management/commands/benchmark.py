@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from todos.benchmarks import SCENARIOS
+
+
+class Command(BaseCommand):
+    help = "Run a benchmark scenario against a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenario", choices=sorted(SCENARIOS))
+        parser.add_argument("--rows", type=int, default=100000)
+        parser.add_argument(
+            "--pages",
+            type=lambda value: [int(page) for page in value.split(",")],
+            default=[1, 10, 100, 1000],
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--concurrency",
+            type=lambda value: [int(clients) for clients in value.split(",")],
+            default=[1, 10, 50],
+        )
+        data = parser.add_argument_group("api scenario")
+        data.add_argument("--users", type=int, default=50)
+        data.add_argument("--projects", type=int, default=20)
+        data.add_argument("--members", type=int, default=5, help="per project")
+        data.add_argument("--depth", type=int, default=2, help="levels of subtasks")
+        data.add_argument("--comments", type=int, default=2, help="per todo")
+        data.add_argument("--tags", type=int, default=50)
+        data.add_argument(
+            "--live", action="store_true", help="send requests to a local server"
+        )
+        data.add_argument("--baseline", help="fail on regressions against this file")
+        data.add_argument("--save-baseline", help="write the results to this file")
+        data.add_argument(
+            "--tolerance",
+            type=float,
+            help="share p95 latency and throughput may worsen by, unchecked if unset",
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            SCENARIOS[options["scenario"]](stdout=self.stdout, **options)
+        except ValueError as exc:
+            raise CommandError(exc)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
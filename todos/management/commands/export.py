@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+
+from todos.export import EXPORT_FORMATS
+from todos.views import ActivityLogViewSet, CommentViewSet, TodoViewSet
+
+EXPORTS = {
+    "todos": TodoViewSet,
+    "comments": CommentViewSet,
+    "activity-logs": ActivityLogViewSet,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream todos, comments or activity logs as NDJSON or CSV, as the "
+        "export endpoints do."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("resource", choices=sorted(EXPORTS))
+        parser.add_argument(
+            "--format", choices=sorted(EXPORT_FORMATS), default="ndjson"
+        )
+        parser.add_argument(
+            "--updated-since", help="Only export rows changed after this moment."
+        )
+        parser.add_argument("--after", help="Only export activity logs after this id.")
+        parser.add_argument(
+            "--filter",
+            action="append",
+            default=[],
+            metavar="NAME=VALUE",
+            help="A filter parameter of the list endpoint; repeatable.",
+        )
+        parser.add_argument("--output", help="File to write instead of stdout.")
+
+    def handle(self, *args, **options):
+        params = {}
+        for item in options["filter"]:
+            name, sep, value = item.partition("=")
+            if not sep:
+                raise CommandError(f"Expected NAME=VALUE, got {item!r}.")
+            params[name] = value
+        for name in ["updated_since", "after"]:
+            if options[name]:
+                params[name] = options[name]
+
+        viewset = EXPORTS[options["resource"]]
+        view = viewset(
+            request=Request(RequestFactory().get("/", params)),
+            args=(),
+            kwargs={},
+            format_kwarg=None,
+            action="export",
+            basename=options["resource"],
+        )
+        try:
+            queryset, watermark = view.get_export_queryset(view.request)
+        except ValidationError as exc:
+            raise CommandError(exc.detail)
+        chunks = view.export_stream(queryset, options["format"])
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8", newline="") as out:
+                out.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+        if watermark is not None and options["verbosity"]:
+            self.stderr.write(f"Watermark: {view.format_watermark(watermark)}")
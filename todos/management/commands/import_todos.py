@@ -0,0 +1,62 @@
+import os
+
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from todos.importer import TodoImporter
+from todos.models import ImportJob, Project
+
+
+class Command(BaseCommand):
+    help = (
+        "Import todos from an NDJSON or CSV file into a project, or resume an "
+        "interrupted import."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", nargs="?", help="NDJSON or CSV file to import.")
+        parser.add_argument("--project", type=int, help="Id of the target project.")
+        parser.add_argument("--user", help="Username owning the imported todos.")
+        parser.add_argument(
+            "--format",
+            choices=[choice for choice, label in ImportJob.FORMAT_CHOICES],
+            help="Defaults to the file extension.",
+        )
+        parser.add_argument("--resume", type=int, metavar="JOB_ID")
+        parser.add_argument("--chunk-size", type=int)
+
+    def handle(self, *args, **options):
+        if options["resume"]:
+            try:
+                job = ImportJob.objects.get(pk=options["resume"])
+            except ImportJob.DoesNotExist:
+                raise CommandError(f"No import job {options['resume']}.")
+        else:
+            job = self.create_job(options)
+        if not TodoImporter(job, chunk_size=options["chunk_size"]).run():
+            raise CommandError(f"Import job {job.pk} is complete or running.")
+        job.refresh_from_db()
+        if options["verbosity"]:
+            self.stdout.write(
+                f"Import job {job.pk} {job.status.lower()}: {job.created_count} "
+                f"todos created, {job.error_count} rows rejected"
+            )
+        if job.status == "FAILED":
+            raise CommandError(f"{job.failure} (resume with --resume {job.pk})")
+
+    def create_job(self, options):
+        if not (options["file"] and options["project"] and options["user"]):
+            raise CommandError("Give a file, --project and --user, or --resume.")
+        try:
+            project = Project.objects.get(pk=options["project"])
+            user = User.objects.get(username=options["user"])
+        except (Project.DoesNotExist, User.DoesNotExist) as exc:
+            raise CommandError(exc)
+        name = os.path.basename(options["file"])
+        format = options["format"] or ("csv" if name.endswith(".csv") else "ndjson")
+        job = ImportJob(project=project, user=user, format=format)
+        with open(options["file"], "rb") as file:
+            job.file.save(name, File(file), save=False)
+        job.save()
+        return job
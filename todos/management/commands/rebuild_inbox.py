@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from todos.inbox import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recreate the inbox entries of users from their open todos."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            type=int,
+            action="append",
+            dest="users",
+            help="Only rebuild the inbox of this user id; repeatable.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild(options["users"], batch_size=options["batch_size"])
+        if options["verbosity"]:
+            self.stdout.write(f"Rebuilt {count} inbox entries")
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from todos.models import Milestone, Project
+from todos.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the todo counters of projects and milestones."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--project",
+            type=int,
+            action="append",
+            dest="projects",
+            help="Only rebuild this project and its milestones; repeatable.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        projects = options["projects"]
+        milestones = None
+        if projects is not None:
+            milestones = Milestone.objects.filter(project__in=projects).values_list(
+                "pk", flat=True
+            )
+        with transaction.atomic():
+            for model, pks in [(Project, projects), (Milestone, milestones)]:
+                count = rebuild(model, pks, batch_size=options["batch_size"])
+                if options["verbosity"]:
+                    self.stdout.write(
+                        f"Rebuilt {count} {model._meta.verbose_name_plural}"
+                    )
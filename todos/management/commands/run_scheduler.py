@@ -0,0 +1,49 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+
+from todos.scheduler import RecurringTaskScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Materialize the occurrences of recurring tasks as todos."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Run a single tick and exit."
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=getattr(settings, "RECURRING_TASK_POLL_INTERVAL", 60),
+            help="Seconds between ticks.",
+        )
+        parser.add_argument("--batch-size", type=int)
+
+    def handle(self, *args, **options):
+        scheduler = RecurringTaskScheduler(batch_size=options["batch_size"])
+        while True:
+            close_old_connections()
+            try:
+                created = scheduler.tick()
+            except DatabaseError:
+                # A lost connection or a conflicting write fails this tick
+                # only; its batch is rolled back and retried by the next.
+                if options["once"]:
+                    raise
+                logger.exception("Scheduler tick failed")
+                close_old_connections()
+            else:
+                if options["verbosity"] > 1 or (created and options["verbosity"]):
+                    self.stdout.write(f"Materialized {created} occurrences")
+            if options["once"]:
+                return
+            try:
+                time.sleep(options["interval"])
+            except KeyboardInterrupt:
+                return
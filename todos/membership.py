@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Project, Todo
+
+Membership = Project.members.through
+
+
+def _key(project_id, user_id):
+    return f"todos:project-member:{project_id}:{user_id}"
+
+
+def project_id_of(obj):
+    """Return the id of the project ``obj`` belongs to."""
+    if isinstance(obj, Project):
+        return obj.pk
+    if hasattr(obj, "project_id"):
+        return obj.project_id
+    if type(obj).todo.is_cached(obj):
+        return obj.todo.project_id
+    return Todo.objects.values_list("project_id", flat=True).get(pk=obj.todo_id)
+
+
+def member_project_ids(request, project_ids):
+    """
+    Return the subset of ``project_ids`` the requesting user is a member of.
+
+    Answers are memoized on the request and in the cache for
+    ``PROJECT_MEMBERSHIP_CACHE_TIMEOUT`` seconds; the ``m2m_changed`` handler
+    in ``todos.signals`` evicts them when members are added or removed, from
+    every process only when the cache is shared. Only
+    the ids missing from both are looked up, in one query on the membership
+    table's unique (project, user) index.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return set()
+    memo = getattr(request, "_project_memberships", None)
+    if memo is None:
+        memo = request._project_memberships = {}
+    missing = set(project_ids) - set(memo)
+    if missing:
+        keys = {_key(project_id, user.pk): project_id for project_id in missing}
+        for key, is_member in cache.get_many(keys).items():
+            memo[keys[key]] = is_member
+            missing.discard(keys[key])
+    if missing:
+        found = set(
+            Membership.objects.filter(
+                user_id=user.pk, project_id__in=missing
+            ).values_list("project_id", flat=True)
+        )
+        cache.set_many(
+            {_key(pid, user.pk): pid in found for pid in missing},
+            getattr(settings, "PROJECT_MEMBERSHIP_CACHE_TIMEOUT", 60),
+        )
+        memo.update({pid: pid in found for pid in missing})
+    return {project_id for project_id in project_ids if memo[project_id]}
+
+
+def is_project_member(request, project_id):
+    return bool(member_project_ids(request, [project_id]))
+
+
+def forget_memberships(pairs, using=None):
+    """
+    Evict cached answers for ``(project_id, user_id)`` pairs, again once the
+    current transaction commits so concurrent requests cannot cache the
+    pre-commit state.
+    """
+    keys = [_key(project_id, user_id) for project_id, user_id in pairs]
+    if keys:
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys), using=using)
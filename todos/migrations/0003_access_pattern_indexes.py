@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("todos", "0002_keyset_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="activitylog",
+            index=models.Index(
+                fields=["user", "timestamp"], name="activity_user_timestamp_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="activitylog",
+            index=models.Index(
+                fields=["action", "timestamp"], name="activity_action_timestamp_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="attachment",
+            index=models.Index(
+                fields=["todo", "uploaded_at"], name="attachment_todo_uploaded_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["todo", "created_at"], name="comment_todo_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="milestone",
+            index=models.Index(
+                fields=["project", "due_date"], name="milestone_project_due_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recurringtask",
+            index=models.Index(fields=["frequency"], name="recurring_frequency_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="todo",
+            index=models.Index(
+                fields=["priority", "due_date"], name="todo_priority_due_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="todo",
+            index=models.Index(
+                condition=models.Q(("completed", False)),
+                fields=["project", "due_date"],
+                name="todo_open_project_due_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="todo",
+            index=models.Index(
+                condition=models.Q(("completed", False)),
+                fields=["user", "due_date"],
+                name="todo_open_user_due_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="todo",
+            index=models.Index(
+                condition=models.Q(("completed", True)),
+                fields=["updated_at"],
+                name="todo_done_updated_idx",
+            ),
+        ),
+    ]
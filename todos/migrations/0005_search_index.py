@@ -0,0 +1,62 @@
+from django.db import migrations
+
+# Indexed columns and BM25 weights as of this migration, see todos.search.
+SEARCH_FIELDS = {
+    "todo": ("title", "description"),
+    "comment": ("content",),
+    "project": ("name", "description"),
+}
+SEARCH_WEIGHTS = (10.0, 1.0)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for model_name, columns in SEARCH_FIELDS.items():
+        model = apps.get_model("todos", model_name)
+        table = model._meta.db_table
+        if vendor == "sqlite":
+            weights = ", ".join(map(str, SEARCH_WEIGHTS[: len(columns)]))
+            schema_editor.execute(
+                f'CREATE VIRTUAL TABLE "{table}_fts" USING fts5('
+                f"{', '.join(columns)}, "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+            schema_editor.execute(
+                f'INSERT INTO "{table}_fts" ("{table}_fts", rank) VALUES (%s, %s)',
+                ["rank", f"bm25({weights})"],
+            )
+            schema_editor.execute(
+                f'INSERT INTO "{table}_fts" (rowid, {", ".join(columns)}) '
+                f'SELECT id, {", ".join(columns)} FROM "{table}"'
+            )
+        elif vendor == "postgresql":
+            from django.contrib.postgres.indexes import GinIndex
+            from django.contrib.postgres.search import SearchVector
+
+            vector = SearchVector(columns[0], weight="A", config="english")
+            for column, weight in zip(columns[1:], "B"):
+                vector += SearchVector(column, weight=weight, config="english")
+            schema_editor.add_index(
+                model, GinIndex(vector, name=f"{model_name}_search_idx")
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for model_name in SEARCH_FIELDS:
+        table = apps.get_model("todos", model_name)._meta.db_table
+        if vendor == "sqlite":
+            schema_editor.execute(f'DROP TABLE IF EXISTS "{table}_fts"')
+        elif vendor == "postgresql":
+            schema_editor.execute(f'DROP INDEX IF EXISTS "{model_name}_search_idx"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("todos", "0004_activity_log_timestamp_default"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, Q
+
+
+def schedule_existing_tasks(apps, schema_editor):
+    # The scheduler moves watermarks in the past forward to the horizon.
+    RecurringTask = apps.get_model("todos", "RecurringTask")
+    RecurringTask.objects.using(schema_editor.connection.alias).filter(
+        Q(end_date__isnull=True) | Q(end_date__gte=F("start_date"))
+    ).update(next_run_at=F("start_date"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("todos", "0005_search_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recurringtask",
+            name="next_run_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="todo",
+            name="occurrence_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="todo",
+            name="recurrence",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="occurrences",
+                to="todos.recurringtask",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recurringtask",
+            index=models.Index(fields=["next_run_at"], name="recurring_next_run_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="todo",
+            constraint=models.UniqueConstraint(
+                fields=("recurrence", "occurrence_at"), name="todo_occurrence_uniq"
+            ),
+        ),
+        migrations.RunPython(schedule_existing_tasks, migrations.RunPython.noop),
+    ]
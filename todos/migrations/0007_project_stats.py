@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:01
+
+import datetime
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("todos", "0006_recurring_task_scheduler"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MilestoneStats",
+            fields=[
+                ("total", models.IntegerField(default=0)),
+                ("completed", models.IntegerField(default=0)),
+                ("open_low", models.IntegerField(default=0)),
+                ("open_medium", models.IntegerField(default=0)),
+                ("open_high", models.IntegerField(default=0)),
+                ("open_urgent", models.IntegerField(default=0)),
+                ("estimated_time", models.DurationField(default=datetime.timedelta)),
+                ("actual_time", models.DurationField(default=datetime.timedelta)),
+                (
+                    "milestone",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to="todos.milestone",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="ProjectStats",
+            fields=[
+                ("total", models.IntegerField(default=0)),
+                ("completed", models.IntegerField(default=0)),
+                ("open_low", models.IntegerField(default=0)),
+                ("open_medium", models.IntegerField(default=0)),
+                ("open_high", models.IntegerField(default=0)),
+                ("open_urgent", models.IntegerField(default=0)),
+                ("estimated_time", models.DurationField(default=datetime.timedelta)),
+                ("actual_time", models.DurationField(default=datetime.timedelta)),
+                (
+                    "project",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to="todos.project",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name="todo",
+            index=models.Index(
+                condition=models.Q(("completed", False)),
+                fields=["milestone", "due_date"],
+                name="todo_open_milestone_due_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:33
+
+import itertools
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def record_existing_objects(apps, schema_editor):
+    # A sync from scratch reads the records, so every object needs one.
+    using = schema_editor.connection.alias
+    ChangeRecord = apps.get_model("todos", "ChangeRecord")
+    sources = [
+        ("todo", "Todo", "project_id"),
+        ("comment", "Comment", "todo__project_id"),
+        ("milestone", "Milestone", "project_id"),
+        ("category", "Category", "project_id"),
+    ]
+    for name, model, project in sources:
+        rows = (
+            apps.get_model("todos", model)
+            .objects.using(using)
+            .order_by("pk")
+            .values_list("pk", project)
+            .iterator(chunk_size=2000)
+        )
+        while batch := list(itertools.islice(rows, 2000)):
+            ChangeRecord.objects.using(using).bulk_create(
+                ChangeRecord(model=name, object_id=pk, project_id=project_id)
+                for pk, project_id in batch
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("todos", "0008_import_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChangeRecord",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                (
+                    "model",
+                    models.CharField(
+                        choices=[
+                            ("todo", "Todo"),
+                            ("comment", "Comment"),
+                            ("milestone", "Milestone"),
+                            ("category", "Category"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("object_id", models.PositiveIntegerField()),
+                ("project_id", models.PositiveIntegerField()),
+                ("deleted", models.BooleanField(default=False)),
+                ("changed_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["project_id", "id"], name="change_project_seq_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("model", "object_id", "project_id"),
+                        name="change_record_object_uniq",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(record_existing_objects, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:00
+
+import itertools
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+PRIORITY_RANKS = {"LOW": 1, "MEDIUM": 2, "HIGH": 3, "URGENT": 4}
+
+
+def fill_inboxes(apps, schema_editor):
+    using = schema_editor.connection.alias
+    InboxEntry = apps.get_model("todos", "InboxEntry")
+    rows = (
+        apps.get_model("todos", "Todo")
+        .objects.using(using)
+        .filter(completed=False)
+        .order_by("pk")
+        .values_list("pk", "user_id", "due_date", "priority")
+        .iterator(chunk_size=2000)
+    )
+    while batch := list(itertools.islice(rows, 2000)):
+        InboxEntry.objects.using(using).bulk_create(
+            InboxEntry(
+                todo_id=pk,
+                user_id=user_id,
+                due_date=due_date,
+                someday=due_date is None,
+                priority=PRIORITY_RANKS.get(priority, 0),
+            )
+            for pk, user_id, due_date, priority in batch
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("todos", "0010_chunked_uploads"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InboxEntry",
+            fields=[
+                (
+                    "todo",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="inbox_entry",
+                        serialize=False,
+                        to="todos.todo",
+                    ),
+                ),
+                ("due_date", models.DateTimeField(blank=True, null=True)),
+                ("someday", models.BooleanField(default=False)),
+                ("priority", models.PositiveSmallIntegerField()),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="inbox",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "someday", "due_date", "-priority", "todo"],
+                        name="inbox_user_order_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(fill_inboxes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:10
+
+import itertools
+
+from django.db import migrations, models
+
+
+def number_existing_records(apps, schema_editor):
+    # Number each project's records in their id order, the order of the
+    # tokens handed out so far.
+    using = schema_editor.connection.alias
+    ChangeRecord = apps.get_model("todos", "ChangeRecord")
+    SyncSequence = apps.get_model("todos", "SyncSequence")
+    records = ChangeRecord.objects.using(using)
+    projects = records.order_by().values_list("project_id", flat=True).distinct()
+    sequences = []
+    for project_id in projects:
+        rows = (
+            records.filter(project_id=project_id)
+            .order_by("pk")
+            .only("pk")
+            .iterator(chunk_size=2000)
+        )
+        seq = 0
+        while batch := list(itertools.islice(rows, 2000)):
+            for record in batch:
+                seq += 1
+                record.seq = seq
+            records.bulk_update(batch, ["seq"])
+        sequences.append(SyncSequence(project_id=project_id, value=seq))
+    SyncSequence.objects.using(using).bulk_create(sequences, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("todos", "0011_inbox_entry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncSequence",
+            fields=[
+                (
+                    "project_id",
+                    models.PositiveIntegerField(primary_key=True, serialize=False),
+                ),
+                ("value", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="changerecord",
+            name="seq",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(number_existing_records, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name="changerecord",
+            name="change_project_seq_idx",
+        ),
+        migrations.AddIndex(
+            model_name="changerecord",
+            index=models.Index(
+                fields=["project_id", "seq"], name="change_project_seq_idx"
+            ),
+        ),
+    ]
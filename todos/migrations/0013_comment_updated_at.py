@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:20
+
+from django.db import migrations, models
+
+
+def copy_created_at(apps, schema_editor):
+    # Existing comments were last changed when they were created.
+    Comment = apps.get_model("todos", "Comment")
+    Comment.objects.using(schema_editor.connection.alias).update(
+        updated_at=models.F("created_at")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("todos", "0012_sync_sequence"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comment",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["updated_at", "id"], name="comment_updated_id_idx"
+            ),
+        ),
+    ]
@@ -1,8 +1,25 @@
+import calendar
+import math
+from datetime import timedelta
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 
 
+class LoadedValuesMixin:
+    """Remembers the field values an instance was loaded from the database with."""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def loaded_value(self, attname, default=None):
+        return getattr(self, "_loaded_values", {}).get(attname, default)
+
+
 class Project(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
@@ -17,18 +34,25 @@ class Project(models.Model):
         return self.name
 
 
-class Milestone(models.Model):
+class Milestone(LoadedValuesMixin, models.Model):
     project = models.ForeignKey(
         Project, related_name="milestones", on_delete=models.CASCADE
     )
     name = models.CharField(max_length=255)
     due_date = models.DateField()
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["project", "due_date"], name="milestone_project_due_idx"
+            ),
+        ]
+
     def __str__(self):
         return f"{self.project.name} - {self.name}"
 
 
-class Category(models.Model):
+class Category(LoadedValuesMixin, models.Model):
     name = models.CharField(max_length=100)
     project = models.ForeignKey(
         Project, related_name="categories", on_delete=models.CASCADE
@@ -45,7 +69,7 @@ class Tag(models.Model):
         return self.name
 
 
-class Todo(models.Model):
+class Todo(LoadedValuesMixin, models.Model):
     PRIORITY_CHOICES = [
         ("LOW", "Low"),
         ("MEDIUM", "Medium"),
@@ -74,9 +98,54 @@ class Todo(models.Model):
     parent_task = models.ForeignKey(
         "self", null=True, blank=True, related_name="subtasks", on_delete=models.CASCADE
     )
+    # Set on todos materialized from a recurring task, see todos.scheduler.
+    recurrence = models.ForeignKey(
+        "RecurringTask",
+        null=True,
+        blank=True,
+        related_name="occurrences",
+        on_delete=models.SET_NULL,
+    )
+    occurrence_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            # Materializing an occurrence twice fails instead of duplicating it.
+            models.UniqueConstraint(
+                fields=["recurrence", "occurrence_at"], name="todo_occurrence_uniq"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="todo_created_id_idx"),
+            models.Index(fields=["due_date", "id"], name="todo_due_id_idx"),
+            models.Index(fields=["updated_at", "id"], name="todo_updated_id_idx"),
+            models.Index(fields=["priority", "due_date"], name="todo_priority_due_idx"),
+            # Filters on ``completed`` compile to ``[NOT] completed``, which a
+            # b-tree on the column cannot serve, so they use partial indexes.
+            models.Index(
+                fields=["project", "due_date"],
+                condition=models.Q(completed=False),
+                name="todo_open_project_due_idx",
+            ),
+            models.Index(
+                fields=["user", "due_date"],
+                condition=models.Q(completed=False),
+                name="todo_open_user_due_idx",
+            ),
+            models.Index(
+                fields=["milestone", "due_date"],
+                condition=models.Q(completed=False),
+                name="todo_open_milestone_due_idx",
+            ),
+            models.Index(
+                fields=["updated_at"],
+                condition=models.Q(completed=True),
+                name="todo_done_updated_idx",
+            ),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -86,11 +155,36 @@ class Comment(models.Model):
     user = models.ForeignKey(User, related_name="comments", on_delete=models.CASCADE)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="comment_created_id_idx"),
+            models.Index(fields=["updated_at", "id"], name="comment_updated_id_idx"),
+            models.Index(
+                fields=["todo", "created_at"], name="comment_todo_created_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"Comment by {self.user.username} on {self.todo.title}"
 
 
+class Blob(models.Model):
+    """
+    File content stored once per SHA-256 digest and shared by the
+    attachments uploaded with it, see todos.uploads.
+    """
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.PositiveBigIntegerField()
+    file = models.FileField(upload_to="attachments/", max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
+
 class Attachment(models.Model):
     todo = models.ForeignKey(Todo, related_name="attachments", on_delete=models.CASCADE)
     file = models.FileField(upload_to="attachments/")
@@ -98,33 +192,305 @@ class Attachment(models.Model):
         User, related_name="attachments", on_delete=models.CASCADE
     )
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # The shared content of chunked uploads; ``file`` names the blob's file.
+    blob = models.ForeignKey(
+        Blob,
+        related_name="attachments",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["todo", "uploaded_at"], name="attachment_todo_uploaded_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"Attachment for {self.todo.title}"
 
 
-class RecurringTask(models.Model):
+class Upload(models.Model):
+    """A chunked upload of an attachment, see todos.uploads."""
+
+    STATUS_CHOICES = [("PENDING", "Pending"), ("COMPLETED", "Completed")]
+
+    todo = models.ForeignKey(Todo, related_name="uploads", on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name="uploads", on_delete=models.CASCADE)
+    filename = models.CharField(max_length=200)
+    # Declared by the client, checked when the upload completes.
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="PENDING")
+    attachment = models.OneToOneField(
+        Attachment,
+        related_name="upload",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload of {self.filename}"
+
+
+class UploadPart(models.Model):
+    upload = models.ForeignKey(Upload, related_name="parts", on_delete=models.CASCADE)
+    number = models.PositiveIntegerField()
+    size = models.PositiveBigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    file = models.FileField(upload_to="uploads/")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["upload", "number"], name="upload_part_number_uniq"
+            ),
+        ]
+
+    def __str__(self):
+        return f"Part {self.number} of {self.upload}"
+
+
+class RecurringTask(LoadedValuesMixin, models.Model):
     FREQUENCY_CHOICES = [
         ("DAILY", "Daily"),
         ("WEEKLY", "Weekly"),
         ("MONTHLY", "Monthly"),
         ("YEARLY", "Yearly"),
     ]
+    # Fixed length periods and periods counted in months.
+    PERIODS = {"DAILY": timedelta(days=1), "WEEKLY": timedelta(weeks=1)}
+    MONTHS = {"MONTHLY": 1, "YEARLY": 12}
 
     todo = models.OneToOneField(Todo, on_delete=models.CASCADE)
     frequency = models.CharField(max_length=10, choices=FREQUENCY_CHOICES)
     start_date = models.DateTimeField()
     end_date = models.DateTimeField(null=True, blank=True)
+    # The earliest occurrence not materialized yet, None once the schedule
+    # has ended. The scheduler only reads rows whose watermark is due.
+    next_run_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["frequency"], name="recurring_frequency_idx"),
+            models.Index(fields=["next_run_at"], name="recurring_next_run_idx"),
+        ]
 
     def __str__(self):
         return f"Recurring {self.todo.title}"
 
+    def save(self, *args, **kwargs):
+        schedule = ["frequency", "start_date", "end_date"]
+        if self._state.adding or any(
+            getattr(self, name) != self.loaded_value(name) for name in schedule
+        ):
+            self.next_run_at = self.run_at_or_after(timezone.now())
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "next_run_at"}
+        super().save(*args, **kwargs)
+
+    def occurrence(self, n):
+        """Return the ``n``-th occurrence, the first one being ``start_date``."""
+        if self.frequency in self.PERIODS:
+            return self.start_date + n * self.PERIODS[self.frequency]
+        start = self.start_date
+        months = start.month - 1 + n * self.MONTHS[self.frequency]
+        year, month = start.year + months // 12, months % 12 + 1
+        # Clamp the 31st to the last day of shorter months.
+        day = min(start.day, calendar.monthrange(year, month)[1])
+        return start.replace(year=year, month=month, day=day)
+
+    def run_at_or_after(self, moment):
+        """Return the first occurrence at or after ``moment``, None if none."""
+        n = 0
+        if moment > self.start_date:
+            if self.frequency in self.PERIODS:
+                n = math.ceil((moment - self.start_date) / self.PERIODS[self.frequency])
+            else:
+                months = (moment.year - self.start_date.year) * 12
+                months += moment.month - self.start_date.month
+                n = max(months // self.MONTHS[self.frequency], 0)
+                while self.occurrence(n) < moment:
+                    n += 1
+        run = self.occurrence(n)
+        if self.end_date is not None and run > self.end_date:
+            return None
+        return run
+
+
+class TodoStats(models.Model):
+    """
+    Counters over the todos of a container, maintained incrementally by the
+    signal handlers in ``todos.signals``, see ``todos.stats``.
+    """
+
+    total = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    open_low = models.IntegerField(default=0)
+    open_medium = models.IntegerField(default=0)
+    open_high = models.IntegerField(default=0)
+    open_urgent = models.IntegerField(default=0)
+    estimated_time = models.DurationField(default=timedelta)
+    actual_time = models.DurationField(default=timedelta)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def open(self):
+        return self.total - self.completed
+
+
+class ProjectStats(TodoStats):
+    project = models.OneToOneField(
+        Project, primary_key=True, related_name="stats", on_delete=models.CASCADE
+    )
+
+
+class MilestoneStats(TodoStats):
+    milestone = models.OneToOneField(
+        Milestone, primary_key=True, related_name="stats", on_delete=models.CASCADE
+    )
+
+
+class ImportJob(models.Model):
+    """A file of todos imported into a project in chunks, see todos.importer."""
+
+    FORMAT_CHOICES = [("ndjson", "NDJSON"), ("csv", "CSV")]
+    STATUS_CHOICES = [
+        ("PENDING", "Pending"),
+        ("RUNNING", "Running"),
+        ("COMPLETED", "Completed"),
+        ("FAILED", "Failed"),
+    ]
+
+    project = models.ForeignKey(
+        Project, related_name="import_jobs", on_delete=models.CASCADE
+    )
+    user = models.ForeignKey(User, related_name="import_jobs", on_delete=models.CASCADE)
+    file = models.FileField(upload_to="imports/")
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="PENDING")
+    # Input rows consumed by committed chunks, which a resumed import skips.
+    rows_processed = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    failure = models.TextField(blank=True)
+    # Counts the claims; a worker only writes progress under its own claim.
+    attempt = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Import {self.pk} into {self.project.name}"
+
+
+class SyncSequence(models.Model):
+    """The last ``ChangeRecord.seq`` handed out in a project, see todos.sync."""
+
+    # Not a foreign key: tombstones outlive their project.
+    project_id = models.PositiveIntegerField(primary_key=True)
+    value = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"project {self.project_id} at {self.value}"
+
+
+class ChangeRecord(models.Model):
+    """
+    The latest change of an object seen from a project, see todos.sync.
+
+    ``seq`` numbers the changes of a project in commit order and serves as
+    the sync token. An object moved to another project leaves a deleted
+    record, a tombstone, in the old one.
+    """
+
+    MODEL_CHOICES = [
+        ("todo", "Todo"),
+        ("comment", "Comment"),
+        ("milestone", "Milestone"),
+        ("category", "Category"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.PositiveIntegerField()
+    # Not a foreign key: tombstones outlive their project.
+    project_id = models.PositiveIntegerField()
+    seq = models.PositiveBigIntegerField(default=0)
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model", "object_id", "project_id"],
+                name="change_record_object_uniq",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["project_id", "seq"], name="change_project_seq_idx"),
+        ]
+
+    def __str__(self):
+        state = "deleted" if self.deleted else "changed"
+        return f"{self.model} {self.object_id} {state} in project {self.project_id}"
+
+
+class InboxEntry(models.Model):
+    """
+    An open todo in the inbox of the user it is assigned to, maintained by
+    the signal handlers in ``todos.signals``, see todos.inbox.
+
+    Rows are ordered by the ``inbox_user_order_idx`` index: dated todos by
+    due date, then todos without one, each by priority, most urgent first.
+    """
+
+    todo = models.OneToOneField(
+        Todo, primary_key=True, related_name="inbox_entry", on_delete=models.CASCADE
+    )
+    user = models.ForeignKey(User, related_name="inbox", on_delete=models.CASCADE)
+    due_date = models.DateTimeField(null=True, blank=True)
+    # Set when ``due_date`` is not, so undated todos sort last on any database.
+    someday = models.BooleanField(default=False)
+    # The todo's priority as a number, 1 for LOW to 4 for URGENT.
+    priority = models.PositiveSmallIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "someday", "due_date", "-priority", "todo"],
+                name="inbox_user_order_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Todo {self.todo_id} in the inbox of user {self.user_id}"
+
 
 class ActivityLog(models.Model):
     user = models.ForeignKey(User, related_name="activities", on_delete=models.CASCADE)
     action = models.CharField(max_length=255)
     target = models.CharField(max_length=255)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the event happens rather than when the buffered row is written.
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["timestamp", "id"], name="activity_timestamp_id_idx"),
+            models.Index(
+                fields=["user", "timestamp"], name="activity_user_timestamp_idx"
+            ),
+            models.Index(
+                fields=["action", "timestamp"], name="activity_action_timestamp_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user.username} {self.action} {self.target}"
@@ -0,0 +1,194 @@
+import base64
+import json
+import operator
+from collections import OrderedDict
+from functools import reduce
+from types import SimpleNamespace
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Page number pagination with an opt-in keyset (cursor) mode.
+
+    Requesting ``?pagination=cursor`` switches to keyset pagination: pages are
+    fetched with a ``WHERE`` on the ordering values of the last row seen
+    instead of ``COUNT(*)`` and ``OFFSET``, so page N costs the same as the
+    first page. The ``next``/``previous`` links carry an opaque ``cursor``
+    parameter. The ordering is the one applied by ``OrderingFilter`` (falling
+    back to the view's ``keyset_ordering``) with the primary key appended as
+    a tie-breaker. Orderings by anything but fields of the model, such as
+    the rank of ``?search=`` results, are rejected with a 400.
+    """
+
+    cursor_query_param = "cursor"
+    mode_query_param = "pagination"
+    invalid_cursor_message = "Invalid cursor"
+    invalid_ordering_message = (
+        "Cursor pagination only orders by fields of the listed objects."
+    )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = (
+            self.cursor_query_param in request.query_params
+            or request.query_params.get(self.mode_query_param) == "cursor"
+        )
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        self.ordering = self.get_keyset_ordering(queryset, view)
+        self.nulls_largest = connections[queryset.db].features.nulls_order_largest
+        values, reverse = self.decode_cursor(request)
+
+        if values is not None:
+            queryset = queryset.filter(self.after(values, reverse))
+        order_by = [
+            ("-" if descending != reverse else "") + field.name
+            for field, descending in self.ordering
+        ]
+        results = list(queryset.order_by(*order_by)[: page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = values is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+        self.page = results
+        return results
+
+    def get_keyset_ordering(self, queryset, view):
+        """Return ``[(field, descending), ...]`` ending with the primary key."""
+        opts = queryset.model._meta
+        try:
+            fields = self.resolve_ordering(opts, queryset.query.order_by)
+        except FieldDoesNotExist:
+            # Annotations and related fields are not columns of the rows
+            # the cursor is built from.
+            raise ValidationError(
+                {self.mode_query_param: [self.invalid_ordering_message]}
+            )
+        if not fields:
+            fields = self.resolve_ordering(
+                opts, getattr(view, "keyset_ordering", ["-pk"])
+            )
+        fields = [(field, desc) for field, desc in fields if not field.primary_key]
+        descending = fields[0][1] if fields else True
+        return fields + [(opts.pk, descending)]
+
+    def resolve_ordering(self, opts, names):
+        fields = []
+        for name in map(str, names):
+            field_name = name.lstrip("-")
+            field = opts.pk if field_name == "pk" else opts.get_field(field_name)
+            fields.append((field, name.startswith("-")))
+        return fields
+
+    def after(self, values, reverse):
+        """Build the filter selecting rows strictly after ``values``."""
+        conditions, equal = [], Q()
+        for (field, descending), value in zip(self.ordering, values):
+            beyond = self.bound(field, value, greater=descending == reverse)
+            if beyond is not None:
+                conditions.append(equal & beyond)
+            if value is None:
+                equal &= Q(**{f"{field.name}__isnull": True})
+            else:
+                equal &= Q(**{field.name: value})
+        # Repeat the inclusive bound on the leading column so the database can
+        # answer the OR with a single index range scan.
+        (field, descending), value = self.ordering[0], values[0]
+        leading = self.bound(field, value, descending == reverse, inclusive=True)
+        return leading & reduce(operator.or_, conditions)
+
+    def bound(self, field, value, greater, inclusive=False):
+        """
+        Return the rows beyond ``value`` in the direction of travel, or ``None``
+        when there are none. NULLs sort as the largest or smallest value,
+        whichever the database does natively, so its indexes stay usable.
+        """
+        nulls_ahead = self.nulls_largest == greater
+        isnull = f"{field.name}__isnull"
+        if value is None:
+            if nulls_ahead:
+                return Q(**{isnull: True}) if inclusive else None
+            return Q() if inclusive else Q(**{isnull: False})
+        lookup = ("gt" if greater else "lt") + ("e" if inclusive else "")
+        condition = Q(**{f"{field.name}__{lookup}": value})
+        if field.null and nulls_ahead:
+            condition |= Q(**{isnull: True})
+        return condition
+
+    def ordering_key(self):
+        return [("-" if desc else "") + field.name for field, desc in self.ordering]
+
+    def encode_cursor(self, obj, reverse):
+        if isinstance(obj, dict):
+            # Rows of ``values()`` querysets, keyed by attname.
+            obj = SimpleNamespace(**obj)
+        values = [
+            None if field.value_from_object(obj) is None else field.value_to_string(obj)
+            for field, descending in self.ordering
+        ]
+        payload = {"o": self.ordering_key(), "v": values, "r": reverse}
+        cursor = base64.urlsafe_b64encode(json.dumps(payload).encode("ascii"))
+        url = replace_query_param(
+            self.base_url, self.cursor_query_param, cursor.decode("ascii")
+        )
+        return remove_query_param(url, self.mode_query_param)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")))
+            if payload["o"] != self.ordering_key():
+                raise ValueError("cursor ordering does not match")
+            values = [
+                None if value is None else field.to_python(value)
+                for (field, descending), value in zip(
+                    self.ordering, payload["v"], strict=True
+                )
+            ]
+            return values, bool(payload["r"])
+        except (TypeError, ValueError, KeyError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(
+            OrderedDict(
+                [
+                    ("next", self.get_next_link()),
+                    ("previous", self.get_previous_link()),
+                    ("results", data),
+                ]
+            )
+        )
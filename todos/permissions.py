@@ -1,5 +1,8 @@
+from asgiref.sync import sync_to_async
 from rest_framework import permissions
 
+from .membership import is_project_member, project_id_of
+
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
@@ -7,9 +10,19 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
             return True
         return obj.owner == request.user
 
+    async def ahas_object_permission(self, request, view, obj):
+        if request.method in permissions.SAFE_METHODS:
+            return True
+        return obj.owner_id == request.user.pk
+
 
 class IsProjectMemberOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
-        return request.user in obj.project.members.all()
+        return is_project_member(request, project_id_of(obj))
+
+    async def ahas_object_permission(self, request, view, obj):
+        if request.method in permissions.SAFE_METHODS:
+            return True
+        return await sync_to_async(self.has_object_permission)(request, view, obj)
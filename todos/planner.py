@@ -0,0 +1,105 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, RelatedField
+
+
+def _get_relation(model, attr):
+    """Return the model field or reverse relation reachable as ``model.<attr>``."""
+    for field in model._meta.get_fields():
+        if field.is_relation and field.auto_created and not field.concrete:
+            if field.get_accessor_name() == attr:
+                return field
+        elif field.name == attr:
+            return field
+    raise FieldDoesNotExist(f"{model.__name__} has no relation named {attr!r}")
+
+
+def _pk_only_queryset(relation):
+    """Minimal queryset for relations rendered from primary keys only."""
+    model = relation.related_model
+    if relation.one_to_many:
+        # The reverse foreign key column is needed to attach rows to parents.
+        return model.objects.only("pk", relation.field.attname)
+    return model.objects.only("pk")
+
+
+def _plan_serializer(serializer, model, prefix=""):
+    select, prefetch = [], []
+    for field in serializer.fields.values():
+        if field.write_only or field.source == "*":
+            continue
+        attrs = field.source_attrs
+        try:
+            relation = _get_relation(model, attrs[0])
+        except FieldDoesNotExist:
+            continue
+        if not relation.is_relation:
+            continue
+        path = prefix + attrs[0]
+        single = relation.many_to_one or relation.one_to_one
+
+        if len(attrs) > 1:
+            # Dotted sources such as "user.username" read through the relation.
+            if single:
+                select.append(path)
+            else:
+                prefetch.append(path)
+        elif isinstance(field, serializers.ListSerializer):
+            child = field.child
+            queryset = plan_queryset(relation.related_model.objects.all(), child)
+            prefetch.append(Prefetch(path, queryset=queryset))
+        elif isinstance(field, serializers.BaseSerializer):
+            if single:
+                select.append(path)
+                nested_select, nested_prefetch = _plan_serializer(
+                    field, relation.related_model, prefix=path + "__"
+                )
+                select.extend(nested_select)
+                prefetch.extend(nested_prefetch)
+            else:
+                prefetch.append(path)
+        elif isinstance(field, ManyRelatedField):
+            if field.child_relation.use_pk_only_optimization():
+                prefetch.append(Prefetch(path, queryset=_pk_only_queryset(relation)))
+            else:
+                prefetch.append(path)
+        elif isinstance(field, RelatedField):
+            # Forward keys rendered from the pk read ``<field>_id`` directly.
+            if single and not (relation.concrete and field.use_pk_only_optimization()):
+                select.append(path)
+        elif not single:
+            prefetch.append(path)
+    return select, prefetch
+
+
+def plan_queryset(queryset, serializer):
+    """
+    Apply the ``select_related``/``prefetch_related`` calls needed to render
+    ``queryset`` with ``serializer`` without issuing per-object queries.
+
+    ``serializer`` may be a serializer class or instance; instances are
+    planned from their bound fields, so dynamically pruned fields are not
+    fetched.
+    """
+    if isinstance(serializer, type):
+        serializer = serializer()
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    select, prefetch = _plan_serializer(serializer, queryset.model)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+class PlannedQuerysetMixin:
+    """
+    Viewset mixin that optimizes ``get_queryset()`` for the serializer the
+    view is going to render with.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        return plan_queryset(queryset, self.get_serializer())
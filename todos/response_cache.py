@@ -0,0 +1,191 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+
+
+class ResponseCache:
+    """
+    Caches serialized GET responses in the ``RESPONSE_CACHE_ALIAS`` cache.
+
+    Entries are keyed on the URL, the media type, the requesting user and
+    a generation per namespace (one per model) the representation depends
+    on. ``invalidate`` replaces the generations of the changed models, so
+    every entry built from the previous state becomes unreachable and ages
+    out of the cache. Hits and misses are counted per namespace.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, "RESPONSE_CACHE_ALIAS", "default")]
+
+    @property
+    def timeout(self):
+        return getattr(settings, "RESPONSE_CACHE_TIMEOUT", 300)
+
+    def namespace(self, model):
+        return model._meta.label_lower
+
+    def _generation_key(self, namespace):
+        return f"todos:response-generation:{namespace}"
+
+    def generations(self, namespaces):
+        keys = [self._generation_key(namespace) for namespace in namespaces]
+        found = self.cache.get_many(keys)
+        for key in set(keys) - set(found):
+            # A fresh value, not 0: an evicted generation must not revive
+            # entries cached under an earlier one.
+            self.cache.add(key, time.time_ns(), None)
+            found[key] = self.cache.get(key)
+        return [found[key] for key in keys]
+
+    def key(self, request, media_type, namespaces):
+        user = request.user.pk if request.user.is_authenticated else "anonymous"
+        scope = (
+            request.get_host(),
+            request.path,
+            request.META.get("QUERY_STRING", ""),
+            media_type,
+            user,
+            list(zip(namespaces, self.generations(namespaces))),
+        )
+        digest = hashlib.md5(repr(scope).encode(), usedforsecurity=False)
+        return f"todos:response:{digest.hexdigest()}"
+
+    def get(self, key, namespace):
+        entry = self.cache.get(key)
+        with self._lock:
+            (self.misses if entry is None else self.hits)[namespace] += 1
+        return entry
+
+    def set(self, key, entry):
+        self.cache.set(key, entry, self.timeout)
+
+    def invalidate(self, models, using=None):
+        """
+        Drop cached responses depending on ``models``, again once the current
+        transaction commits so concurrent requests cannot cache the
+        pre-commit state.
+        """
+        keys = {self._generation_key(self.namespace(model)) for model in models}
+        if not keys:
+            return
+
+        def bump():
+            self.cache.set_many({key: time.time_ns() for key in keys}, None)
+
+        bump()
+        transaction.on_commit(bump, using=using)
+
+    def stats(self):
+        with self._lock:
+            return {
+                namespace: {
+                    "hits": self.hits[namespace],
+                    "misses": self.misses[namespace],
+                }
+                for namespace in self.hits | self.misses
+            }
+
+
+response_cache = ResponseCache()
+
+
+class CachedResponseMixin:
+    """
+    Serves ``list`` and ``retrieve`` from ``response_cache``.
+
+    Rendered responses are cached per accepted media type, so hits skip the
+    queries, the serializers and the renderer. ``cache_dependencies`` lists
+    models, besides the view's own, whose changes alter the representations.
+    Responses carry an ``X-Cache: HIT`` or ``MISS`` header. ``?expand=``
+    requests, which nest arbitrary related objects, are not cached.
+    """
+
+    cache_dependencies = ()
+    cached_headers = ("ETag", "Last-Modified")
+
+    def get_cache_namespaces(self):
+        models = [self.queryset.model, *self.cache_dependencies]
+        return sorted({response_cache.namespace(model) for model in models})
+
+    def cached_hit(self, request):
+        """Return the cached response to ``request``, or None on a miss."""
+        namespace = response_cache.namespace(self.queryset.model)
+        key = response_cache.key(
+            request, request.accepted_media_type, self.get_cache_namespaces()
+        )
+        entry = response_cache.get(key, namespace)
+        if entry is not None:
+            content, content_type, headers = entry
+            return HttpResponse(
+                content,
+                content_type=content_type,
+                headers={**headers, "X-Cache": "HIT"},
+            )
+        self.response_cache_key = key
+        return None
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if "expand" in request.query_params:
+            return handler(request, *args, **kwargs)
+        response = self.cached_hit(request)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        return response
+
+    async def acached_response(self, handler, request, *args, **kwargs):
+        if "expand" in request.query_params:
+            return await handler(request, *args, **kwargs)
+        response = await sync_to_async(self.cached_hit, thread_sensitive=False)(request)
+        if response is None:
+            response = await handler(request, *args, **kwargs)
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        key = getattr(self, "response_cache_key", None)
+        if key is not None:
+            if response.status_code == 200:
+                response.render()
+                headers = {
+                    name: response[name]
+                    for name in self.cached_headers
+                    if response.has_header(name)
+                }
+                entry = (response.content, response["Content-Type"], headers)
+                response_cache.set(key, entry)
+            response["X-Cache"] = "MISS"
+        return response
+
+    async def afinalize_response(self, request, response, *args, **kwargs):
+        if getattr(self, "response_cache_key", None) is None:
+            return await super().afinalize_response(request, response, *args, **kwargs)
+        # Misses are rendered and stored, which may query the database in the
+        # browsable API's forms and reach a cache server.
+        return await sync_to_async(self.finalize_response)(
+            request, response, *args, **kwargs
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.acached_response(super().alist, request, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.acached_response(super().aretrieve, request, *args, **kwargs)
@@ -0,0 +1,171 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connections, router, transaction
+from django.utils import timezone
+
+from .models import RecurringTask, Todo
+from .signals import todos_bulk_created
+
+logger = logging.getLogger(__name__)
+
+
+class RecurringTaskScheduler:
+    """
+    Materializes the occurrences of recurring tasks as todos.
+
+    Each tick creates the todos of every occurrence due within ``horizon``
+    of now, in batches of ``batch_size`` recurring tasks, reading only the
+    rows whose ``next_run_at`` watermark is due. A batch's todos and the
+    advanced watermarks are written in one transaction, so restarts neither
+    skip nor repeat occurrences. Where the database supports it the batch
+    rows are locked with ``SKIP LOCKED``, letting several workers share the
+    work; the unique (recurrence, occurrence_at) constraint makes a batch
+    that raced another worker roll back instead of duplicating todos.
+    Occurrences missed by more than ``horizon``, e.g. during a long outage,
+    are skipped rather than caught up with.
+    """
+
+    copied_fields = [
+        "title",
+        "description",
+        "user_id",
+        "project_id",
+        "category_id",
+        "milestone_id",
+        "priority",
+        "estimated_time",
+    ]
+
+    max_conflicts = 3
+
+    def __init__(self, batch_size=None, horizon=None, using=None):
+        self.batch_size = batch_size or getattr(
+            settings, "RECURRING_TASK_BATCH_SIZE", 500
+        )
+        self.horizon = horizon or timedelta(
+            days=getattr(settings, "RECURRING_TASK_HORIZON_DAYS", 7)
+        )
+        self.using = using or router.db_for_write(RecurringTask)
+
+    def tick(self, now=None):
+        """Materialize every occurrence due now, return the number of todos."""
+        now = now or timezone.now()
+        until = now + self.horizon
+        created = conflicts = 0
+        while True:
+            try:
+                with transaction.atomic(using=self.using):
+                    tasks = self.lock_due(until)
+                    if not tasks:
+                        return created
+                    created += self.materialize(tasks, now - self.horizon, until)
+            except IntegrityError:
+                # Another worker materialized some of these occurrences and
+                # advanced their watermarks; the next batch skips them.
+                conflicts += 1
+                if conflicts > self.max_conflicts:
+                    raise
+                logger.warning("Recurring task batch raced another worker")
+
+    def lock_due(self, until):
+        features = connections[self.using].features
+        due = (
+            RecurringTask.objects.using(self.using)
+            .filter(next_run_at__lte=until)
+            .select_related("todo")
+            .prefetch_related("todo__tags")
+            .order_by("next_run_at")
+        )
+        if features.has_select_for_update_skip_locked:
+            of = ("self",) if features.has_select_for_update_of else ()
+            due = due.select_for_update(skip_locked=True, of=of)
+        return list(due[: self.batch_size])
+
+    def materialize(self, tasks, since, until):
+        occurrences = []
+        for task in tasks:
+            if task.next_run_at < since:
+                task.next_run_at = task.run_at_or_after(since)
+            while task.next_run_at is not None and task.next_run_at <= until:
+                occurrences.append((task, task.next_run_at))
+                task.next_run_at = task.run_at_or_after(
+                    task.next_run_at + timedelta(microseconds=1)
+                )
+        # Occurrences that exist already, e.g. after the schedule was edited.
+        existing = set()
+        if occurrences:
+            existing.update(
+                Todo.objects.using(self.using)
+                .filter(
+                    recurrence__in=tasks,
+                    occurrence_at__gte=min(run for task, run in occurrences),
+                )
+                .values_list("recurrence_id", "occurrence_at")
+            )
+        todos = [
+            self.occurrence(task, run)
+            for task, run in occurrences
+            if (task.pk, run) not in existing
+        ]
+        Todo.objects.using(self.using).bulk_create(todos)
+        if todos and todos[0].pk is None:
+            # The database cannot return the primary keys of inserted rows.
+            pks = {
+                (recurrence_id, run): pk
+                for pk, recurrence_id, run in Todo.objects.using(self.using)
+                .filter(
+                    recurrence__in=tasks,
+                    occurrence_at__in=[t.occurrence_at for t in todos],
+                )
+                .values_list("pk", "recurrence_id", "occurrence_at")
+            }
+            for todo in todos:
+                todo.pk = pks[todo.recurrence_id, todo.occurrence_at]
+        self.copy_tags(tasks, todos)
+        self.advance(tasks)
+        todos_bulk_created(todos, using=self.using)
+        return len(todos)
+
+    def advance(self, tasks):
+        """
+        Write the new watermarks. ``bulk_update`` would compile a ``CASE``
+        expression over the whole batch; one prepared ``UPDATE`` executed
+        per row is several times faster.
+
+        The raw ``UPDATE`` sends no signals. That is only fine because no
+        receiver keeps anything derived from recurring tasks: the only one,
+        ``remember_saved_values``, tracks in-memory instances. Write through
+        the ORM if a receiver for ``RecurringTask`` is ever added.
+        """
+        connection = connections[self.using]
+        quote = connection.ops.quote_name
+        opts = RecurringTask._meta
+        field = opts.get_field("next_run_at")
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"UPDATE {quote(opts.db_table)} SET {quote(field.column)} = %s "
+                f"WHERE {quote(opts.pk.column)} = %s",
+                [
+                    (field.get_db_prep_value(task.next_run_at, connection), task.pk)
+                    for task in tasks
+                ],
+            )
+
+    def occurrence(self, task, run):
+        template = task.todo
+        todo = Todo(recurrence=task, occurrence_at=run, due_date=run)
+        for attname in self.copied_fields:
+            setattr(todo, attname, getattr(template, attname))
+        return todo
+
+    def copy_tags(self, tasks, todos):
+        tags = {task.pk: [tag.pk for tag in task.todo.tags.all()] for task in tasks}
+        through = Todo.tags.through
+        rows = [
+            through(todo_id=todo.pk, tag_id=tag_id)
+            for todo in todos
+            for tag_id in tags[todo.recurrence_id]
+        ]
+        through.objects.using(self.using).bulk_create(rows)
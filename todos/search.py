@@ -0,0 +1,201 @@
+import operator
+import re
+from functools import reduce
+
+from django.db import connections, router
+from django.db.models import FloatField, Q, Value
+from rest_framework import filters
+
+from .models import Comment, Project, Todo
+
+# Indexed columns of each searchable model, most important first.
+SEARCH_FIELDS = {
+    Todo: ("title", "description"),
+    Comment: ("content",),
+    Project: ("name", "description"),
+}
+# Relative weight of a match in each position of SEARCH_FIELDS.
+SEARCH_WEIGHTS = (10.0, 1.0)
+MAX_TERMS = 16
+
+
+def search_terms(query):
+    """Split a user supplied query into at most ``MAX_TERMS`` word terms."""
+    return re.findall(r"\w+", query.lower())[:MAX_TERMS]
+
+
+def fts_table(model):
+    return f"{model._meta.db_table}_fts"
+
+
+class SearchBackend:
+    """
+    Fallback for databases without a full-text engine: ``icontains`` on
+    every indexed column, unranked.
+    """
+
+    def index(self, model, objs, using):
+        pass
+
+    def remove(self, model, pks, using):
+        pass
+
+    def rebuild(self, model, using):
+        pass
+
+    def search(self, queryset, terms):
+        columns = SEARCH_FIELDS[queryset.model]
+        for term in terms:
+            queryset = queryset.filter(
+                reduce(
+                    operator.or_,
+                    (Q(**{f"{column}__icontains": term}) for column in columns),
+                )
+            )
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    FTS5 tables named ``<table>_fts`` holding a copy of the indexed columns
+    under the row's primary key as ``rowid``, written by the signal handlers
+    in ``todos.signals``. Terms match as prefixes and results are ranked with
+    BM25 (``rank``, configured with ``SEARCH_WEIGHTS``).
+    """
+
+    def index(self, model, objs, using):
+        columns = SEARCH_FIELDS[model]
+        rows = [
+            [obj.pk, *(getattr(obj, column) or "" for column in columns)]
+            for obj in objs
+        ]
+        if not rows:
+            return
+        placeholders = ", ".join(["%s"] * (len(columns) + 1))
+        with connections[using].cursor() as cursor:
+            cursor.executemany(
+                f'INSERT OR REPLACE INTO "{fts_table(model)}" '
+                f"(rowid, {', '.join(columns)}) VALUES ({placeholders})",
+                rows,
+            )
+
+    def remove(self, model, pks, using):
+        pks = list(pks)
+        if not pks:
+            return
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM "{fts_table(model)}" WHERE rowid IN '
+                f"({', '.join(['%s'] * len(pks))})",
+                pks,
+            )
+
+    def rebuild(self, model, using):
+        table, columns = fts_table(model), ", ".join(SEARCH_FIELDS[model])
+        weights = ", ".join(map(str, SEARCH_WEIGHTS[: len(SEARCH_FIELDS[model])]))
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{table}"')
+            cursor.execute(
+                f'INSERT INTO "{table}" ("{table}", rank) VALUES (%s, %s)',
+                ["rank", f"bm25({weights})"],
+            )
+            cursor.execute(
+                f'INSERT INTO "{table}" (rowid, {columns}) '
+                f'SELECT id, {columns} FROM "{model._meta.db_table}"'
+            )
+
+    def search(self, queryset, terms):
+        table = fts_table(queryset.model)
+        # A join, not a correlated subquery: FTS5 answers MATCH once and
+        # computes ``rank`` while walking the matches.
+        return queryset.extra(
+            select={"search_rank": f'-"{table}".rank'},
+            tables=[table],
+            where=[
+                f'"{table}" MATCH %s',
+                f'"{table}".rowid = "{queryset.model._meta.db_table}"."id"',
+            ],
+            params=[" ".join(f'"{term}"*' for term in terms)],
+        )
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    ``tsvector`` matching against the weighted ``search_vector`` of the
+    model, which a GIN expression index created by the migrations serves.
+    Terms match as prefixes and results are ranked with ``ts_rank``.
+    """
+
+    def search(self, queryset, terms):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        query = SearchQuery(
+            " & ".join(f"{term}:*" for term in terms),
+            config="english",
+            search_type="raw",
+        )
+        vector = search_vector(queryset.model)
+        return (
+            queryset.alias(search_document=vector)
+            .filter(search_document=query)
+            .annotate(search_rank=SearchRank(vector, query))
+        )
+
+
+def search_vector(model):
+    """The weighted ``tsvector`` expression indexed on Postgres."""
+    from django.contrib.postgres.search import SearchVector
+
+    return reduce(
+        operator.add,
+        (
+            SearchVector(column, weight=weight, config="english")
+            for column, weight in zip(SEARCH_FIELDS[model], "AB")
+        ),
+    )
+
+
+BACKENDS = {
+    "sqlite": SQLiteSearchBackend(),
+    "postgresql": PostgresSearchBackend(),
+}
+
+
+def get_backend(using):
+    return BACKENDS.get(connections[using].vendor, SearchBackend())
+
+
+def update_index(model, objs, using=None):
+    """Write ``objs`` to the search index, for writes that bypass signals."""
+    using = using or router.db_for_write(model)
+    get_backend(using).index(model, objs, using)
+
+
+def remove_from_index(model, pks, using=None):
+    using = using or router.db_for_write(model)
+    get_backend(using).remove(model, pks, using)
+
+
+def search(queryset, query):
+    """
+    Filter ``queryset`` to the rows matching every term of ``query`` and
+    annotate them with ``search_rank``, higher is better.
+    """
+    terms = search_terms(query)
+    if not terms:
+        rank = Value(0.0, output_field=FloatField())
+        return queryset.none().annotate(search_rank=rank)
+    return get_backend(queryset.db).search(queryset, terms)
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    ``SearchFilter`` answered by the full-text index of the view's model,
+    ordered by relevance unless ``OrderingFilter`` orders it.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms or queryset.model not in SEARCH_FIELDS:
+            return super().filter_queryset(request, queryset, view)
+        return search(queryset, " ".join(terms)).order_by("-search_rank", "-pk")
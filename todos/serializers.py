@@ -1,4 +1,14 @@
-from rest_framework import serializers
+import re
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from django.utils.text import get_valid_filename
+from rest_framework import permissions, serializers
+from rest_framework.fields import empty
+from rest_framework.relations import ManyRelatedField, RelatedField
+from .instrumentation import SerializerTimingMixin
 from .models import (
     Project,
     Milestone,
@@ -9,10 +19,243 @@ from .models import (
     Attachment,
     RecurringTask,
     ActivityLog,
+    ProjectStats,
+    MilestoneStats,
+    ImportJob,
+    Upload,
+    UploadPart,
 )
+from .stats import OPEN_COUNTERS
+
+
+def _split_param(value):
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+class SparseFieldsetMixin:
+    """
+    Lets clients choose the fields of a representation.
+
+    ``?fields=url,title`` keeps only the listed fields and ``?expand=project``
+    replaces the hyperlinks of the fields named in ``Meta.expandable_fields``
+    with the nested representation. Both only apply to the top-level
+    serializer of safe requests; ``fields`` and ``expand`` may also be passed
+    as keyword arguments.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        if request is not None and request.method in permissions.SAFE_METHODS:
+            if fields is None and "fields" in request.query_params:
+                fields = _split_param(request.query_params["fields"])
+            if expand is None and "expand" in request.query_params:
+                expand = _split_param(request.query_params["expand"])
+
+        expandable = getattr(self.Meta, "expandable_fields", {})
+        for name in expand or ():
+            if name not in expandable or name not in self.fields:
+                continue
+            serializer_class = expandable[name]
+            if "." not in serializer_class:
+                serializer_class = f"{__name__}.{serializer_class}"
+            many = isinstance(self.fields[name], ManyRelatedField)
+            self.fields[name] = import_string(serializer_class)(
+                many=many, read_only=True
+            )
+
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class RelatedObjectCache:
+    """
+    Resolves the objects referenced by a list of payloads with one query per
+    related queryset instead of one query per reference.
+
+    While ``collecting`` the lookups are only recorded; ``load()`` then
+    fetches them all and later lookups are answered from memory.
+    """
+
+    def __init__(self):
+        self.collecting = False
+        self.wanted = {}
+        self.objects = {}
+
+    def get(self, queryset, lookup_field, value):
+        key = (queryset.model, lookup_field)
+        if self.collecting:
+            self.wanted.setdefault(key, (queryset, set()))[1].add(str(value))
+            return None
+        try:
+            return self.objects[key][str(value)]
+        except KeyError:
+            raise queryset.model.DoesNotExist
+
+    def load(self):
+        for (model, lookup_field), (queryset, values) in self.wanted.items():
+            found = queryset.filter(**{f"{lookup_field}__in": values})
+            self.objects[model, lookup_field] = {
+                str(getattr(obj, lookup_field)): obj for obj in found
+            }
+
+
+class CachedHyperlinkedRelatedField(serializers.HyperlinkedRelatedField):
+    """Looks objects up in the context's ``RelatedObjectCache`` when present."""
+
+    def get_object(self, view_name, view_args, view_kwargs):
+        cache = self.context.get("related_object_cache")
+        if cache is None:
+            return super().get_object(view_name, view_args, view_kwargs)
+        value = view_kwargs[self.lookup_url_kwarg]
+        return cache.get(self.get_queryset(), self.lookup_field, value)
+
+
+class TemplatedHyperlinkedIdentityField(serializers.HyperlinkedIdentityField):
+    """
+    Reverses the URL once per format, then substitutes each object's lookup
+    value, for serializers rendering thousands of objects. Like any bound
+    field, it serves a single request.
+    """
+
+    placeholder = "__lookup__"
+
+    def get_url(self, obj, view_name, request, format):
+        value = getattr(obj, self.lookup_field)
+        if value in (None, ""):
+            return None
+        templates = self.__dict__.setdefault("_url_templates", {})
+        if format not in templates:
+            kwargs = {self.lookup_url_kwarg: self.placeholder}
+            templates[format] = self.reverse(
+                view_name, kwargs=kwargs, request=request, format=format
+            )
+        return templates[format].replace(self.placeholder, str(value))
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    List serializer that validates and saves many objects in a constant
+    number of queries.
+
+    Related objects referenced by the payloads are fetched up front through a
+    ``RelatedObjectCache``. Updates match payloads to the ``instance`` list by
+    their ``id``. Objects are written with ``bulk_create``/``bulk_update``,
+    which do not send model signals.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            cache = self._context["related_object_cache"] = RelatedObjectCache()
+            cache.collecting = True
+            try:
+                self.collect_references(data)
+            finally:
+                cache.collecting = False
+            cache.load()
+        if self.instance is not None:
+            self.targets = []
+            self.instance_map = {obj.pk: obj for obj in self.instance}
+        return super().to_internal_value(data)
+
+    def collect_references(self, data):
+        fields = [
+            field
+            for field in self.child._writable_fields
+            if isinstance(field, (RelatedField, ManyRelatedField))
+        ]
+        for item in data:
+            if not isinstance(item, dict):
+                continue
+            for field in fields:
+                value = field.get_value(item)
+                if value is empty or value is None:
+                    continue
+                try:
+                    field.to_internal_value(value)
+                except serializers.ValidationError:
+                    pass
+
+    def run_child_validation(self, data):
+        if self.instance is None:
+            return super().run_child_validation(data)
+        try:
+            instance = self.instance_map[int(data["id"])]
+        except (KeyError, TypeError, ValueError):
+            raise serializers.ValidationError({"id": ["Unknown or missing id."]})
+        self.child.instance = instance
+        self.child.initial_data = data
+        self.targets.append(instance)
+        return super().run_child_validation(data)
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        m2m_names = {field.name for field in model._meta.many_to_many}
+        instances, m2m = [], []
+        for attrs in validated_data:
+            related = {name: attrs.pop(name) for name in m2m_names & set(attrs)}
+            instance = model(**attrs)
+            instances.append(instance)
+            m2m.extend((instance, name, objs) for name, objs in related.items())
+        with transaction.atomic():
+            model.objects.bulk_create(instances)
+            self.set_many_to_many(m2m)
+        return instances
+
+    def update(self, instances, validated_data):
+        model = self.child.Meta.model
+        m2m_names = {field.name for field in model._meta.many_to_many}
+        now = timezone.now()
+        fields, m2m = set(), []
+        for instance, attrs in zip(self.targets, validated_data):
+            for name, value in attrs.items():
+                if name in m2m_names:
+                    m2m.append((instance, name, value))
+                else:
+                    setattr(instance, name, value)
+                    fields.add(name)
+            for field in model._meta.concrete_fields:
+                if getattr(field, "auto_now", False):
+                    setattr(instance, field.attname, now)
+                    fields.add(field.name)
+        with transaction.atomic():
+            if fields:
+                model.objects.bulk_update(self.targets, fields)
+            self.set_many_to_many(m2m, replace=True)
+        return self.targets
+
+    def set_many_to_many(self, assignments, replace=False):
+        """Write ``(instance, field name, objects)`` assignments in bulk."""
+        model = self.child.Meta.model
+        for field in model._meta.many_to_many:
+            rows = [
+                (obj, objs) for obj, name, objs in assignments if name == field.name
+            ]
+            if not rows:
+                continue
+            through = field.remote_field.through
+            source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+            if replace:
+                through.objects.filter(
+                    **{f"{source}__in": [obj.pk for obj, objs in rows]}
+                ).delete()
+            through.objects.bulk_create(
+                [
+                    through(**{f"{source}_id": obj.pk, f"{target}_id": pk})
+                    for obj, objs in rows
+                    for pk in {related.pk for related in objs}
+                ]
+            )
+
+
+class DynamicHyperlinkedModelSerializer(
+    SerializerTimingMixin, SparseFieldsetMixin, serializers.HyperlinkedModelSerializer
+):
+    serializer_related_field = CachedHyperlinkedRelatedField
 
 
-class ProjectSerializer(serializers.HyperlinkedModelSerializer):
+class ProjectSerializer(DynamicHyperlinkedModelSerializer):
     milestones = serializers.HyperlinkedRelatedField(
         many=True, view_name="milestone-detail", read_only=True
     )
@@ -34,6 +277,10 @@ class ProjectSerializer(serializers.HyperlinkedModelSerializer):
             "milestones",
             "todos",
         ]
+        expandable_fields = {
+            "milestones": "MilestoneSerializer",
+            "todos": "TodoSerializer",
+        }
         extra_kwargs = {
             "url": {"view_name": "project-detail"},
             "owner": {"view_name": "user-detail"},
@@ -41,7 +288,7 @@ class ProjectSerializer(serializers.HyperlinkedModelSerializer):
         }
 
 
-class MilestoneSerializer(serializers.HyperlinkedModelSerializer):
+class MilestoneSerializer(DynamicHyperlinkedModelSerializer):
     todos = serializers.HyperlinkedRelatedField(
         many=True, view_name="todo-detail", read_only=True
     )
@@ -49,13 +296,14 @@ class MilestoneSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Milestone
         fields = ["url", "id", "project", "name", "due_date", "todos"]
+        expandable_fields = {"project": "ProjectSerializer", "todos": "TodoSerializer"}
         extra_kwargs = {
             "url": {"view_name": "milestone-detail"},
             "project": {"view_name": "project-detail"},
         }
 
 
-class CategorySerializer(serializers.HyperlinkedModelSerializer):
+class CategorySerializer(DynamicHyperlinkedModelSerializer):
     todos = serializers.HyperlinkedRelatedField(
         many=True, view_name="todo-detail", read_only=True
     )
@@ -63,13 +311,14 @@ class CategorySerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Category
         fields = ["url", "id", "name", "project", "todos"]
+        expandable_fields = {"project": "ProjectSerializer", "todos": "TodoSerializer"}
         extra_kwargs = {
             "url": {"view_name": "category-detail"},
             "project": {"view_name": "project-detail"},
         }
 
 
-class TagSerializer(serializers.HyperlinkedModelSerializer):
+class TagSerializer(DynamicHyperlinkedModelSerializer):
     todos = serializers.HyperlinkedRelatedField(
         many=True, view_name="todo-detail", read_only=True
     )
@@ -77,15 +326,17 @@ class TagSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Tag
         fields = ["url", "id", "name", "todos"]
+        expandable_fields = {"todos": "TodoSerializer"}
         extra_kwargs = {
             "url": {"view_name": "tag-detail"},
         }
 
 
-class CommentSerializer(serializers.HyperlinkedModelSerializer):
+class CommentSerializer(DynamicHyperlinkedModelSerializer):
     class Meta:
         model = Comment
-        fields = ["url", "id", "todo", "user", "content", "created_at"]
+        fields = ["url", "id", "todo", "user", "content", "created_at", "updated_at"]
+        expandable_fields = {"todo": "TodoSerializer"}
         extra_kwargs = {
             "url": {"view_name": "comment-detail"},
             "todo": {"view_name": "todo-detail"},
@@ -93,10 +344,11 @@ class CommentSerializer(serializers.HyperlinkedModelSerializer):
         }
 
 
-class AttachmentSerializer(serializers.HyperlinkedModelSerializer):
+class AttachmentSerializer(DynamicHyperlinkedModelSerializer):
     class Meta:
         model = Attachment
         fields = ["url", "id", "todo", "file", "uploaded_by", "uploaded_at"]
+        expandable_fields = {"todo": "TodoSerializer"}
         extra_kwargs = {
             "url": {"view_name": "attachment-detail"},
             "todo": {"view_name": "todo-detail"},
@@ -104,17 +356,26 @@ class AttachmentSerializer(serializers.HyperlinkedModelSerializer):
         }
 
 
-class RecurringTaskSerializer(serializers.HyperlinkedModelSerializer):
+class RecurringTaskSerializer(DynamicHyperlinkedModelSerializer):
     class Meta:
         model = RecurringTask
-        fields = ["url", "id", "todo", "frequency", "start_date", "end_date"]
+        fields = [
+            "url",
+            "id",
+            "todo",
+            "frequency",
+            "start_date",
+            "end_date",
+            "next_run_at",
+        ]
+        expandable_fields = {"todo": "TodoSerializer"}
         extra_kwargs = {
             "url": {"view_name": "recurringtask-detail"},
             "todo": {"view_name": "todo-detail"},
         }
 
 
-class TodoSerializer(serializers.HyperlinkedModelSerializer):
+class TodoSerializer(DynamicHyperlinkedModelSerializer):
     comments = CommentSerializer(many=True, read_only=True)
     attachments = AttachmentSerializer(many=True, read_only=True)
     recurring_task = RecurringTaskSerializer(read_only=True)
@@ -124,6 +385,7 @@ class TodoSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = Todo
+        list_serializer_class = BulkListSerializer
         fields = [
             "url",
             "id",
@@ -141,12 +403,22 @@ class TodoSerializer(serializers.HyperlinkedModelSerializer):
             "actual_time",
             "parent_task",
             "subtasks",
+            "recurrence",
+            "occurrence_at",
             "created_at",
             "updated_at",
             "comments",
             "attachments",
             "recurring_task",
         ]
+        expandable_fields = {
+            "project": "ProjectSerializer",
+            "category": "CategorySerializer",
+            "milestone": "MilestoneSerializer",
+            "tags": "TagSerializer",
+            "parent_task": "TodoSerializer",
+            "subtasks": "TodoSerializer",
+        }
         extra_kwargs = {
             "url": {"view_name": "todo-detail"},
             "user": {"view_name": "user-detail"},
@@ -155,10 +427,179 @@ class TodoSerializer(serializers.HyperlinkedModelSerializer):
             "milestone": {"view_name": "milestone-detail"},
             "tags": {"view_name": "tag-detail", "many": True},
             "parent_task": {"view_name": "todo-detail"},
+            "recurrence": {"view_name": "recurringtask-detail", "read_only": True},
+            "occurrence_at": {"read_only": True},
         }
 
 
-class ActivityLogSerializer(serializers.HyperlinkedModelSerializer):
+class TodoTreeSerializer(SerializerTimingMixin, serializers.HyperlinkedModelSerializer):
+    """
+    A node of ``todos.tree.assemble``: the todo, the rollup of its subtree
+    and its subtasks, null where the depth limit cut them off.
+    """
+
+    serializer_url_field = TemplatedHyperlinkedIdentityField
+    depth = serializers.IntegerField(read_only=True)
+    rollup = serializers.SerializerMethodField()
+    subtasks = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Todo
+        fields = [
+            "url",
+            "id",
+            "title",
+            "completed",
+            "priority",
+            "due_date",
+            "estimated_time",
+            "actual_time",
+            "depth",
+            "rollup",
+            "subtasks",
+        ]
+        extra_kwargs = {"url": {"view_name": "todo-detail"}}
+
+    def get_rollup(self, obj):
+        duration = self.fields["estimated_time"]
+        return {
+            **obj.rollup,
+            "estimated_time": duration.to_representation(obj.rollup["estimated_time"]),
+            "actual_time": duration.to_representation(obj.rollup["actual_time"]),
+        }
+
+    def get_subtasks(self, obj):
+        if obj.children is None:
+            return None
+        return [self.to_representation(child) for child in obj.children]
+
+
+class NameListField(serializers.ListField):
+    """A list of names, also accepted as one comma separated string."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = [name.strip() for name in data.split(",") if name.strip()]
+        return super().to_internal_value(data)
+
+
+class TodoImportRowSerializer(serializers.ModelSerializer):
+    """
+    A row of an import file. Category, milestone and tags are referenced by
+    name; a missing milestone is created when ``milestone_due_date`` is given.
+    """
+
+    category = serializers.CharField(max_length=100, required=False)
+    milestone = serializers.CharField(max_length=255, required=False)
+    milestone_due_date = serializers.DateField(required=False)
+    tags = NameListField(child=serializers.CharField(max_length=50), default=list)
+
+    class Meta:
+        model = Todo
+        fields = [
+            "title",
+            "description",
+            "completed",
+            "priority",
+            "due_date",
+            "estimated_time",
+            "actual_time",
+            "category",
+            "milestone",
+            "milestone_due_date",
+            "tags",
+        ]
+
+
+class ImportJobSerializer(DynamicHyperlinkedModelSerializer):
+    class Meta:
+        model = ImportJob
+        fields = [
+            "url",
+            "id",
+            "project",
+            "user",
+            "file",
+            "format",
+            "status",
+            "rows_processed",
+            "created_count",
+            "error_count",
+            "errors",
+            "failure",
+            "created_at",
+            "updated_at",
+        ]
+        read_only_fields = [
+            "user",
+            "status",
+            "rows_processed",
+            "created_count",
+            "error_count",
+            "errors",
+            "failure",
+        ]
+        extra_kwargs = {
+            "url": {"view_name": "importjob-detail"},
+            "project": {"view_name": "project-detail"},
+            "user": {"view_name": "user-detail"},
+            "format": {"required": False},
+        }
+
+    def validate(self, attrs):
+        if not attrs.get("format"):
+            name = attrs["file"].name.lower()
+            attrs["format"] = "csv" if name.endswith(".csv") else "ndjson"
+        return attrs
+
+
+class UploadPartSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadPart
+        fields = ["number", "size", "sha256"]
+
+
+class UploadSerializer(DynamicHyperlinkedModelSerializer):
+    parts = UploadPartSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Upload
+        fields = [
+            "url",
+            "id",
+            "todo",
+            "user",
+            "filename",
+            "size",
+            "sha256",
+            "status",
+            "attachment",
+            "parts",
+            "created_at",
+            "updated_at",
+        ]
+        read_only_fields = ["user", "status", "attachment"]
+        extra_kwargs = {
+            "url": {"view_name": "upload-detail"},
+            "todo": {"view_name": "todo-detail"},
+            "user": {"view_name": "user-detail"},
+            "attachment": {"view_name": "attachment-detail"},
+        }
+
+    def validate_filename(self, value):
+        try:
+            return get_valid_filename(value.replace("\\", "/").rsplit("/", 1)[-1])
+        except SuspiciousFileOperation:
+            raise serializers.ValidationError("Enter a valid file name.")
+
+    def validate_sha256(self, value):
+        value = value.lower()
+        if value and not re.fullmatch(r"[0-9a-f]{64}", value):
+            raise serializers.ValidationError("Enter a hex SHA-256 digest.")
+        return value
+
+
+class ActivityLogSerializer(DynamicHyperlinkedModelSerializer):
     class Meta:
         model = ActivityLog
         fields = ["url", "id", "user", "action", "target", "timestamp"]
@@ -166,3 +607,45 @@ class ActivityLogSerializer(serializers.HyperlinkedModelSerializer):
             "url": {"view_name": "activitylog-detail"},
             "user": {"view_name": "user-detail"},
         }
+
+
+class TodoStatsSerializer(SerializerTimingMixin, serializers.ModelSerializer):
+    open = serializers.IntegerField(read_only=True)
+    overdue = serializers.IntegerField(read_only=True)
+    open_by_priority = serializers.SerializerMethodField()
+
+    class Meta:
+        fields = [
+            "total",
+            "open",
+            "completed",
+            "overdue",
+            "open_by_priority",
+            "estimated_time",
+            "actual_time",
+        ]
+
+    def get_open_by_priority(self, obj):
+        return {
+            priority: getattr(obj, name) for priority, name in OPEN_COUNTERS.items()
+        }
+
+
+class ProjectStatsSerializer(TodoStatsSerializer):
+    project = serializers.HyperlinkedRelatedField(
+        view_name="project-detail", read_only=True
+    )
+
+    class Meta(TodoStatsSerializer.Meta):
+        model = ProjectStats
+        fields = ["project", *TodoStatsSerializer.Meta.fields]
+
+
+class MilestoneStatsSerializer(TodoStatsSerializer):
+    milestone = serializers.HyperlinkedRelatedField(
+        view_name="milestone-detail", read_only=True
+    )
+
+    class Meta(TodoStatsSerializer.Meta):
+        model = MilestoneStats
+        fields = ["milestone", *TodoStatsSerializer.Meta.fields]
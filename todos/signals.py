@@ -1,18 +1,381 @@
-from django.db.models.signals import post_save, post_delete
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
 from django.dispatch import receiver
-from .models import Todo, ActivityLog
+from rest_framework.authtoken.models import Token
+from . import inbox, stats, sync
+from .activity import activity_log
+from .authentication import token_cache
+from .conditional import touch
+from .feed import publish, publish_many
+from .instrumentation import record_query
+from .membership import forget_memberships, project_id_of
+from .models import (
+    Attachment,
+    Category,
+    Comment,
+    Milestone,
+    Project,
+    RecurringTask,
+    Tag,
+    Todo,
+    UploadPart,
+)
+from .response_cache import response_cache
+from .search import remove_from_index, update_index
+from .uploads import delete_files, release
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
 
 
 @receiver(post_save, sender=Todo)
 def log_todo_creation(sender, instance, created, **kwargs):
     if created:
-        ActivityLog.objects.create(
-            user=instance.user, action="created", target=f"Todo: {instance.title}"
+        activity_log.record(
+            instance.user_id,
+            "created",
+            f"Todo: {instance.title}",
+            using=kwargs["using"],
         )
 
 
 @receiver(post_delete, sender=Todo)
 def log_todo_deletion(sender, instance, **kwargs):
-    ActivityLog.objects.create(
-        user=instance.user, action="deleted", target=f"Todo: {instance.title}"
+    activity_log.record(
+        instance.user_id, "deleted", f"Todo: {instance.title}", using=kwargs["using"]
+    )
+
+
+@receiver(m2m_changed, sender=Project.members.through)
+def forget_changed_memberships(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ("post_add", "post_remove"):
+        ids = pk_set
+    elif action == "pre_clear":
+        related = instance.projects if reverse else instance.members
+        ids = related.values_list("pk", flat=True)
+    else:
+        return
+    if reverse:
+        pairs = [(project_id, instance.pk) for project_id in ids]
+    else:
+        pairs = [(instance.pk, user_id) for user_id in ids]
+    forget_memberships(pairs, using=kwargs["using"])
+
+
+@receiver(pre_delete, sender=Project)
+def forget_deleted_project_members(sender, instance, **kwargs):
+    members = instance.members.values_list("pk", flat=True)
+    forget_memberships(
+        [(instance.pk, user_id) for user_id in members], using=kwargs["using"]
+    )
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    token_cache.forget([instance.key], using=kwargs["using"])
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def forget_saved_user_tokens(sender, instance, created, update_fields, **kwargs):
+    # Logins only stamp ``last_login``.
+    if created or update_fields == frozenset(["last_login"]):
+        return
+    keys = Token.objects.using(kwargs["using"]).filter(user_id=instance.pk)
+    token_cache.forget(keys.values_list("key", flat=True), using=kwargs["using"])
+
+
+@receiver(post_delete, sender=UploadPart)
+def delete_part_file(sender, instance, **kwargs):
+    delete_files([instance.file], using=kwargs["using"])
+
+
+@receiver(post_delete, sender=Attachment)
+def release_attachment_blob(sender, instance, **kwargs):
+    if instance.blob_id is not None:
+        release(instance.blob_id, using=kwargs["using"])
+
+
+def _moved(instance, attname, created):
+    """Values of ``attname`` whose containers gained or lost ``instance``."""
+    current = getattr(instance, attname)
+    if created:
+        return {current}
+    previous = instance.loaded_value(attname, current)
+    return {previous, current} if previous != current else set()
+
+
+@receiver(post_save, sender=Todo)
+def touch_todo_containers(sender, instance, created, **kwargs):
+    touch(Project, _moved(instance, "project_id", created), using=kwargs["using"])
+    touch(Todo, _moved(instance, "parent_task_id", created), using=kwargs["using"])
+
+
+@receiver(post_delete, sender=Todo)
+def touch_deleted_todo_containers(sender, instance, **kwargs):
+    touch(Project, [instance.project_id], using=kwargs["using"])
+    touch(Todo, [instance.parent_task_id], using=kwargs["using"])
+
+
+@receiver(post_save, sender=Milestone)
+def touch_milestone_project(sender, instance, created, **kwargs):
+    touch(Project, _moved(instance, "project_id", created), using=kwargs["using"])
+
+
+@receiver(post_delete, sender=Milestone)
+def touch_deleted_milestone_project(sender, instance, **kwargs):
+    touch(Project, [instance.project_id], using=kwargs["using"])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Attachment)
+@receiver(post_delete, sender=Attachment)
+def touch_nesting_todo(sender, instance, **kwargs):
+    touch(Todo, [instance.todo_id], using=kwargs["using"])
+
+
+@receiver(m2m_changed, sender=Project.members.through)
+@receiver(m2m_changed, sender=Todo.tags.through)
+def touch_many_to_many_owner(sender, instance, action, reverse, pk_set, **kwargs):
+    model = Project if sender is Project.members.through else Todo
+    if not reverse:
+        if action.startswith("post_"):
+            touch(model, [instance.pk], using=kwargs["using"])
+    elif action in ("post_add", "post_remove"):
+        touch(model, pk_set, using=kwargs["using"])
+    elif action == "pre_clear":
+        related = instance.projects if model is Project else instance.todos
+        touch(model, related.values_list("pk", flat=True), using=kwargs["using"])
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_cached_responses(sender, **kwargs):
+    response_cache.invalidate([sender], using=kwargs["using"])
+
+
+@receiver(post_save, sender=Milestone)
+def invalidate_milestone_responses(sender, instance, created, **kwargs):
+    models = [Milestone]
+    if _moved(instance, "project_id", created):
+        models.append(Project)
+    response_cache.invalidate(models, using=kwargs["using"])
+
+
+@receiver(post_delete, sender=Milestone)
+def invalidate_deleted_milestone_responses(sender, **kwargs):
+    response_cache.invalidate([Milestone, Project], using=kwargs["using"])
+
+
+@receiver(post_save, sender=Todo)
+def invalidate_todo_container_responses(sender, instance, created, **kwargs):
+    containers = {
+        "project_id": Project,
+        "milestone_id": Milestone,
+        "category_id": Category,
+    }
+    models = [
+        model
+        for attname, model in containers.items()
+        if _moved(instance, attname, created)
+    ]
+    response_cache.invalidate(models, using=kwargs["using"])
+
+
+@receiver(post_delete, sender=Todo)
+def invalidate_deleted_todo_responses(sender, **kwargs):
+    response_cache.invalidate(
+        [Project, Milestone, Category, Tag], using=kwargs["using"]
     )
+
+
+@receiver(m2m_changed, sender=Project.members.through)
+@receiver(m2m_changed, sender=Todo.tags.through)
+def invalidate_many_to_many_responses(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        model = Project if sender is Project.members.through else Tag
+        response_cache.invalidate([model], using=kwargs["using"])
+
+
+@receiver(post_save, sender=Todo)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Project)
+def index_searchable(sender, instance, **kwargs):
+    update_index(sender, [instance], using=kwargs["using"])
+
+
+@receiver(post_delete, sender=Todo)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Project)
+def unindex_searchable(sender, instance, **kwargs):
+    remove_from_index(sender, [instance.pk], using=kwargs["using"])
+
+
+@receiver(post_save, sender=Todo)
+def count_saved_todo(sender, instance, created, **kwargs):
+    before = None if created else stats.tracked_values(instance, loaded=True)
+    stats.record([(before, stats.tracked_values(instance))], using=kwargs["using"])
+
+
+@receiver(post_delete, sender=Todo)
+def count_deleted_todo(sender, instance, **kwargs):
+    before = stats.tracked_values(instance, loaded=True)
+    stats.record([(before, None)], using=kwargs["using"])
+
+
+@receiver(post_save, sender=Todo)
+def update_inbox(sender, instance, created, **kwargs):
+    inbox.record([instance], created, using=kwargs["using"])
+
+
+@receiver(post_save, sender=Todo)
+@receiver(post_save, sender=Milestone)
+def publish_saved(sender, instance, created, **kwargs):
+    # A moved object is published to the project it left too.
+    projects = _moved(instance, "project_id", created) or {instance.project_id}
+    action = "created" if created else "updated"
+    publish(instance, action, projects, using=kwargs["using"])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Attachment)
+def publish_saved_todo_child(sender, instance, created, **kwargs):
+    action = "created" if created else "updated"
+    publish(instance, action, using=kwargs["using"])
+
+
+@receiver(post_delete, sender=Todo)
+@receiver(post_delete, sender=Milestone)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Attachment)
+def publish_deleted(sender, instance, **kwargs):
+    publish(instance, "deleted", using=kwargs["using"])
+
+
+def _record_saved(model, objs, created, using):
+    """
+    Record saved ``objs`` for sync, with tombstones in the projects they
+    left; the comments of moved todos move along.
+    """
+    changes, moves = [], {}
+    for obj in objs:
+        left = _moved(obj, "project_id", created) - {obj.project_id}
+        changes.extend((obj.pk, project_id, True) for project_id in left)
+        changes.append((obj.pk, obj.project_id, False))
+        if left:
+            moves[obj.pk] = left
+    sync.record(model, changes, using=using)
+    if model is Todo and moves:
+        comments = Comment.objects.using(using).filter(todo__in=moves)
+        changes = []
+        for pk, todo_id, project_id in comments.values_list(
+            "pk", "todo_id", "todo__project_id"
+        ):
+            changes.extend((pk, left, True) for left in moves[todo_id])
+            changes.append((pk, project_id, False))
+        sync.record(Comment, changes, using=using)
+
+
+@receiver(post_save, sender=Todo)
+@receiver(post_save, sender=Milestone)
+@receiver(post_save, sender=Category)
+def record_saved_change(sender, instance, created, **kwargs):
+    _record_saved(sender, [instance], created, kwargs["using"])
+
+
+@receiver(post_save, sender=Comment)
+def record_saved_comment(sender, instance, **kwargs):
+    changes = [(instance.pk, project_id_of(instance), False)]
+    sync.record(Comment, changes, using=kwargs["using"])
+
+
+@receiver(post_delete, sender=Todo)
+@receiver(post_delete, sender=Milestone)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Comment)
+def record_deleted_change(sender, instance, **kwargs):
+    changes = [(instance.pk, project_id_of(instance), True)]
+    sync.record(sender, changes, using=kwargs["using"])
+
+
+def todos_bulk_created(todos, using=None):
+    """
+    Apply to todos inserted with ``bulk_create``, which sends no signals,
+    what the receivers in this module apply to todos saved one at a time.
+    """
+    touch(Project, {todo.project_id for todo in todos}, using=using)
+    touch(Todo, {todo.parent_task_id for todo in todos}, using=using)
+    response_cache.invalidate([Project, Milestone, Category, Tag], using=using)
+    update_index(Todo, todos, using=using)
+    stats.record([(None, stats.tracked_values(todo)) for todo in todos], using=using)
+    inbox.record(todos, True, using=using)
+    activity_log.record_many(
+        [
+            activity_log.entry(todo.user_id, "created", f"Todo: {todo.title}")
+            for todo in todos
+        ],
+        using=using,
+    )
+    publish_many(Todo, todos, "created", using=using)
+    _record_saved(Todo, todos, True, using)
+
+
+def todos_bulk_updated(todos, using=None):
+    """``todos_bulk_created`` for todos written with ``bulk_update``."""
+    # Changing project or parent adds and removes subtasks from both.
+    for attname, model in [("project_id", Project), ("parent_task_id", Todo)]:
+        moved = set().union(*(_moved(todo, attname, False) for todo in todos))
+        touch(model, moved, using=using)
+    response_cache.invalidate([Project, Milestone, Category, Tag], using=using)
+    update_index(Todo, todos, using=using)
+    stats.record(
+        [
+            (stats.tracked_values(todo, loaded=True), stats.tracked_values(todo))
+            for todo in todos
+        ],
+        using=using,
+    )
+    inbox.record(todos, using=using)
+    projects = [
+        _moved(todo, "project_id", False) or {todo.project_id} for todo in todos
+    ]
+    publish_many(Todo, todos, "updated", projects, using=using)
+    _record_saved(Todo, todos, False, using)
+    for todo in todos:
+        remember_saved_values(Todo, todo)
+
+
+def containers_bulk_created(model, objs, using=None):
+    """``todos_bulk_created`` for categories or milestones."""
+    if not objs:
+        return
+    models = [model]
+    if model is Milestone:
+        touch(Project, {obj.project_id for obj in objs}, using=using)
+        models.append(Project)
+        publish_many(Milestone, objs, "created", using=using)
+    response_cache.invalidate(models, using=using)
+    _record_saved(model, objs, True, using)
+
+
+@receiver(post_save, sender=Milestone)
+@receiver(post_save, sender=Todo)
+@receiver(post_save, sender=RecurringTask)
+@receiver(post_save, sender=Category)
+def remember_saved_values(sender, instance, **kwargs):
+    # Receivers above compare against the loaded values; registered last so
+    # a later save of the same instance compares against this one.
+    deferred = instance.get_deferred_fields()
+    instance._loaded_values = {
+        field.attname: getattr(instance, field.attname)
+        for field in sender._meta.concrete_fields
+        if field.attname not in deferred
+    }
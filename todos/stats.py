@@ -0,0 +1,166 @@
+from datetime import timedelta
+
+from django.db import router
+from django.db.models import Count, DurationField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Milestone, MilestoneStats, Project, ProjectStats, Todo
+
+# Stats model of each container and the todo field referencing it.
+SCOPES = {
+    Project: (ProjectStats, "project"),
+    Milestone: (MilestoneStats, "milestone"),
+}
+OPEN_COUNTERS = {
+    "LOW": "open_low",
+    "MEDIUM": "open_medium",
+    "HIGH": "open_high",
+    "URGENT": "open_urgent",
+}
+DURATIONS = ["estimated_time", "actual_time"]
+COUNTERS = ["total", "completed", *OPEN_COUNTERS.values(), *DURATIONS]
+# Todo columns the counters are computed from.
+TRACKED = ["project_id", "milestone_id", "completed", "priority", *DURATIONS]
+
+
+def tracked_values(todo, loaded=False):
+    """
+    The values of ``todo`` the counters depend on, as saved (``loaded``) or
+    as currently set on the instance.
+    """
+    if loaded:
+        return {name: todo.loaded_value(name, getattr(todo, name)) for name in TRACKED}
+    return {name: getattr(todo, name) for name in TRACKED}
+
+
+def _zero():
+    return {name: timedelta() if name in DURATIONS else 0 for name in COUNTERS}
+
+
+def _add(deltas, values, sign):
+    for container, (model, field) in SCOPES.items():
+        pk = values[f"{field}_id"]
+        if pk is None:
+            continue
+        delta = deltas.setdefault((container, pk), _zero())
+        delta["total"] += sign
+        if values["completed"]:
+            delta["completed"] += sign
+        elif values["priority"] in OPEN_COUNTERS:
+            delta[OPEN_COUNTERS[values["priority"]]] += sign
+        for name in DURATIONS:
+            if values[name] is not None:
+                delta[name] += sign * values[name]
+
+
+def record(changes, using=None):
+    """
+    Apply ``(before, after)`` pairs of ``tracked_values``, None for a todo
+    created or deleted, to the counters.
+
+    Changes are netted per container first, so saves leaving the tracked
+    values alone cost no query and bulk writes one ``UPDATE`` per container.
+    Counters are built lazily: a container without a stats row yet gets one
+    from ``rebuild`` when a todo is saved into it.
+    """
+    deltas, current = {}, set()
+    for before, after in changes:
+        if before is not None:
+            _add(deltas, before, -1)
+        if after is not None:
+            _add(deltas, after, 1)
+            current.update(
+                (container, after[f"{field}_id"])
+                for container, (model, field) in SCOPES.items()
+            )
+    missing = {}
+    for (container, pk), delta in deltas.items():
+        delta = {name: value for name, value in delta.items() if value}
+        if not delta:
+            continue
+        model = SCOPES[container][0]
+        db = using or router.db_for_write(model)
+        updated = (
+            model._base_manager.using(db)
+            .filter(pk=pk)
+            .update(**{name: F(name) + value for name, value in delta.items()})
+        )
+        if not updated and (container, pk) in current:
+            missing.setdefault(container, set()).add(pk)
+    for container, pks in missing.items():
+        rebuild(container, pks, using=using)
+
+
+def aggregate(todos, field):
+    """Yield ``(pk, counters)`` of ``todos`` grouped by ``field``."""
+    # Annotations are prefixed: some counters share the name of a column.
+    expressions = {
+        "total": Count("pk"),
+        "completed": Count("pk", filter=Q(completed=True)),
+        **{
+            name: Count("pk", filter=Q(completed=False, priority=priority))
+            for priority, name in OPEN_COUNTERS.items()
+        },
+        **{
+            name: Coalesce(Sum(name), Value(timedelta()), output_field=DurationField())
+            for name in DURATIONS
+        },
+    }
+    rows = (
+        todos.order_by()
+        .values(field)
+        .annotate(**{f"count_{name}": value for name, value in expressions.items()})
+    )
+    for row in rows:
+        yield row[field], {name: row[f"count_{name}"] for name in COUNTERS}
+
+
+def rebuild(container, pks=None, using=None, batch_size=1000):
+    """
+    Recompute the counters of the ``container`` rows in ``pks``, of every
+    row if None, with one aggregate query, and upsert them in batches.
+    """
+    model, field = SCOPES[container]
+    using = using or router.db_for_write(model)
+    containers = container._base_manager.using(using)
+    todos = Todo._base_manager.using(using)
+    if pks is not None:
+        containers = containers.filter(pk__in=pks)
+        todos = todos.filter(**{f"{field}__in": pks})
+    counters = dict(aggregate(todos, field))
+    rows = [
+        model(**{f"{field}_id": pk}, **counters.get(pk, _zero()))
+        for pk in containers.values_list("pk", flat=True).iterator()
+    ]
+    model._base_manager.using(using).bulk_create(
+        rows,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=[field],
+        update_fields=COUNTERS,
+    )
+    return len(rows)
+
+
+def get_stats(obj, using=None):
+    """
+    Return the stats row of the project or milestone ``obj``, building it
+    if missing, with ``overdue`` set.
+
+    Being relative to the current time, the overdue count is not stored but
+    counted on the partial index of open todos by container and due date.
+    """
+    model, field = SCOPES[type(obj)]
+    using = using or router.db_for_read(model)
+    try:
+        stats = model._base_manager.using(using).get(pk=obj.pk)
+    except model.DoesNotExist:
+        rebuild(type(obj), [obj.pk], using=using)
+        stats = model._base_manager.using(using).get(pk=obj.pk)
+    stats.overdue = (
+        Todo._base_manager.using(using)
+        .filter(**{field: obj.pk}, completed=False, due_date__lt=timezone.now())
+        .count()
+    )
+    return stats
@@ -0,0 +1,49 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+_done = object()
+
+
+class ThreadedIterator:
+    """
+    Iterates a sync iterator from the event loop, fetching each item in the
+    request's thread, where database cursors and files it reads stay usable.
+
+    ``close`` closes the iterator; streaming responses call it when they are
+    closed, whether or not the content was read to the end.
+    """
+
+    def __init__(self, iterator):
+        self.iterator = iter(iterator)
+        self.fetch = sync_to_async(next)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self.fetch(self.iterator, _done)
+        if item is _done:
+            raise StopAsyncIteration
+        return item
+
+    def close(self):
+        close = getattr(self.iterator, "close", None)
+        if close is not None:
+            close()
+
+
+def is_asgi(request):
+    """Whether ``request``, a Django or REST framework one, came in over ASGI."""
+    return isinstance(getattr(request, "_request", request), ASGIRequest)
+
+
+def streaming_content(request, iterator):
+    """
+    Return ``iterator`` as the content of a streaming response to
+    ``request``. Under ASGI, Django reads sync content to the end before
+    sending any of it, so it is wrapped in a ``ThreadedIterator`` there and
+    only one chunk is held at a time.
+    """
+    if is_asgi(request):
+        return ThreadedIterator(iterator)
+    return iterator
@@ -0,0 +1,189 @@
+import re
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .export import FlatSerializer
+from .models import Category, ChangeRecord, Comment, Milestone, SyncSequence, Todo
+
+# Record names of the synced models and the fields sent for them.
+SYNC_MODELS = {
+    Todo: (
+        "todo",
+        [
+            "id",
+            "title",
+            "description",
+            "completed",
+            "user",
+            "project",
+            "category",
+            "milestone",
+            "parent_task",
+            "priority",
+            "due_date",
+            "estimated_time",
+            "actual_time",
+            "recurrence",
+            "occurrence_at",
+            "created_at",
+            "updated_at",
+        ],
+    ),
+    Comment: ("comment", ["id", "todo", "user", "content", "created_at"]),
+    Milestone: ("milestone", ["id", "project", "name", "due_date"]),
+    Category: ("category", ["id", "project", "name"]),
+}
+MODELS_BY_NAME = {name: model for model, (name, _) in SYNC_MODELS.items()}
+
+
+def page_size():
+    return getattr(settings, "SYNC_PAGE_SIZE", 500)
+
+
+def parse_token(token):
+    """
+    Return the ``{project id: seq}`` a sync token holds, ``{}`` for an empty
+    one. Raise ValueError for an invalid token.
+    """
+    if not token:
+        return {}
+    since = {}
+    for pair in token.split(","):
+        match = re.fullmatch(r"([0-9]+):([0-9]+)", pair)
+        if match is None:
+            raise ValueError(f"Invalid sync token {token!r}.")
+        since[int(match[1])] = int(match[2])
+    return since
+
+
+def format_token(since):
+    """The sync token of ``{project id: seq}``, see ``parse_token``."""
+    return ",".join(f"{project_id}:{seq}" for project_id, seq in sorted(since.items()))
+
+
+def record(model, changes, using=None):
+    """
+    Record ``(object id, project id, deleted)`` changes of ``model`` objects.
+
+    An object's earlier record in the same project is replaced, so a sync
+    returns each changed object once, however often it changed. Changes are
+    numbered in order: record a move's tombstone before the new record.
+
+    Numbers come from each project's ``SyncSequence``, locked until the
+    transaction ends, so a project's changes commit in the order of their
+    numbers and a client never skips a change committed after its token.
+    """
+    # The last change of an object in a project wins, in its place.
+    changes = list({change[:2]: change for change in changes}.values())
+    if not changes:
+        return
+    name = SYNC_MODELS[model][0]
+    using = using or router.db_for_write(ChangeRecord)
+    by_project = {}
+    for object_id, project_id, _ in changes:
+        by_project.setdefault(project_id, set()).add(object_id)
+    with transaction.atomic(using=using):
+        sequences = lock_sequences(by_project, using)
+        records = ChangeRecord.objects.using(using)
+        for project_id, object_ids in by_project.items():
+            records.filter(
+                model=name, project_id=project_id, object_id__in=object_ids
+            ).delete()
+        now = timezone.now()
+        objs = []
+        for object_id, project_id, deleted in changes:
+            sequence = sequences[project_id]
+            sequence.value += 1
+            objs.append(
+                ChangeRecord(
+                    model=name,
+                    object_id=object_id,
+                    project_id=project_id,
+                    seq=sequence.value,
+                    deleted=deleted,
+                    changed_at=now,
+                )
+            )
+        SyncSequence.objects.using(using).bulk_update(sequences.values(), ["value"])
+        records.bulk_create(objs)
+
+
+def lock_sequences(project_ids, using):
+    """Lock and return the ``SyncSequence`` of ``project_ids``, by project."""
+    # Locked in project order, so concurrent writers cannot deadlock.
+    sequences = SyncSequence.objects.using(using).order_by("project_id")
+    locked = {
+        sequence.project_id: sequence
+        for sequence in sequences.select_for_update().filter(project_id__in=project_ids)
+    }
+    missing = set(project_ids) - locked.keys()
+    if missing:
+        sequences.bulk_create(
+            [SyncSequence(project_id=project_id) for project_id in sorted(missing)],
+            ignore_conflicts=True,
+        )
+        locked.update(
+            (sequence.project_id, sequence)
+            for sequence in sequences.select_for_update().filter(project_id__in=missing)
+        )
+    return locked
+
+
+def changes(project_ids, since=None, limit=None, using=None):
+    """
+    Return the changes to the objects of ``project_ids`` after ``since``,
+    the ``{project id: seq}`` of a token, at most ``limit``, the
+    ``{project id: seq}`` of the next token and whether more follow.
+
+    Changes are dicts ordered by their record ids, which within a project
+    follow ``seq``. Deleted objects have no ``data``; the others hold their
+    current field values, read with one query per model.
+    """
+    since = since or {}
+    limit = limit or page_size()
+    after = Q(project_id__in=set(project_ids) - since.keys())
+    for project_id in set(project_ids) & since.keys():
+        after |= Q(project_id=project_id, seq__gt=since[project_id])
+    records = list(
+        ChangeRecord.objects.using(using)
+        .filter(after)
+        .order_by("id")
+        .values_list("seq", "model", "object_id", "project_id", "deleted")[: limit + 1]
+    )
+    has_more = len(records) > limit
+    records = records[:limit]
+
+    live = {}
+    for _, name, object_id, _, deleted in records:
+        if not deleted:
+            live.setdefault(name, set()).add(object_id)
+    data = {}
+    for name, object_ids in live.items():
+        model = MODELS_BY_NAME[name]
+        serializer = FlatSerializer(model, SYNC_MODELS[model][1])
+        queryset = model._base_manager.using(using).filter(pk__in=object_ids)
+        for row in serializer.rows(queryset, chunk_size=len(object_ids)):
+            data[name, row[0]] = dict(zip(serializer.fields, row))
+
+    result = []
+    next_token = dict(since)
+    for seq, name, object_id, project_id, deleted in records:
+        next_token[project_id] = seq
+        values = data.get((name, object_id))
+        if not deleted and values is None:
+            # Deleted since; its tombstone follows.
+            continue
+        result.append(
+            {
+                "seq": seq,
+                "model": name,
+                "id": object_id,
+                "project": project_id,
+                "deleted": deleted,
+                "data": values,
+            }
+        )
+    return result, next_token, has_more
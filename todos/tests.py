@@ -1,3 +1,2702 @@
-from django.test import TestCase
+import asyncio
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import types
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from datetime import timezone as dt_timezone
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIHandler
+from django.core.signals import request_finished, request_started
+from django.core.exceptions import ImproperlyConfigured
+from django.db import (
+    DatabaseError,
+    close_old_connections,
+    connection,
+    connections,
+    transaction,
+)
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, resolve
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import http_date, urlsafe_base64_encode
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.routers import DefaultRouter
+
+from todo_project.database import databases
+
+from .activity import activity_log
+from .authentication import CachedTokenAuthentication, token_cache
+from .benchmarks import generate, regressions
+from .conditional import touch
+from .urls import router
+from .feed import InProcessBroker
+from .importer import TodoImporter
+from .inbox import BUCKETS, Buckets
+from .instrumentation import metrics, metrics_view
+from .response_cache import response_cache
+from .scheduler import RecurringTaskScheduler
+from .signals import todos_bulk_created
+from .stats import rebuild
+from .sync import changes
+from .models import (
+    ActivityLog,
+    Attachment,
+    Blob,
+    Category,
+    Comment,
+    ImportJob,
+    InboxEntry,
+    Milestone,
+    MilestoneStats,
+    Project,
+    ProjectStats,
+    RecurringTask,
+    Tag,
+    Todo,
+    Upload,
+)
+from .uploads import complete_upload, store_part
+from .views import (
+    ActivityLogViewSet,
+    AttachmentViewSet,
+    CategoryViewSet,
+    CommentViewSet,
+    MilestoneViewSet,
+    ProjectViewSet,
+    RecurringTaskViewSet,
+    TodoViewSet,
+)
+
+
+# The API hyperlinks users to "user-detail", which the project does not route.
+def n_plus_one(request):
+    """Reads the project of every todo on its own, for the N+1 detection."""
+    titles = [todo.project.name for todo in Todo.objects.all()]
+    return HttpResponse(",".join(titles))
+
+
+urlpatterns = [
+    path("api/v1/", include("todos.urls")),
+    path("users/<int:pk>/", lambda request, pk: HttpResponse(), name="user-detail"),
+    path("metrics", metrics_view, name="metrics"),
+    path("n-plus-one/", n_plus_one, name="n-plus-one"),
+]
+
+
+def async_urlconf():
+    """The test URLconf, with the API views built with async reads on."""
+    module = types.ModuleType("todos.tests.async_urls")
+    with override_settings(ASYNC_READ_VIEWS=True):
+        async_router = DefaultRouter()
+        for prefix, viewset, basename in router.registry:
+            async_router.register(prefix, viewset, basename)
+        module.urlpatterns = [path("api/v1/", include(async_router.urls))]
+    module.urlpatterns += urlpatterns
+    return module
+
+
+ASYNC_URLCONF = async_urlconf()
+
+
+def asgi_get(url, headers=None):
+    """
+    GET ``url`` through the ASGI handler, the way servers call it, and return
+    the status and the size of the body it sent.
+    """
+    path, _, query = url.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "query_string": query.encode(),
+        "headers": [
+            (name.lower().encode(), value.encode())
+            for name, value in (headers or {}).items()
+        ],
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 0),
+    }
+    sent = {"status": None, "size": 0}
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # The client stays connected until the response is sent.
+        await asyncio.Future()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            sent["status"] = message["status"]
+        else:
+            sent["size"] += len(message.get("body", b""))
+
+    # As the test client does, keep the test's transaction open.
+    request_started.disconnect(close_old_connections)
+    request_finished.disconnect(close_old_connections)
+    try:
+        async_to_sync(ASGIHandler())(scope, receive, send)
+    finally:
+        request_started.connect(close_old_connections)
+        request_finished.connect(close_old_connections)
+    return sent["status"], sent["size"]
+
+
+@override_settings(ROOT_URLCONF="todos.tests", ACTIVITY_LOG_FLUSH_INTERVAL=None)
+class APITestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("alice", password="secret")
+        cls.project = Project.objects.create(name="Launch", owner=cls.user)
+        cls.project.members.add(cls.user)
+
+    def setUp(self):
+        # Cached answers outlive the rolled back data of earlier tests.
+        for alias in settings.CACHES:
+            caches[alias].clear()
+
+    def tearDown(self):
+        # Write buffered entries while the test database still exists.
+        activity_log.flush()
+
+    def create_todos(self, count, **kwargs):
+        tag = Tag.objects.create(name="backend")
+        todos = []
+        for i in range(count):
+            todo = Todo.objects.create(
+                title=f"Task {i}", user=self.user, project=self.project, **kwargs
+            )
+            todo.tags.add(tag)
+            Todo.objects.create(
+                title=f"Subtask {i}",
+                user=self.user,
+                project=self.project,
+                parent_task=todo,
+            )
+            Comment.objects.create(todo=todo, user=self.user, content="Looks good")
+            Attachment.objects.create(
+                todo=todo, uploaded_by=self.user, file="attachments/log.txt"
+            )
+            todos.append(todo)
+        return todos
+
+
+class QuerysetPlannerTests(APITestCase):
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_todo_list_query_count_is_independent_of_page_size(self):
+        self.create_todos(10)
+        with mock.patch.object(PageNumberPagination, "page_size", 2):
+            small = self.count_queries("/api/v1/todos/")
+        with mock.patch.object(PageNumberPagination, "page_size", 20):
+            large = self.count_queries("/api/v1/todos/")
+        self.assertEqual(small, large)
+        # validators, count, page, tags, subtasks, comments, attachments
+        self.assertEqual(large, 7)
+
+    def test_every_list_endpoint_has_a_fixed_query_count(self):
+        self.create_todos(3)
+        baseline = {}
+        for endpoint in ["projects", "tags", "comments", "attachments", "todos"]:
+            baseline[endpoint] = self.count_queries(f"/api/v1/{endpoint}/")
+        self.create_todos(3)
+        for endpoint, queries in baseline.items():
+            self.assertEqual(
+                self.count_queries(f"/api/v1/{endpoint}/"), queries, endpoint
+            )
+
+    def test_todo_detail_prefetches_nested_relations(self):
+        todo = self.create_todos(1)[0]
+        self.assertEqual(self.count_queries(f"/api/v1/todos/{todo.pk}/"), 6)
+
+
+class SparseFieldsetTests(APITestCase):
+    def test_fields_limits_representation_and_prefetches(self):
+        self.create_todos(3)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/v1/projects/?fields=id,name")
+        self.assertEqual(
+            response.json()["results"], [{"id": self.project.pk, "name": "Launch"}]
+        )
+        # validators, count and page: members, milestones and todos are not
+        # prefetched
+        self.assertEqual(len(ctx.captured_queries), 3)
+
+    def test_expand_nests_related_representation(self):
+        self.create_todos(2)
+        url = "/api/v1/todos/?fields=id,project,tags&expand=project,tags"
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        todo = response.json()["results"][0]
+        self.assertEqual(todo["project"]["name"], "Launch")
+        self.assertEqual(todo["tags"][0]["name"], "backend")
+        self.create_todos(2)
+        with CaptureQueriesContext(connection) as more:
+            self.client.get(url)
+        self.assertEqual(len(ctx.captured_queries), len(more.captured_queries))
+
+    def test_fields_are_ignored_on_writes(self):
+        response = self.client.post(
+            "/api/v1/tags/?fields=id", {"name": "ops"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 403)
+        self.client.force_login(self.user)
+        response = self.client.post(
+            "/api/v1/tags/?fields=id", {"name": "ops"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["name"], "ops")
+
+
+class KeysetPaginationTests(APITestCase):
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("count", response.json())
+            ids.extend(todo["id"] for todo in response.json()["results"])
+            url = response.json()["next"]
+        return ids
+
+    def test_pages_follow_ordering_with_ties_and_nulls(self):
+        due = timezone.now()
+        for i in range(25):
+            Todo.objects.create(
+                title=f"Task {i}",
+                user=self.user,
+                project=self.project,
+                due_date=None if i % 3 == 0 else due + timedelta(days=i % 2),
+            )
+        for ordering in ["due_date", "-due_date", "-created_at"]:
+            expected = list(
+                Todo.objects.order_by(
+                    ordering, ("-" if ordering.startswith("-") else "") + "id"
+                ).values_list("id", flat=True)
+            )
+            url = f"/api/v1/todos/?pagination=cursor&ordering={ordering}"
+            self.assertEqual(self.walk(url), expected, ordering)
+
+    def test_previous_link_returns_to_earlier_page(self):
+        for i in range(15):
+            ActivityLog.objects.create(user=self.user, action="created", target=i)
+        self.client.force_login(self.user)
+        first = self.client.get("/api/v1/activity-logs/?pagination=cursor").json()
+        second = self.client.get(first["next"]).json()
+        self.assertIsNone(first["previous"])
+        back = self.client.get(second["previous"]).json()
+        self.assertEqual(back["results"], first["results"])
+
+    def test_page_numbers_remain_the_default(self):
+        self.assertIn("count", self.client.get("/api/v1/comments/").json())
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get("/api/v1/todos/?cursor=bogus")
+        self.assertEqual(response.status_code, 404)
+
+    def test_ordering_by_search_rank_is_rejected(self):
+        response = self.client.get("/api/v1/todos/?search=task&pagination=cursor")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("pagination", response.json())
+
+
+class QueryPlanTests(APITestCase):
+    """Every filter combination the viewsets expose must be served by an index."""
+
+    viewsets = [
+        ProjectViewSet,
+        MilestoneViewSet,
+        CategoryViewSet,
+        TodoViewSet,
+        CommentViewSet,
+        AttachmentViewSet,
+        RecurringTaskViewSet,
+        ActivityLogViewSet,
+    ]
+
+    def setUp(self):
+        super().setUp()
+        todo = self.create_todos(1)[0]
+        milestone = Milestone.objects.create(
+            project=self.project, name="Beta", due_date=timezone.now().date()
+        )
+        category = Category.objects.create(project=self.project, name="Ops")
+        recurring = RecurringTask.objects.create(
+            todo=todo, frequency="DAILY", start_date=timezone.now()
+        )
+        self.values = {
+            "owner": [self.user.pk],
+            "members": [self.user.pk],
+            "user": [self.user.pk],
+            "uploaded_by": [self.user.pk],
+            "project": [self.project.pk],
+            "milestone": [milestone.pk],
+            "category": [category.pk],
+            "todo": [todo.pk],
+            "completed": ["false", "true"],
+            "priority": ["HIGH"],
+            "frequency": ["DAILY"],
+            "recurrence": [recurring.pk],
+            "action": ["created"],
+        }
+
+    def plans(self, viewset):
+        factory = RequestFactory()
+        orderings = [None] + getattr(viewset, "ordering_fields", [])
+        fields = viewset.filterset_fields
+        for size in range(1, len(fields) + 1):
+            for combination in itertools.combinations(fields, size):
+                choices = [self.values[name] for name in combination]
+                for values in itertools.product(*choices, orderings):
+                    params = dict(zip(combination, values))
+                    if values[-1]:
+                        params["ordering"] = values[-1]
+                    view = viewset(action="list", format_kwarg=None, kwargs={})
+                    view.request = Request(factory.get("/", params))
+                    yield params, view.filter_queryset(viewset.queryset.all())
+
+    @skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN output")
+    def test_filters_never_scan_a_table(self):
+        for viewset in self.viewsets:
+            # A scan of a partial index only visits the rows matching its
+            # condition, which the filter implied for SQLite to pick it.
+            partial = "|".join(
+                index.name
+                for index in viewset.queryset.model._meta.indexes
+                if index.condition is not None
+            )
+            full_scan = rf"\bSCAN (?!CONSTANT|\S+ USING INDEX ({partial or '-'})\b)"
+            for params, queryset in self.plans(viewset):
+                with self.subTest(viewset=viewset.__name__, **params):
+                    # The filter itself (as in the COUNT query) is index-served...
+                    self.assertNotRegex(queryset.order_by().explain(), full_scan)
+                    # ...and ordered pages read an index, for the filter or for
+                    # the order when SQLite estimates that to be cheaper.
+                    self.assertNotRegex(queryset.explain(), r"(?m)\bSCAN \S+$")
+
+
+class ActivityLogWriterTests(APITestCase):
+    def test_entries_are_written_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            todo = Todo.objects.create(
+                title="Ship", user=self.user, project=self.project
+            )
+        self.assertFalse(ActivityLog.objects.exists())
+        activity_log.flush()
+        log = ActivityLog.objects.get()
+        self.assertEqual(
+            (log.user, log.action, log.target), (self.user, "created", "Todo: Ship")
+        )
+        self.assertLessEqual(log.timestamp, todo.created_at + timedelta(seconds=1))
+
+    def test_rolled_back_transactions_are_not_logged(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    Todo.objects.create(
+                        title="Ship", user=self.user, project=self.project
+                    )
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+        self.assertEqual(callbacks, [])
+        activity_log.flush()
+        self.assertFalse(ActivityLog.objects.exists())
+
+    @override_settings(ACTIVITY_LOG_BATCH_SIZE=4)
+    def test_cascading_deletes_are_written_in_batches(self):
+        for i in range(8):
+            Todo.objects.create(title=f"Task {i}", user=self.user, project=self.project)
+        with CaptureQueriesContext(connection) as ctx:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.project.delete()
+        inserts = [
+            query
+            for query in ctx.captured_queries
+            if query["sql"].startswith('INSERT INTO "todos_activitylog"')
+        ]
+        self.assertEqual(len(inserts), 2)
+        self.assertEqual(ActivityLog.objects.filter(action="deleted").count(), 8)
+
+
+class BulkTodoTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.category = Category.objects.create(project=self.project, name="Ops")
+        self.tags = [Tag.objects.create(name=f"tag{i}") for i in range(3)]
+
+    def payload(self, count):
+        return [
+            {
+                "title": f"Imported {i}",
+                "user": f"http://testserver/users/{self.user.pk}/",
+                "project": f"http://testserver/api/v1/projects/{self.project.pk}/",
+                "category": f"/api/v1/categories/{self.category.pk}/",
+                "tags": [f"/api/v1/tags/{tag.pk}/" for tag in self.tags[: i % 3 + 1]],
+            }
+            for i in range(count)
+        ]
+
+    def bulk(self, method, data):
+        with CaptureQueriesContext(connection) as ctx:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = getattr(self.client, method)(
+                    "/api/v1/todos/bulk/", data, content_type="application/json"
+                )
+        return response, len(ctx.captured_queries)
+
+    def test_create_uses_a_constant_number_of_queries(self):
+        self.bulk("post", self.payload(1))  # caches the project membership
+        response, few = self.bulk("post", self.payload(2))
+        self.assertEqual(response.status_code, 201, response.content)
+        response, many = self.bulk("post", self.payload(40))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(few, many)
+        self.assertEqual(len(response.json()), 40)
+        self.assertEqual(Todo.objects.filter(tags=self.tags[0]).count(), 43)
+        self.assertEqual(Todo.objects.filter(tags=self.tags[2]).count(), 13)
+        activity_log.flush()
+        self.assertEqual(ActivityLog.objects.filter(action="created").count(), 43)
+
+    def test_create_reports_errors_per_item(self):
+        data = self.payload(2)
+        data[1]["category"] = "/api/v1/categories/999/"
+        response, queries = self.bulk("post", data)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Todo.objects.exists())
+        self.assertIn("category", str(response.json()))
+
+    def test_create_requires_membership_of_every_project(self):
+        other = Project.objects.create(name="Other", owner=self.user)
+        data = self.payload(2)
+        data[0]["project"] = f"/api/v1/projects/{other.pk}/"
+        response, queries = self.bulk("post", data)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Todo.objects.exists())
+
+    def test_partial_update_and_delete(self):
+        todos = self.create_todos(3)
+        response, queries = self.bulk(
+            "patch",
+            [
+                {
+                    "id": todo.pk,
+                    "completed": True,
+                    "tags": [f"/api/v1/tags/{self.tags[2].pk}/"],
+                }
+                for todo in todos
+            ],
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Todo.objects.filter(completed=True).count(), 3)
+        self.assertEqual(list(todos[0].tags.all()), [self.tags[2]])
+
+        response, queries = self.bulk("delete", [todo.pk for todo in todos])
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Todo.objects.filter(pk__in=[t.pk for t in todos]).exists())
+
+    def test_bulk_writes_update_project_stats(self):
+        response, queries = self.bulk("post", self.payload(4))
+        ids = [todo["id"] for todo in response.json()]
+        stats = ProjectStats.objects.get(pk=self.project.pk)
+        self.assertEqual((stats.total, stats.open_medium), (4, 4))
+        self.bulk("patch", [{"id": pk, "completed": True} for pk in ids[:3]])
+        stats.refresh_from_db()
+        self.assertEqual((stats.completed, stats.open_medium), (3, 1))
+        self.bulk("delete", ids[1:])
+        stats.refresh_from_db()
+        self.assertEqual((stats.total, stats.completed), (1, 1))
+
+    def test_partial_update_rejects_unknown_ids(self):
+        response, queries = self.bulk("patch", [{"id": 999, "completed": True}])
+        self.assertEqual(response.status_code, 400)
+        response, queries = self.bulk("delete", [999])
+        self.assertEqual(response.status_code, 400)
+
+
+    def test_empty_lists(self):
+        response, queries = self.bulk("post", [])
+        self.assertEqual((response.status_code, response.json()), (201, []))
+        response, queries = self.bulk("patch", [])
+        self.assertEqual((response.status_code, response.json()), (200, []))
+        response, queries = self.bulk("delete", [])
+        self.assertEqual(response.status_code, 204)
+
+class ProjectMembershipTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.todo = self.create_todos(1)[0]
+
+    def patch(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.patch(
+                url, {"title": "Renamed"}, content_type="application/json"
+            )
+        lookups = [
+            q for q in ctx.captured_queries if "todos_project_members" in q["sql"]
+        ]
+        return response.status_code, len(lookups)
+
+    def test_membership_is_cached_across_requests(self):
+        url = f"/api/v1/todos/{self.todo.pk}/"
+        self.assertEqual(self.patch(url), (200, 1))
+        self.assertEqual(self.patch(url), (200, 0))
+
+    def test_removing_a_member_evicts_the_cache(self):
+        url = f"/api/v1/todos/{self.todo.pk}/"
+        self.assertEqual(self.patch(url), (200, 1))
+        self.user.projects.remove(self.project)
+        self.assertEqual(self.patch(url), (403, 1))
+        self.project.members.add(self.user)
+        self.assertEqual(self.patch(url), (200, 1))
+        self.project.members.clear()
+        self.assertEqual(self.patch(url), (403, 1))
+
+    def test_objects_related_through_a_todo(self):
+        comment = self.todo.comments.get()
+        response = self.client.patch(
+            f"/api/v1/comments/{comment.pk}/",
+            {"content": "Edited"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class ConditionalRequestTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.todo = self.create_todos(1)[0]
+        self.url = f"/api/v1/todos/{self.todo.pk}/"
+
+    def etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual("Last-Modified" in response, url != "/api/v1/todos/")
+        return response["ETag"]
+
+    def test_unchanged_detail_and_list_are_not_modified(self):
+        for url in [self.url, "/api/v1/todos/"]:
+            etag = self.etag(url)
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response["ETag"], etag)
+            # session, user and the validator query: nothing is serialized
+            self.assertEqual(len(ctx.captured_queries), 3, url)
+
+    def test_deleted_rows_modify_the_list(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Todo.objects.create(
+                title="Other", user=self.user, project=self.project
+            )
+        etag = self.etag("/api/v1/todos/")
+        since = http_date(time.time() + 60)
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        response = self.client.get("/api/v1/todos/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get("/api/v1/todos/", HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_with_stale_etag_fails_precondition(self):
+        etag = self.etag(self.url)
+        response = self.client.patch(
+            self.url,
+            {"title": "Renamed"},
+            content_type="application/json",
+            HTTP_IF_MATCH=etag,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        response = self.client.patch(
+            self.url,
+            {"title": "Renamed again"},
+            content_type="application/json",
+            HTTP_IF_MATCH=etag,
+        )
+        self.assertEqual(response.status_code, 412)
+        self.todo.refresh_from_db()
+        self.assertEqual(self.todo.title, "Renamed")
+
+    def test_nested_changes_touch_the_containing_objects(self):
+        todo_etag = self.etag(self.url)
+        project_url = f"/api/v1/projects/{self.project.pk}/"
+        project_etag = self.etag(project_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(todo=self.todo, user=self.user, content="New")
+        self.assertNotEqual(self.etag(self.url), todo_etag)
+        self.assertEqual(self.etag(project_url), project_etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            Milestone.objects.create(
+                project=self.project, name="Beta", due_date=timezone.now().date()
+            )
+        self.assertNotEqual(self.etag(project_url), project_etag)
+
+    def test_touches_are_merged_and_dropped_with_rolled_back_work(self):
+        other = Project.objects.create(name="Other", owner=self.user)
+        before = dict(Project.objects.values_list("pk", "updated_at"))
+        with CaptureQueriesContext(connection) as ctx:
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        touch(Project, [self.project.pk])
+                        raise DatabaseError
+                except DatabaseError:
+                    pass
+                touch(Project, [other.pk])
+                with transaction.atomic():
+                    touch(Project, [other.pk, None])
+        updates = [
+            query
+            for query in ctx.captured_queries
+            if query["sql"].startswith('UPDATE "todos_project"')
+        ]
+        self.assertEqual(len(updates), 1)
+        after = dict(Project.objects.values_list("pk", "updated_at"))
+        self.assertEqual(after[self.project.pk], before[self.project.pk])
+        self.assertGreater(after[other.pk], before[other.pk])
+
+
+class ResponseCacheTests(APITestCase):
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response["X-Cache"], len(ctx.captured_queries), response.json()
+
+    def test_repeated_reads_are_served_from_the_cache(self):
+        url = f"/api/v1/projects/{self.project.pk}/"
+        before = response_cache.stats().get("todos.project", Counter())
+        status, queries, data = self.get(url)
+        self.assertEqual(status, "MISS")
+        self.assertEqual(self.get(url), ("HIT", 0, data))
+        self.assertEqual(self.get(url + "?fields=id")[0], "MISS")
+        self.client.force_login(self.user)
+        self.assertEqual(self.get(url)[0], "MISS")
+        response = self.client.get(url, HTTP_ACCEPT="text/html")
+        self.assertEqual(response["X-Cache"], "MISS")
+        stats = response_cache.stats()["todos.project"]
+        self.assertEqual(stats["hits"] - before["hits"], 1)
+        self.assertEqual(stats["misses"] - before["misses"], 4)
+
+    def test_writes_invalidate_dependent_responses(self):
+        todo = self.create_todos(1)[0]
+        tag = todo.tags.get()
+        project_url = f"/api/v1/projects/{self.project.pk}/"
+        tag_url = f"/api/v1/tags/{tag.pk}/"
+        for url in [project_url, tag_url, "/api/v1/projects/"]:
+            self.get(url)
+        todo.tags.clear()
+        status, queries, data = self.get(tag_url)
+        self.assertEqual((status, data["todos"]), ("MISS", []))
+        self.assertEqual(self.get(project_url)[0], "HIT")
+        Todo.objects.create(title="New", user=self.user, project=self.project)
+        status, queries, data = self.get(project_url)
+        self.assertEqual((status, len(data["todos"])), ("MISS", 3))
+        self.project.name = "Relaunch"
+        self.project.save()
+        status, queries, data = self.get("/api/v1/projects/")
+        self.assertEqual((status, data["results"][0]["name"]), ("MISS", "Relaunch"))
+
+    def test_moving_a_todo_invalidates_both_projects(self):
+        todo = self.create_todos(1)[0]
+        other = Project.objects.create(name="Other", owner=self.user)
+        urls = [f"/api/v1/projects/{pk}/" for pk in (self.project.pk, other.pk)]
+        for url in urls:
+            self.get(url)
+        todo.project = other
+        todo.save()
+        self.assertEqual([self.get(url)[0] for url in urls], ["MISS", "MISS"])
+        self.assertEqual(len(self.get(urls[1])[2]["todos"]), 1)
+
+    def test_bulk_writes_invalidate_dependent_responses(self):
+        url = f"/api/v1/projects/{self.project.pk}/"
+        tag = Tag.objects.create(name="backend")
+        self.client.force_login(self.user)
+        self.get(url)
+        response = self.client.post(
+            "/api/v1/todos/bulk/",
+            [
+                {
+                    "title": "Bulk",
+                    "user": f"http://testserver/users/{self.user.pk}/",
+                    "project": f"http://testserver{url}",
+                    "tags": [f"/api/v1/tags/{tag.pk}/"],
+                }
+            ],
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        status, queries, data = self.get(url)
+        self.assertEqual((status, len(data["todos"])), ("MISS", 1))
+
+    def test_cached_responses_keep_their_validators(self):
+        url = f"/api/v1/projects/{self.project.pk}/"
+        etag = self.client.get(url)["ETag"]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, len(ctx.captured_queries)), (304, 0))
+
+
+class SearchTests(APITestCase):
+    def search(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any("LIKE" in q["sql"] for q in ctx.captured_queries))
+        return response.json()
+
+    def titles(self, query):
+        data = self.search(f"/api/v1/todos/?search={query}")
+        return [todo["title"] for todo in data["results"]]
+
+    def test_index_follows_writes(self):
+        todo = Todo.objects.create(
+            title="Deploy database migrations", user=self.user, project=self.project
+        )
+        self.assertEqual(self.titles("deplo migr"), ["Deploy database migrations"])
+        todo.title = "Rotate credentials"
+        todo.save()
+        self.assertEqual(self.titles("deploy"), [])
+        self.assertEqual(self.titles("credential"), ["Rotate credentials"])
+        todo.delete()
+        self.assertEqual(self.titles("credential"), [])
+
+    def test_title_matches_rank_above_description_matches(self):
+        Todo.objects.create(
+            title="Write release notes",
+            description="Mention the invoice export",
+            user=self.user,
+            project=self.project,
+        )
+        Todo.objects.create(
+            title="Invoice export", user=self.user, project=self.project
+        )
+        self.assertEqual(
+            self.titles("invoice"), ["Invoice export", "Write release notes"]
+        )
+
+    def test_bulk_created_todos_are_indexed(self):
+        tag = Tag.objects.create(name="backend")
+        self.client.force_login(self.user)
+        response = self.client.post(
+            "/api/v1/todos/bulk/",
+            [
+                {
+                    "title": "Bulk imported backlog",
+                    "user": f"http://testserver/users/{self.user.pk}/",
+                    "project": f"http://testserver/api/v1/projects/{self.project.pk}/",
+                    "tags": [f"/api/v1/tags/{tag.pk}/"],
+                }
+            ],
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.titles("backlog"), ["Bulk imported backlog"])
+
+    def test_search_endpoint_spans_todos_comments_and_projects(self):
+        todo = self.create_todos(1)[0]
+        Comment.objects.create(todo=todo, user=self.user, content="Launch blocker")
+        data = self.search("/api/v1/search/?q=launch")
+        results = data["results"]
+        self.assertEqual([p["name"] for p in results["projects"]], ["Launch"])
+        self.assertEqual(
+            [c["content"] for c in results["comments"]], ["Launch blocker"]
+        )
+        self.assertEqual(results["todos"], [])
+        data = self.search("/api/v1/search/?q=task&type=todos&limit=1")
+        self.assertEqual(list(data["results"]), ["todos"])
+        self.assertEqual(len(data["results"]["todos"]), 1)
+        response = self.client.get("/api/v1/search/?q=task&type=users")
+        self.assertEqual(response.status_code, 400)
+
+
+    def test_queries_without_words_match_nothing(self):
+        self.create_todos(1)
+        self.client.logout()
+        for url in [
+            "/api/v1/todos/?search=--",
+            "/api/v1/projects/?search=!!",
+            "/api/v1/search/?q=",
+            '/api/v1/search/?q="""',
+        ]:
+            data = self.search(url)
+            results = data["results"]
+            if isinstance(results, dict):
+                results = list(itertools.chain(*results.values()))
+            self.assertEqual(results, [], url)
+        self.client.force_login(self.user)
+        response = self.client.get("/api/v1/todos/export/?search=--")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"")
+
+class RecurringTaskSchedulerTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        self.scheduler = RecurringTaskScheduler(horizon=timedelta(days=7))
+
+    def recurring(self, frequency, start, **kwargs):
+        template = Todo.objects.create(
+            title="Water plants", user=self.user, project=self.project
+        )
+        template.tags.add(Tag.objects.get_or_create(name="chores")[0])
+        return RecurringTask.objects.create(
+            todo=template, frequency=frequency, start_date=start, **kwargs
+        )
+
+    def test_months_keep_their_day_where_possible(self):
+        start = datetime(2024, 1, 31, 9, tzinfo=dt_timezone.utc)
+        task = RecurringTask(frequency="MONTHLY", start_date=start)
+        self.assertEqual(
+            [task.occurrence(n).date() for n in range(3)],
+            [date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 31)],
+        )
+        self.assertEqual(
+            task.run_at_or_after(start + timedelta(days=1)), task.occurrence(1)
+        )
+        task.frequency = "YEARLY"
+        self.assertEqual(task.run_at_or_after(start), start)
+        task.end_date = start + timedelta(days=300)
+        self.assertIsNone(task.run_at_or_after(start + timedelta(days=1)))
+
+    def test_tick_materializes_due_occurrences_once(self):
+        task = self.recurring("DAILY", self.now + timedelta(hours=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.scheduler.tick(self.now), 7)
+        occurrences = task.occurrences.order_by("occurrence_at")
+        self.assertEqual(
+            [todo.occurrence_at for todo in occurrences],
+            [task.occurrence(n) for n in range(7)],
+        )
+        self.assertEqual(occurrences[0].title, "Water plants")
+        self.assertEqual(occurrences[0].due_date, task.start_date)
+        self.assertEqual([tag.name for tag in occurrences[0].tags.all()], ["chores"])
+        task.refresh_from_db()
+        self.assertEqual(task.next_run_at, task.occurrence(7))
+        # Nothing is due: one indexed read (in a savepoint) and no writes.
+        with self.assertNumQueries(3):
+            self.assertEqual(self.scheduler.tick(self.now), 0)
+        self.assertEqual(self.scheduler.tick(self.now + timedelta(days=1)), 1)
+
+    def test_schedules_end_and_skip_long_missed_occurrences(self):
+        ended = self.recurring(
+            "WEEKLY",
+            self.now + timedelta(hours=1),
+            end_date=self.now + timedelta(days=10),
+        )
+        stale = self.recurring("DAILY", self.now - timedelta(days=30))
+        RecurringTask.objects.filter(pk=stale.pk).update(next_run_at=stale.start_date)
+        self.scheduler.tick(self.now + timedelta(days=7))
+        ended.refresh_from_db()
+        self.assertIsNone(ended.next_run_at)
+        self.assertEqual(ended.occurrences.count(), 2)
+        # Only the missed week and the week ahead are materialized.
+        self.assertEqual(stale.occurrences.count(), 15)
+
+    def test_editing_a_schedule_does_not_duplicate_occurrences(self):
+        task = self.recurring("DAILY", self.now + timedelta(hours=1))
+        self.scheduler.tick(self.now)
+        task.end_date = self.now + timedelta(days=30)
+        task.save()
+        self.assertEqual(task.next_run_at, task.start_date)
+        self.assertEqual(self.scheduler.tick(self.now + timedelta(days=1)), 1)
+        self.assertEqual(task.occurrences.count(), 8)
+
+    def test_command_survives_failed_ticks(self):
+        tick = mock.patch.object(
+            RecurringTaskScheduler, "tick", side_effect=[DatabaseError("gone"), 2]
+        )
+        # The second sleep stops the loop, as Ctrl-C would.
+        sleep = mock.patch("time.sleep", side_effect=[None, KeyboardInterrupt])
+        out = io.StringIO()
+        with tick, sleep, self.assertLogs("todos", "ERROR") as logs:
+            call_command("run_scheduler", stdout=out)
+        self.assertIn("Scheduler tick failed", logs.output[0])
+        self.assertEqual(out.getvalue(), "Materialized 2 occurrences\n")
+
+
+class StatsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.milestone = Milestone.objects.create(
+            project=self.project, name="Beta", due_date=date(2030, 1, 1)
+        )
+        self.other = Project.objects.create(name="Other", owner=self.user)
+
+    def todo(self, **kwargs):
+        return Todo.objects.create(
+            title="Task", user=self.user, project=self.project, **kwargs
+        )
+
+    def counters(self, model, pk):
+        return model.objects.filter(pk=pk).values().get()
+
+    def assertRebuildMatches(self):
+        for container, model in [(Project, ProjectStats), (Milestone, MilestoneStats)]:
+            stored = list(model.objects.order_by("pk").values())
+            rebuild(container, [row["pk"] for row in model.objects.values("pk")])
+            self.assertEqual(stored, list(model.objects.order_by("pk").values()))
+
+    def test_counters_follow_transitions(self):
+        past = timezone.now() - timedelta(days=1)
+        first = self.todo(
+            milestone=self.milestone,
+            priority="HIGH",
+            estimated_time=timedelta(hours=2),
+            due_date=past,
+        )
+        second = self.todo(priority="LOW", actual_time=timedelta(minutes=30))
+        stats = self.counters(ProjectStats, self.project.pk)
+        self.assertEqual(
+            (stats["total"], stats["open_high"], stats["open_low"]), (2, 1, 1)
+        )
+        self.assertEqual(stats["estimated_time"], timedelta(hours=2))
+
+        first.priority = "URGENT"
+        first.save()
+        second.completed = True
+        second.actual_time = timedelta(hours=1)
+        second.save()
+        stats = self.counters(ProjectStats, self.project.pk)
+        self.assertEqual(
+            (stats["completed"], stats["open_high"], stats["open_urgent"]), (1, 0, 1)
+        )
+        self.assertEqual(stats["actual_time"], timedelta(hours=1))
+        self.assertRebuildMatches()
+
+        first.project = self.other
+        first.milestone = None
+        first.save()
+        self.assertEqual(self.counters(ProjectStats, self.other.pk)["total"], 1)
+        self.assertEqual(self.counters(MilestoneStats, self.milestone.pk)["total"], 0)
+        second.delete()
+        stats = self.counters(ProjectStats, self.project.pk)
+        self.assertEqual((stats["total"], stats["actual_time"]), (0, timedelta()))
+        self.assertRebuildMatches()
+
+    def test_saves_leaving_counted_fields_alone_cost_no_update(self):
+        todo = self.todo(milestone=self.milestone)
+        todo.title = "Renamed"
+        with CaptureQueriesContext(connection) as ctx:
+            todo.save()
+        self.assertFalse(
+            [q for q in ctx.captured_queries if "stats" in q["sql"].lower()]
+        )
+
+    def test_stats_endpoints_read_the_counters(self):
+        self.todo(milestone=self.milestone, due_date=timezone.now() - timedelta(1))
+        self.todo(milestone=self.milestone, completed=True)
+        ProjectStats.objects.all().delete()
+        # Missing rows are rebuilt on first read.
+        response = self.client.get(f"/api/v1/projects/{self.project.pk}/stats/")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(
+            (data["total"], data["open"], data["completed"], data["overdue"]),
+            (2, 1, 1, 1),
+        )
+        self.assertEqual(data["open_by_priority"]["MEDIUM"], 1)
+        self.todo()
+        self.todo()
+        # The session, the user, the project, its counters and its overdue
+        # todos, whatever the number of todos.
+        with self.assertNumQueries(5):
+            response = self.client.get(f"/api/v1/projects/{self.project.pk}/stats/")
+        self.assertEqual(response.json()["total"], 4)
+        response = self.client.get(f"/api/v1/milestones/{self.milestone.pk}/stats/")
+        self.assertEqual(response.json()["total"], 2)
+        self.assertTrue(
+            response.json()["milestone"].endswith(f"/milestones/{self.milestone.pk}/")
+        )
+
+
+class TodoTreeTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def todo(self, title, parent=None, **kwargs):
+        return Todo.objects.create(
+            title=title,
+            user=self.user,
+            project=self.project,
+            parent_task=parent,
+            **kwargs,
+        )
+
+    def tree(self, todo, **params):
+        return self.client.get(f"/api/v1/todos/{todo.pk}/tree/", params)
+
+    def test_subtree_with_rollups_and_depth_limit(self):
+        root = self.todo("Release")
+        docs = self.todo(
+            "Docs", root, completed=True, estimated_time=timedelta(hours=1)
+        )
+        self.todo("API reference", docs, estimated_time=timedelta(minutes=30))
+        self.todo("Tag", root, actual_time=timedelta(hours=2))
+        self.todo("Unrelated")
+
+        data = self.tree(root).json()
+        self.assertEqual(
+            data["rollup"],
+            {
+                "total": 4,
+                "completed": 1,
+                "estimated_time": "01:30:00",
+                "actual_time": "02:00:00",
+            },
+        )
+        self.assertEqual([node["title"] for node in data["subtasks"]], ["Docs", "Tag"])
+        self.assertEqual(data["subtasks"][0]["subtasks"][0]["depth"], 2)
+        self.assertTrue(data["url"].endswith(f"/api/v1/todos/{root.pk}/"))
+
+        data = self.tree(root, depth=1).json()
+        docs_node, tag_node = data["subtasks"]
+        # Cut off subtasks are null, a leaf has none.
+        self.assertIsNone(docs_node["subtasks"])
+        self.assertEqual(docs_node["rollup"]["total"], 2)
+        self.assertEqual(tag_node["subtasks"], [])
+        self.assertEqual(self.tree(root, depth="x").status_code, 400)
+
+    def test_cycle_through_the_root_terminates(self):
+        root = self.todo("Root")
+        child = self.todo("Child", root)
+        Todo.objects.filter(pk=root.pk).update(parent_task=child)
+        data = self.tree(root).json()
+        self.assertEqual(data["rollup"]["total"], 2)
+        self.assertEqual(data["subtasks"][0]["subtasks"], [])
+
+    def test_large_tree_in_a_constant_number_of_queries(self):
+        root = self.todo("Root")
+        level, count = [root], 1
+        while count < 10000:
+            children = [
+                Todo(
+                    title="Node",
+                    user=self.user,
+                    project=self.project,
+                    parent_task=parent,
+                )
+                for parent in level
+                for _ in range(10)
+            ][: 10000 - count]
+            level = Todo.objects.bulk_create(children)
+            count += len(level)
+        # The session, the user, the root and the subtree.
+        with self.assertNumQueries(4):
+            response = self.tree(root)
+        data = response.json()
+        self.assertEqual(data["rollup"]["total"], 10000)
+        self.assertEqual(len(data["subtasks"]), 10)
+        self.assertEqual(len(data["subtasks"][0]["subtasks"][0]["subtasks"]), 10)
+
+
+@override_settings(EXPORT_WATERMARK_LAG=0)
+class ExportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.todos = self.create_todos(3)
+        self.todos[0].estimated_time = timedelta(hours=1, minutes=30)
+        self.todos[0].completed = True
+        self.todos[0].save()
+
+    def export(self, path, **params):
+        response = self.client.get(f"/api/v1/{path}/export/", params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_ndjson_rows_are_flat_and_filtered(self):
+        response, content = self.export("todos", completed="true")
+        self.assertEqual(
+            response["Content-Type"], "application/x-ndjson; charset=utf-8"
+        )
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["id"], self.todos[0].pk)
+        self.assertEqual(rows[0]["project"], self.project.pk)
+        self.assertEqual(rows[0]["estimated_time"], "01:30:00")
+        self.assertTrue(rows[0]["updated_at"].endswith("Z"))
+        self.assertIsNone(rows[0]["milestone"])
+
+    def test_csv_export(self):
+        response, content = self.export("todos", format="csv")
+        rows = list(csv.DictReader(io.StringIO(content)))
+        # Ordered by the watermark, the todo changed last comes last.
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[-1]["title"], "Task 0")
+        self.assertEqual(rows[0]["milestone"], "")
+        self.assertIn('filename="todo.csv"', response["Content-Disposition"])
+
+    def test_updated_since_watermark_drives_incremental_extracts(self):
+        response, content = self.export("todos")
+        watermark = response["X-Export-Watermark"]
+        response, content = self.export("todos", updated_since=watermark)
+        self.assertEqual(content, "")
+        self.assertNotIn("X-Export-Watermark", response)
+        self.todos[1].title = "Changed"
+        self.todos[1].save()
+        response, content = self.export("todos", updated_since=watermark)
+        self.assertEqual(
+            [json.loads(line)["title"] for line in content.splitlines()], ["Changed"]
+        )
+        response = self.client.get(
+            "/api/v1/todos/export/", {"updated_since": "yesterday"}
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            "/api/v1/todos/export/", {"updated_since": "yesterday", "format": "csv"}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            list(csv.reader(io.StringIO(response.content.decode()))),
+            [["updated_since"], ["Expected an ISO 8601 date and time."]],
+        )
+
+    def test_rows_changed_within_the_lag_are_left_to_the_next_extract(self):
+        with override_settings(EXPORT_WATERMARK_LAG=60):
+            response, content = self.export("todos")
+        self.assertEqual(content, "")
+        self.assertNotIn("X-Export-Watermark", response)
+
+    def test_edited_comments_are_exported_again(self):
+        comment = Comment.objects.create(
+            todo=self.todos[0], user=self.user, content="Soon"
+        )
+        watermark = self.export("comments")[0]["X-Export-Watermark"]
+        comment.content = "Later"
+        comment.save()
+        response, content = self.export("comments", updated_since=watermark)
+        self.assertEqual(
+            [json.loads(line)["content"] for line in content.splitlines()], ["Later"]
+        )
+
+    def test_activity_logs_are_watermarked_by_id(self):
+        # Recorded before the first extract, written after it.
+        late = activity_log.entry(self.user.pk, "updated", "Todo: Task 1")
+        activity_log.flush()
+        response, content = self.export("activity-logs")
+        watermark = response["X-Export-Watermark"]
+        self.assertEqual(watermark, str(json.loads(content.splitlines()[-1])["id"]))
+        with self.captureOnCommitCallbacks(execute=True):
+            activity_log.record_many([late])
+        activity_log.flush()
+        response, content = self.export("activity-logs", after=watermark)
+        self.assertEqual(
+            [json.loads(line)["action"] for line in content.splitlines()], ["updated"]
+        )
+        for after in ["x", "\u00b2"]:
+            response = self.client.get(
+                "/api/v1/activity-logs/export/", {"after": after}
+            )
+            self.assertEqual(response.status_code, 400, after)
+
+    @override_settings(EXPORT_CHUNK_SIZE=100)
+    def test_asgi_exports_are_streamed(self):
+        Todo.objects.bulk_create(
+            Todo(
+                title=f"Bulk {i}",
+                description="x" * 1000,
+                user=self.user,
+                project=self.project,
+            )
+            for i in range(4000)
+        )
+        token = Token.objects.create(user=self.user)
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        status, size = asgi_get(
+            "/api/v1/todos/export/?format=csv",
+            {"Authorization": f"Token {token.key}"},
+        )
+        self.assertEqual(status, 200)
+        self.assertGreater(size, 4 * 10**6)
+        self.assertLess(tracemalloc.get_traced_memory()[1], 2**20)
+
+    def test_activity_log_watermarks_lag_behind_recent_entries(self):
+        activity_log.flush()
+        ActivityLog.objects.all().delete()
+        now = timezone.now()
+        # A recent entry written before an entry recorded earlier.
+        recent = activity_log.entry(self.user.pk, "updated", "Todo: Task 1")
+        earlier = activity_log.entry(self.user.pk, "deleted", "Todo: Task 2")
+        earlier.timestamp = now - timedelta(minutes=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            activity_log.record_many([recent, earlier])
+        activity_log.flush()
+        with override_settings(EXPORT_WATERMARK_LAG=60):
+            response, content = self.export("activity-logs")
+            watermark = response["X-Export-Watermark"]
+            self.assertEqual(watermark, str(earlier.pk))
+            self.assertEqual(
+                [json.loads(line)["action"] for line in content.splitlines()],
+                ["updated", "deleted"],
+            )
+            with self.captureOnCommitCallbacks(execute=True):
+                activity_log.record(self.user.pk, "created", "Todo: Task 3")
+            activity_log.flush()
+            response, content = self.export("activity-logs", after=watermark)
+            self.assertEqual(content, "")
+            self.assertNotIn("X-Export-Watermark", response)
+        response, content = self.export("activity-logs", after=watermark)
+        self.assertEqual(
+            [json.loads(line)["action"] for line in content.splitlines()], ["created"]
+        )
+
+    def test_management_command_matches_the_endpoint(self):
+        activity_log.flush()
+        response, content = self.export("activity-logs", action="created")
+        out = io.StringIO()
+        call_command(
+            "export",
+            "activity-logs",
+            "--filter",
+            "action=created",
+            stdout=out,
+            stderr=io.StringIO(),
+        )
+        self.assertEqual(out.getvalue(), content)
+        self.assertEqual(len(content.splitlines()), 6)
+        self.client.logout()
+        response = self.client.get("/api/v1/activity-logs/export/")
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get("/api/v1/activity-logs/export/?format=csv")
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(response.content.startswith(b"detail\r\n"))
+
+
+class ImportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(
+            MEDIA_ROOT=media.name, IMPORT_IN_BACKGROUND=False, IMPORT_CHUNK_SIZE=3
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client.force_login(self.user)
+        self.category = Category.objects.create(name="Backend", project=self.project)
+
+    def ndjson(self, rows):
+        lines = [row if isinstance(row, str) else json.dumps(row) for row in rows]
+        return SimpleUploadedFile("todos.ndjson", "\n".join(lines).encode())
+
+    def upload(self, file):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/v1/imports/",
+                {"project": f"/api/v1/projects/{self.project.pk}/", "file": file},
+            )
+        self.assertEqual(response.status_code, 202, response.content)
+        return ImportJob.objects.get(pk=response.json()["id"])
+
+    def test_rows_are_imported_with_their_references(self):
+        job = self.upload(
+            self.ndjson(
+                [
+                    {"title": "Schema", "category": "Backend", "tags": ["db", "api"]},
+                    {
+                        "title": "Docs",
+                        "milestone": "Beta",
+                        "milestone_due_date": "2030-01-01",
+                        "tags": "api",
+                        "estimated_time": "01:00:00",
+                    },
+                    {"title": "Bad priority", "priority": "SOON"},
+                    "{not json",
+                    {"title": "Release", "milestone": "Beta", "category": "Ops"},
+                    {"title": "Launch", "milestone": "GA"},
+                ]
+            )
+        )
+        self.assertEqual(job.status, "COMPLETED")
+        self.assertEqual((job.rows_processed, job.created_count), (6, 3))
+        self.assertEqual([error["row"] for error in job.errors], [3, 4, 6])
+        self.assertIn("priority", job.errors[0]["errors"])
+        release = Todo.objects.get(title="Release")
+        self.assertEqual(release.milestone, Todo.objects.get(title="Docs").milestone)
+        self.assertEqual(release.milestone.due_date, date(2030, 1, 1))
+        self.assertEqual(release.category.name, "Ops")
+        self.assertEqual(Todo.objects.get(title="Schema").category, self.category)
+        self.assertEqual(Tag.objects.get(name="api").todos.count(), 2)
+        self.assertEqual(release.user, self.user)
+        self.assertEqual(ProjectStats.objects.get(pk=self.project.pk).total, 3)
+        self.assertEqual(
+            self.client.get(f"/api/v1/imports/{job.pk}/").json()["created_count"], 3
+        )
+        recorded = {
+            (change["model"], change["id"]) for change in changes([self.project.pk])[0]
+        }
+        self.assertIn(("category", release.category_id), recorded)
+        self.assertIn(("milestone", release.milestone_id), recorded)
+
+    def test_undecodable_rows_are_reported_alone(self):
+        for name, content in [
+            ("todos.ndjson", b'{"title": "Ok"}\n{"title": "Caf\xe9"}\n{"title": "A"}'),
+            ("todos.csv", b"\xef\xbb\xbftitle\nOk\nCaf\xe9\nOk\n"),
+        ]:
+            job = self.upload(SimpleUploadedFile(name, content))
+            self.assertEqual(job.status, "COMPLETED", name)
+            self.assertEqual((job.rows_processed, job.created_count), (3, 2), name)
+            self.assertEqual(job.errors, [{"row": 2, "errors": ["Invalid UTF-8."]}])
+
+    def test_chunks_take_a_constant_number_of_queries(self):
+        def queries(count):
+            rows = [{"title": f"Task {i}", "tags": ["a", "b"]} for i in range(count)]
+            job = ImportJob.objects.create(
+                project=self.project, user=self.user, format="ndjson"
+            )
+            job.file.save("todos.ndjson", self.ndjson(rows))
+            with CaptureQueriesContext(connection) as ctx:
+                TodoImporter(job, chunk_size=count).run()
+            return len(ctx.captured_queries)
+
+        queries(1)  # creates the tags
+        self.assertEqual(queries(2), queries(50))
+
+    def test_interrupted_import_resumes_after_the_last_chunk(self):
+        rows = [{"title": f"Task {i}"} for i in range(7)]
+        original = TodoImporter.import_chunk
+        calls = []
+
+        def interrupted(importer, chunk):
+            calls.append(chunk)
+            if len(calls) == 2:
+                raise DatabaseError("connection lost")
+            return original(importer, chunk)
+
+        with mock.patch.object(TodoImporter, "import_chunk", interrupted):
+            job = self.upload(self.ndjson(rows))
+        self.assertEqual((job.status, job.rows_processed), ("FAILED", 3))
+        self.assertEqual(job.failure, "connection lost")
+
+        ImportJob.objects.filter(pk=job.pk).update(
+            status="RUNNING", updated_at=timezone.now()
+        )
+        with mock.patch("todos.views.start_import") as start:
+            response = self.client.post(f"/api/v1/imports/{job.pk}/resume/")
+        self.assertEqual(response.status_code, 409)
+        start.assert_not_called()
+        ImportJob.objects.filter(pk=job.pk).update(
+            updated_at=timezone.now() - timedelta(minutes=10)
+        )
+        response = self.client.post(f"/api/v1/imports/{job.pk}/resume/")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["status"], "COMPLETED")
+        self.assertEqual(
+            sorted(Todo.objects.values_list("title", flat=True)),
+            [f"Task {i}" for i in range(7)],
+        )
+        response = self.client.post(f"/api/v1/imports/{job.pk}/resume/")
+        self.assertEqual(response.status_code, 400)
+
+    def test_import_taken_over_by_another_worker_stops(self):
+        rows = [{"title": f"Task {i}"} for i in range(7)]
+        original = TodoImporter.import_chunk
+
+        def taken_over(importer, chunk):
+            if importer.job.rows_processed == 3:
+                # Another worker claims the job, stale to it, meanwhile.
+                ImportJob.objects.filter(pk=importer.job.pk).update(
+                    attempt=F("attempt") + 1
+                )
+            return original(importer, chunk)
+
+        job = ImportJob.objects.create(
+            project=self.project, user=self.user, format="ndjson"
+        )
+        job.file.save("todos.ndjson", self.ndjson(rows))
+        with mock.patch.object(TodoImporter, "import_chunk", taken_over):
+            with self.assertLogs("todos.importer", "WARNING"):
+                self.assertFalse(TodoImporter(job).run())
+        job.refresh_from_db()
+        self.assertEqual(
+            (job.status, job.rows_processed, job.attempt), ("RUNNING", 3, 2)
+        )
+        self.assertEqual(Todo.objects.filter(title__startswith="Task").count(), 3)
+
+    def test_management_command_imports_csv(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as file:
+            file.write("title,completed,tags,due_date\n")
+            file.write('Ship,true,"release, ops",2030-01-01T09:00:00Z\n')
+            file.write("Plan,,,\n")
+        self.addCleanup(os.remove, file.name)
+        out = io.StringIO()
+        call_command(
+            "import_todos",
+            file.name,
+            project=self.project.pk,
+            user=self.user.username,
+            stdout=out,
+        )
+        self.assertIn("2 todos created", out.getvalue())
+        ship = Todo.objects.get(title="Ship")
+        self.assertTrue(ship.completed)
+        self.assertEqual(
+            sorted(ship.tags.values_list("name", flat=True)), ["ops", "release"]
+        )
+        self.assertFalse(Todo.objects.get(title="Plan").completed)
+
+    def test_import_requires_project_membership(self):
+        other = Project.objects.create(name="Other", owner=self.user)
+        response = self.client.post(
+            "/api/v1/imports/",
+            {
+                "project": f"/api/v1/projects/{other.pk}/",
+                "file": self.ndjson([{"title": "x"}]),
+            },
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(ImportJob.objects.exists())
+
+
+class ChangeFeedTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.broker = InProcessBroker()
+        patcher = mock.patch("todos.feed.broker", self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_login(self.user)
+
+    def test_changes_are_published_to_their_projects_on_commit(self):
+        other = Project.objects.create(name="Other", owner=self.user)
+        subscription, _ = self.broker.subscribe(self.project.pk)
+        left, _ = self.broker.subscribe(other.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            todo = Todo.objects.create(
+                title="Ship", user=self.user, project=self.project
+            )
+            Comment.objects.create(todo=todo, user=self.user, content="Soon")
+            self.assertEqual(subscription.drain(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            todo.project = other
+            todo.save()
+        events = subscription.drain()
+        self.assertEqual(
+            [type for _, type, _ in events],
+            ["todo.created", "comment.created", "todo.updated"],
+        )
+        self.assertEqual(events[0][2]["title"], "Ship")
+        self.assertEqual(events[2][2]["project"], other.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            todo.delete()
+        self.assertEqual(
+            [type for _, type, _ in left.drain()],
+            ["todo.updated", "comment.deleted", "todo.deleted"],
+        )
+
+    def test_milestones_are_published_however_created(self):
+        subscription, _ = self.broker.subscribe(self.project.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            Milestone.objects.create(
+                name="Beta", project=self.project, due_date="2030-01-01"
+            )
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        row = {"title": "Ship", "milestone": "GA", "milestone_due_date": "2031-01-01"}
+        with override_settings(MEDIA_ROOT=media.name):
+            with self.captureOnCommitCallbacks(execute=True):
+                job = ImportJob.objects.create(
+                    project=self.project, user=self.user, format="ndjson"
+                )
+                job.file.save(
+                    "todos.ndjson",
+                    SimpleUploadedFile("todos.ndjson", json.dumps(row).encode()),
+                )
+                TodoImporter(job).run()
+        self.assertEqual(
+            [
+                (type, data["name"], data["due_date"])
+                for _, type, data in subscription.drain()
+                if type.startswith("milestone.")
+            ],
+            [
+                ("milestone.created", "Beta", "2030-01-01"),
+                ("milestone.created", "GA", "2031-01-01"),
+            ],
+        )
+
+    def test_reconnecting_clients_get_the_events_they_missed(self):
+        self.broker.publish(self.project.pk, "todo.created", {"id": 1})
+        subscription, _ = self.broker.subscribe(self.project.pk)
+        self.broker.publish(self.project.pk + 1, "todo.created", {"id": 2})
+        self.broker.publish(self.project.pk, "todo.updated", {"id": 1})
+        ((last_id, _, _),) = subscription.drain()
+        _, missed = self.broker.subscribe(self.project.pk, f"{self.broker.epoch}-1")
+        self.assertEqual(missed, [(last_id, "todo.updated", {"id": 1})])
+        _, missed = self.broker.subscribe(self.project.pk, last_id)
+        self.assertEqual(missed, [])
+        # Ids of another process or beyond the history cannot be resumed.
+        self.assertIsNone(self.broker.subscribe(self.project.pk, "0-1")[1])
+        with override_settings(FEED_HISTORY=1):
+            broker = InProcessBroker()
+            for i in range(3):
+                broker.publish(self.project.pk, "todo.updated", {"id": i})
+            self.assertIsNone(broker.subscribe(self.project.pk, f"{broker.epoch}-1")[1])
+            self.assertEqual(
+                len(broker.subscribe(self.project.pk, f"{broker.epoch}-2")[1]), 1
+            )
+
+    def test_slow_clients_are_dropped(self):
+        with override_settings(FEED_QUEUE_SIZE=2):
+            subscription, _ = self.broker.subscribe(self.project.pk)
+        for i in range(3):
+            self.broker.publish(self.project.pk, "todo.updated", {"id": i})
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual(len(subscription.wait(0)), 2)
+
+    def test_event_stream_resumes_after_last_event_id(self):
+        self.broker.publish(self.project.pk, "todo.created", {"id": 1})
+        self.broker.publish(self.project.pk, "todo.updated", {"id": 1})
+        response = self.client.get(
+            f"/api/v1/projects/{self.project.pk}/events/",
+            HTTP_LAST_EVENT_ID=f"{self.broker.epoch}-1",
+        )
+        self.assertEqual(response["Content-Type"], "text/event-stream; charset=utf-8")
+        chunks = iter(response.streaming_content)
+        self.assertEqual(next(chunks), b": feed\nretry: 3000\n\n")
+        self.assertEqual(
+            next(chunks),
+            f"id: {self.broker.epoch}-2\nevent: todo.updated\n"
+            f'data: {{"id":1}}\n\n'.encode(),
+        )
+        with override_settings(FEED_HEARTBEAT=0):
+            self.assertEqual(next(chunks), b": heartbeat\n\n")
+        response.close()
+        self.assertEqual(self.broker._subscribers, {})
+
+        for last_event_id in ["stale-1", f"{self.broker.epoch}-\u00b2"]:
+            response = self.client.get(
+                f"/api/v1/projects/{self.project.pk}/events/",
+                {"last_event_id": last_event_id},
+            )
+            chunks = iter(response.streaming_content)
+            next(chunks)
+            self.assertIn(b"event: reset", next(chunks))
+            response.close()
+
+    def test_event_stream_requires_membership(self):
+        other = Project.objects.create(name="Other", owner=self.user)
+        response = self.client.get(f"/api/v1/projects/{other.pk}/events/")
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(response.content.startswith(b"event: error\n"))
+
+    async def test_events_delivered_before_the_loop_is_bound_wake_it(self):
+        subscription, _ = self.broker.subscribe(self.project.pk)
+        self.broker.publish(self.project.pk, "todo.created", {"id": 1})
+        subscription.bind_loop()
+        events = await asyncio.wait_for(subscription.wait_async(60), 1)
+        self.assertEqual([type for _, type, _ in events], ["todo.created"])
+        self.broker.unsubscribe(subscription)
+
+    async def test_event_stream_is_served_from_the_event_loop(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(
+            f"/api/v1/projects/{self.project.pk}/events/"
+        )
+        self.assertTrue(response.is_async)
+        chunks = aiter(response.streaming_content)
+        await anext(chunks)
+        self.broker.publish(self.project.pk, "todo.created", {"id": 1})
+        self.assertIn(b"event: todo.created", await anext(chunks))
+        await chunks.aclose()
+
+
+class SyncTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def sync(self, since="", **params):
+        response = self.client.get("/api/v1/sync/", {"since": since, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def summary(self, data):
+        return [
+            (change["model"], change["id"], change["project"], change["deleted"])
+            for change in data["changes"]
+        ]
+
+    def test_sync_returns_changes_since_the_token(self):
+        category = Category.objects.create(name="Backend", project=self.project)
+        todo = Todo.objects.create(
+            title="Ship", user=self.user, project=self.project, category=category
+        )
+        comment = Comment.objects.create(todo=todo, user=self.user, content="Soon")
+        data = self.sync()
+        self.assertEqual(
+            self.summary(data),
+            [
+                ("category", category.pk, self.project.pk, False),
+                ("todo", todo.pk, self.project.pk, False),
+                ("comment", comment.pk, self.project.pk, False),
+            ],
+        )
+        self.assertEqual(data["changes"][1]["data"]["category"], category.pk)
+        self.assertEqual(data["projects"], [self.project.pk])
+        self.assertFalse(data["has_more"])
+
+        for title in ["Ship it", "Ship it now"]:
+            todo.title = title
+            todo.save()
+        comment_pk = comment.pk
+        comment.delete()
+        with self.assertNumQueries(5):
+            changes = self.sync(data["next"])
+        self.assertEqual(
+            self.summary(changes),
+            [
+                ("todo", todo.pk, self.project.pk, False),
+                ("comment", comment_pk, self.project.pk, True),
+            ],
+        )
+        self.assertEqual(changes["changes"][0]["data"]["title"], "Ship it now")
+        self.assertIsNone(changes["changes"][1]["data"])
+        self.assertEqual(self.sync(changes["next"])["changes"], [])
+        self.assertEqual(self.sync(changes["next"])["next"], changes["next"])
+
+    def test_touched_todos_are_synced_again(self):
+        todo = Todo.objects.create(title="Ship", user=self.user, project=self.project)
+        token = self.sync()["next"]
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(todo=todo, user=self.user, content="Soon")
+        changes = self.sync(token)["changes"]
+        self.assertEqual(
+            [(change["model"], change["id"]) for change in changes],
+            [("comment", changes[0]["id"]), ("todo", todo.pk)],
+        )
+        todo.refresh_from_db()
+        self.assertEqual(
+            changes[1]["data"]["updated_at"],
+            todo.updated_at.isoformat().replace("+00:00", "Z"),
+        )
+
+    def test_moved_todos_leave_tombstones(self):
+        todo = Todo.objects.create(title="Ship", user=self.user, project=self.project)
+        comment = Comment.objects.create(todo=todo, user=self.user, content="Soon")
+        token = self.sync()["next"]
+        other = Project.objects.create(name="Other", owner=self.user)
+        other.members.add(self.user)
+        todo.project = other
+        todo.save()
+        self.assertEqual(
+            self.summary(self.sync(token)),
+            [
+                ("todo", todo.pk, self.project.pk, True),
+                ("todo", todo.pk, other.pk, False),
+                ("comment", comment.pk, self.project.pk, True),
+                ("comment", comment.pk, other.pk, False),
+            ],
+        )
+        data = self.sync(project=other.pk)
+        self.assertEqual(len(data["changes"]), 2)
+        self.assertEqual(data["projects"], [self.project.pk, other.pk])
+
+    def test_bulk_writes_are_recorded_and_paged(self):
+        todos = Todo.objects.bulk_create(
+            Todo(title=f"Task {i}", user=self.user, project=self.project)
+            for i in range(3)
+        )
+        todos_bulk_created(todos)
+        with override_settings(SYNC_PAGE_SIZE=2):
+            first = self.sync()
+            second = self.sync(first["next"])
+        self.assertTrue(first["has_more"])
+        self.assertFalse(second["has_more"])
+        self.assertEqual(
+            [change["id"] for change in first["changes"] + second["changes"]],
+            [todo.pk for todo in todos],
+        )
+
+    def test_tokens_hold_the_position_reached_in_each_project(self):
+        other = Project.objects.create(name="Other", owner=self.user)
+        other.members.add(self.user)
+        Todo.objects.create(title="Ship", user=self.user, project=self.project)
+        Todo.objects.create(title="Plan", user=self.user, project=other)
+        token = self.sync()["next"]
+        self.assertEqual(token, f"{self.project.pk}:1,{other.pk}:1")
+        todo = Todo.objects.create(title="Test", user=self.user, project=other)
+        data = self.sync(token)
+        self.assertEqual(self.summary(data), [("todo", todo.pk, other.pk, False)])
+        self.assertEqual(data["changes"][0]["seq"], 2)
+        self.assertEqual(data["next"], f"{self.project.pk}:1,{other.pk}:2")
+        for token in ["42", "1:\u00b2", "1:2:3"]:
+            response = self.client.get("/api/v1/sync/", {"since": token})
+            self.assertEqual(response.status_code, 400, token)
+
+    def test_sync_is_limited_to_member_projects(self):
+        other = Project.objects.create(name="Other", owner=self.user)
+        Todo.objects.create(title="Hidden", user=self.user, project=other)
+        self.assertEqual(self.sync()["changes"], [])
+        response = self.client.get(f"/api/v1/sync/?project={other.pk}")
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get("/api/v1/sync/?since=yesterday")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/v1/sync/", {"project": "\u00b2"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(ROOT_URLCONF=ASYNC_URLCONF)
+class AsyncReadTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.user)
+        self.todo = Todo.objects.create(
+            title="Ship", user=self.user, project=self.project
+        )
+
+    def get(self, url, **extra):
+        return self.client.get(
+            url, HTTP_AUTHORIZATION=f"Token {self.token.key}", **extra
+        )
+
+    def test_reads_are_served_by_coroutines(self):
+        self.assertTrue(asyncio.iscoroutinefunction(resolve("/api/v1/todos/").func))
+        self.assertFalse(asyncio.iscoroutinefunction(resolve("/api/v1/comments/").func))
+        urls = [
+            "/api/v1/todos/",
+            f"/api/v1/todos/{self.todo.pk}/",
+            "/api/v1/projects/",
+            f"/api/v1/projects/{self.project.pk}/",
+        ]
+        for url in urls:
+            response = self.get(url)
+            self.assertEqual(response.status_code, 200)
+            with override_settings(ROOT_URLCONF="todos.tests"):
+                self.assertEqual(response.json(), self.get(url).json())
+
+    def test_authentication_and_permissions(self):
+        response = self.client.get(
+            "/api/v1/todos/", HTTP_AUTHORIZATION="Token not-a-token"
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()["detail"], "Invalid token.")
+        self.assertEqual(self.client.get("/api/v1/todos/").status_code, 200)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get("/api/v1/todos/").status_code, 200)
+        self.assertEqual(self.get("/api/v1/todos/0/").status_code, 404)
+        self.assertEqual(self.get("/api/v1/todos/?project=x").status_code, 400)
+        # Writes go through the sync views.
+        response = self.client.patch(
+            f"/api/v1/todos/{self.todo.pk}/",
+            {"title": "Shipped"},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {self.token.key}",
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_and_cached_responses(self):
+        response = self.get(f"/api/v1/todos/{self.todo.pk}/")
+        response = self.get(
+            f"/api/v1/todos/{self.todo.pk}/", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.get("/api/v1/projects/")["X-Cache"], "MISS")
+        with self.assertNumQueries(0):
+            # The token and the response both come from caches.
+            self.assertEqual(self.get("/api/v1/projects/")["X-Cache"], "HIT")
+
+    async def test_reads_on_the_event_loop(self):
+        response = await self.async_client.get(
+            f"/api/v1/todos/{self.todo.pk}/",
+            headers={"Authorization": f"Token {self.token.key}"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["title"], "Ship")
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get("/api/v1/projects/")
+        self.assertEqual(response.json()["count"], 1)
+
+
+@override_settings(ROOT_URLCONF=ASYNC_URLCONF)
+class AsyncConditionalRequestTests(ConditionalRequestTests):
+    """``ConditionalRequestTests`` against the async read views."""
+
+
+@override_settings(ROOT_URLCONF=ASYNC_URLCONF)
+class AsyncResponseCacheTests(ResponseCacheTests):
+    """``ResponseCacheTests`` against the async read views."""
+
+
+@override_settings(ROOT_URLCONF=ASYNC_URLCONF)
+class AsyncKeysetPaginationTests(KeysetPaginationTests):
+    """``KeysetPaginationTests`` against the async read views."""
+
+
+class CompactFormatTests(APITestCase):
+    def compact(self, url, **extra):
+        response = self.client.get(
+            url, HTTP_ACCEPT="application/json; profile=compact", **extra
+        )
+        self.assertEqual(response["Content-Type"], "application/json; profile=compact")
+        return response.status_code, json.loads(response.content)
+
+    def test_compact_representation_matches_the_regular_one(self):
+        todo = self.create_todos(3)[0]
+        self.client.force_login(self.user)
+        urls = [
+            "/api/v1/todos/",
+            "/api/v1/todos/?fields=url,title,tags,subtasks",
+            "/api/v1/todos/?pagination=cursor",
+            f"/api/v1/todos/{todo.pk}/",
+            f"/api/v1/todos/{todo.pk}/?expand=project",
+            "/api/v1/projects/",
+            f"/api/v1/projects/{self.project.pk}/",
+            "/api/v1/comments/",
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                expected = self.client.get(url).json()
+                self.assertEqual(self.compact(url), (200, expected))
+        with mock.patch("todos.compact.orjson", None):
+            self.assertEqual(self.compact("/api/v1/todos/")[1]["count"], 6)
+
+    def test_format_query_parameter(self):
+        todo = self.create_todos(1)[0]
+        response = self.client.get(f"/api/v1/todos/{todo.pk}/?format=compact")
+        self.assertEqual(response["Content-Type"], "application/json; profile=compact")
+        # Links keep the format, as they do for ``?format=json``.
+        self.assertEqual(
+            json.loads(response.content)["url"],
+            f"http://testserver/api/v1/todos/{todo.pk}/?format=compact",
+        )
+        response = self.client.get(f"/api/v1/todos/{todo.pk}/tree/?format=compact")
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_links_of_compact_pages(self):
+        self.create_todos(3)
+        with mock.patch.object(PageNumberPagination, "page_size", 4):
+            status, page = self.compact("/api/v1/todos/?pagination=cursor")
+            status, rest = self.compact(page["next"])
+            self.assertEqual(self.compact(rest["previous"]), (200, page))
+        self.assertEqual(len(page["results"] + rest["results"]), 6)
+
+    def test_compact_queries_do_not_grow_with_the_page(self):
+        def count(size):
+            with mock.patch.object(PageNumberPagination, "page_size", size):
+                with CaptureQueriesContext(connection) as ctx:
+                    self.compact("/api/v1/todos/")
+            return len(ctx.captured_queries)
+
+        self.create_todos(10)
+        self.assertEqual(count(2), count(20))
+
+    def test_missing_objects_and_validators(self):
+        self.assertEqual(self.compact("/api/v1/todos/0/")[0], 404)
+        todo = self.create_todos(1)[0]
+        url = f"/api/v1/todos/{todo.pk}/"
+        accept = "application/json; profile=compact"
+        compact = self.client.get(url, HTTP_ACCEPT=accept)
+        self.assertNotEqual(compact["ETag"], self.client.get(url)["ETag"])
+        response = self.client.get(
+            url, HTTP_ACCEPT=accept, HTTP_IF_NONE_MATCH=compact["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(ROOT_URLCONF=ASYNC_URLCONF)
+class AsyncCompactFormatTests(CompactFormatTests):
+    """``CompactFormatTests`` against the async read views."""
+
+
+class TokenCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.user)
+        self.auth = CachedTokenAuthentication()
+
+    def authenticate(self):
+        request = RequestFactory().get(
+            "/", HTTP_AUTHORIZATION=f"Token {self.token.key}"
+        )
+        return self.auth.authenticate(request)
+
+    def test_tokens_are_looked_up_once(self):
+        before = token_cache.stats()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate(), (self.user, self.token))
+        with self.assertNumQueries(0):
+            user, token = self.authenticate()
+        self.assertEqual((user.username, token.key), ("alice", self.token.key))
+        stats = token_cache.stats()
+        self.assertEqual(stats["hits"] - before["hits"], 1)
+        self.assertEqual(stats["misses"] - before["misses"], 1)
+        self.assertGreater(stats["hit_rate"], 0)
+        with self.assertRaisesMessage(AuthenticationFailed, "Invalid token."):
+            self.auth.authenticate_credentials("unknown")
+
+    def test_logout_evicts_the_token(self):
+        auth = f"Token {self.token.key}"
+        self.assertEqual(
+            self.client.get("/api/v1/todos/", HTTP_AUTHORIZATION=auth).status_code, 200
+        )
+        response = self.client.post("/api/v1/auth/logout/", HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, 204)
+        with self.assertRaisesMessage(AuthenticationFailed, "Invalid token."):
+            self.authenticate()
+
+    def test_password_changes_and_deactivation_evict_the_user(self):
+        self.authenticate()
+        response = self.client.post(
+            "/api/v1/auth/password-reset-confirm/",
+            {
+                "uid": urlsafe_base64_encode(force_bytes(self.user.pk)),
+                "token": default_token_generator.make_token(self.user),
+                "new_password": "n3w-secret",
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            user, token = self.authenticate()
+        self.assertTrue(user.check_password("n3w-secret"))
+        user.is_active = False
+        user.save()
+        with self.assertRaisesMessage(AuthenticationFailed, "User inactive"):
+            self.authenticate()
+        # Logins only stamp ``last_login`` and keep the entry.
+        user.save(update_fields=["last_login"])
+        with self.assertNumQueries(0), self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    async def test_async_lookups_share_the_cache(self):
+        with self.assertRaises(AuthenticationFailed):
+            await self.auth.aauthenticate_credentials("unknown")
+        user, token = await self.auth.aauthenticate_credentials(self.token.key)
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertIsNotNone(await token_cache.aget(self.token.key))
+
+
+class UploadTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client.force_login(self.user)
+        self.todo = Todo.objects.create(
+            title="Crash", user=self.user, project=self.project
+        )
+
+    def start(self, filename="log.txt", todo=None, **data):
+        response = self.client.post(
+            "/api/v1/uploads/",
+            {"todo": f"/api/v1/todos/{(todo or self.todo).pk}/", "filename": filename}
+            | data,
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return f"/api/v1/uploads/{response.json()['id']}/"
+
+    def put_part(self, url, number, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.put(
+                f"{url}parts/{number}/", data, content_type="application/octet-stream"
+            )
+
+    def complete(self, url):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f"{url}complete/")
+
+    def upload(self, *parts, **data):
+        url = self.start(**data)
+        for number, part in enumerate(parts, 1):
+            self.assertEqual(self.put_part(url, number, part).status_code, 200)
+        response = self.complete(url)
+        self.assertEqual(response.status_code, 201, response.content)
+        return Attachment.objects.get(pk=response.json()["id"])
+
+    def files(self, directory):
+        path = os.path.join(self.media, directory)
+        return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+    def download(self, attachment, **headers):
+        response = self.client.get(
+            f"/api/v1/attachments/{attachment.pk}/download/", headers=headers
+        )
+        if response.streaming:
+            content = b"".join(response.streaming_content)
+        else:
+            content = response.content
+        response.close()
+        return response, content
+
+    def write_file(self, size):
+        """Write ``size`` random bytes to a temporary file, without holding them."""
+        file = tempfile.TemporaryFile()
+        self.addCleanup(file.close)
+        for _ in range(size // 2**16):
+            file.write(os.urandom(2**16))
+        file.seek(0)
+        return file
+
+    def test_parts_are_assembled_into_an_attachment(self):
+        url = self.start(size=11, sha256=hashlib.sha256(b"hello world").hexdigest())
+        self.assertEqual(self.put_part(url, 2, b" world").status_code, 200)
+        self.assertEqual(self.put_part(url, 1, b"HELLO").status_code, 200)
+        # Parts are replaced by their next upload.
+        response = self.put_part(url, 1, b"hello")
+        self.assertEqual(response.json()["size"], 5)
+        self.assertEqual(len(self.files("uploads")), 2)
+        self.assertEqual(len(self.client.get(url).json()["parts"]), 2)
+        compact = self.client.get(
+            "/api/v1/uploads/", headers={"Accept": "application/json; profile=compact"}
+        )
+        self.assertEqual(compact.json(), self.client.get("/api/v1/uploads/").json())
+        response = self.complete(url)
+        self.assertEqual(response.status_code, 201, response.content)
+        attachment = Attachment.objects.get(pk=response.json()["id"])
+        self.assertEqual(attachment.todo, self.todo)
+        self.assertEqual(attachment.uploaded_by, self.user)
+        self.assertEqual(attachment.blob.size, 11)
+        with attachment.file.open("rb") as file:
+            self.assertEqual(file.read(), b"hello world")
+        self.assertEqual(self.client.get(url).json()["status"], "COMPLETED")
+        self.assertEqual(self.files("uploads"), [])
+        self.assertEqual(self.put_part(url, 3, b"!").status_code, 400)
+        self.assertEqual(self.complete(url).status_code, 400)
+
+    def test_identical_content_is_stored_once(self):
+        first = self.upload(b"same ", b"content")
+        second = self.upload(b"same content", filename="copy.txt")
+        self.assertEqual(Blob.objects.count(), 1)
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(len(self.files("attachments")), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(Blob.objects.count(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(Blob.objects.count(), 0)
+        self.assertEqual(self.files("attachments"), [])
+
+    def test_uploads_are_checked_before_completing(self):
+        url = self.start(sha256=hashlib.sha256(b"expected").hexdigest())
+        self.put_part(url, 1, b"received")
+        response = self.complete(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("sha256", response.json())
+        url = self.start(size=3)
+        self.put_part(url, 1, b"a")
+        self.put_part(url, 3, b"c")
+        self.assertIn("parts", self.complete(url).json())
+        self.put_part(url, 2, b"bb")
+        self.assertIn("size", self.complete(url).json())
+        self.assertEqual(self.complete(self.start()).status_code, 400)
+        for number in [0, 10001, 3000000000]:
+            self.assertEqual(self.put_part(url, number, b"d").status_code, 400)
+        self.assertEqual(self.put_part(url, "9" * 20, b"d").status_code, 404)
+        with override_settings(UPLOAD_MAX_PART_SIZE=4):
+            self.assertEqual(self.put_part(url, 4, b"12345").status_code, 400)
+        self.assertEqual(Blob.objects.count(), 0)
+        self.assertEqual(self.files("attachments"), [])
+        self.assertEqual(len(self.files("uploads")), 4)
+        response = self.client.post(
+            "/api/v1/uploads/",
+            {"todo": f"/api/v1/todos/{self.todo.pk}/", "filename": "a", "sha256": "x"},
+        )
+        self.assertIn("sha256", response.json())
+
+    def test_missing_parts_are_reported_briefly(self):
+        url = self.start()
+        self.put_part(url, 2, b"b")
+        self.put_part(url, 10000, b"z")
+        response = self.complete(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(), {"parts": ["9998 parts are missing: 1, 3, 4, 5, 6, ..."]}
+        )
+        url = self.start()
+        self.put_part(url, 3, b"c")
+        self.assertEqual(
+            self.complete(url).json(), {"parts": ["2 parts are missing: 1, 2"]}
+        )
+
+    def test_uploads_are_private_to_members(self):
+        other = Project.objects.create(name="Other", owner=self.user)
+        todo = Todo.objects.create(title="Other", user=self.user, project=other)
+        response = self.client.post(
+            "/api/v1/uploads/",
+            {"todo": f"/api/v1/todos/{todo.pk}/", "filename": "log.txt"},
+        )
+        self.assertEqual(response.status_code, 403)
+        url = self.start(filename="../../etc/passwd")
+        self.assertEqual(self.client.get(url).json()["filename"], "passwd")
+        self.client.force_login(User.objects.create_user("bob"))
+        self.assertEqual(self.put_part(url, 1, b"data").status_code, 404)
+
+    def test_deleting_an_upload_deletes_its_parts(self):
+        url = self.start()
+        self.put_part(url, 1, b"part")
+        self.assertEqual(len(self.files("uploads")), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.files("uploads"), [])
+
+    def test_downloads_answer_range_requests(self):
+        data = bytes(range(100))
+        attachment = self.upload(data)
+        etag = f'"{attachment.blob.sha256}"'
+        response, content = self.download(attachment)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, data)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Content-Length"], "100")
+        self.assertEqual(response["ETag"], etag)
+        self.assertIn("attachment", response["Content-Disposition"])
+        cases = {
+            "bytes=10-19": (10, 19),
+            "bytes=90-": (90, 99),
+            "bytes=-5": (95, 99),
+            "bytes=95-1000": (95, 99),
+        }
+        for header, (start, end) in cases.items():
+            response, content = self.download(attachment, Range=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(content, data[start : end + 1])
+            self.assertEqual(response["Content-Range"], f"bytes {start}-{end}/100")
+            self.assertEqual(response["Content-Length"], str(end - start + 1))
+        response, content = self.download(attachment, Range="bytes=100-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */100")
+        # Multiple ranges and stale If-Range validators get the whole file.
+        for headers in [
+            {"Range": "bytes=0-1,5-6"},
+            {"Range": "bytes=0-1", "If-Range": '"stale"'},
+        ]:
+            response, content = self.download(attachment, **headers)
+            self.assertEqual((response.status_code, content), (200, data))
+        response, content = self.download(attachment, Range="bytes=0-1", If_Range=etag)
+        self.assertEqual((response.status_code, content), (206, data[:2]))
+        response, content = self.download(attachment, Accept="video/mp4")
+        self.assertEqual(response.status_code, 200)
+        response, content = self.download(attachment, If_None_Match=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_large_files_are_streamed(self):
+        size = 8 * 2**20
+        upload = Upload.objects.create(todo=self.todo, user=self.user, filename="big")
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        for number in (1, 2):
+            store_part(upload, number, self.write_file(size // 2))
+        self.assertLess(tracemalloc.get_traced_memory()[1], 2**20)
+        tracemalloc.reset_peak()
+        with self.captureOnCommitCallbacks(execute=True):
+            attachment = complete_upload(upload)
+        self.assertEqual(attachment.blob.size, size)
+        self.assertLess(tracemalloc.get_traced_memory()[1], 2**20)
+        for headers in [{}, {"Range": "bytes=1-"}]:
+            tracemalloc.reset_peak()
+            response = self.client.get(
+                f"/api/v1/attachments/{attachment.pk}/download/", headers=headers
+            )
+            received = sum(len(chunk) for chunk in response.streaming_content)
+            response.close()
+            self.assertEqual(received, size - len(headers))
+            self.assertLess(tracemalloc.get_traced_memory()[1], 2**20)
+        token = Token.objects.create(user=self.user)
+        for headers in [{}, {"Range": "bytes=1-"}]:
+            tracemalloc.reset_peak()
+            status, received = asgi_get(
+                f"/api/v1/attachments/{attachment.pk}/download/",
+                {"Authorization": f"Token {token.key}", **headers},
+            )
+            self.assertEqual(status, 206 if headers else 200)
+            self.assertEqual(received, size - len(headers))
+            self.assertLess(tracemalloc.get_traced_memory()[1], 2**20)
+
+
+class InboxTests(APITestCase):
+    now = datetime(2030, 1, 10, 12, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("django.utils.timezone.now", return_value=self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_login(self.user)
+
+    def todo(self, title, hours=None, priority="MEDIUM", **kwargs):
+        due_date = None if hours is None else self.now + timedelta(hours=hours)
+        return Todo.objects.create(
+            title=title,
+            user=self.user,
+            project=self.project,
+            due_date=due_date,
+            priority=priority,
+            **kwargs,
+        )
+
+    def inbox(self, **params):
+        response = self.client.get("/api/v1/me/inbox/", params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def titles(self, data):
+        return [(todo["title"], todo["bucket"]) for todo in data["results"]]
+
+    def test_entries_follow_the_todos(self):
+        tag = Tag.objects.create(name="ops")
+        todo = self.todo("Ship", hours=2, priority="HIGH")
+        self.assertEqual(
+            InboxEntry.objects.values_list("user", "due_date", "priority").get(),
+            (self.user.pk, todo.due_date, 3),
+        )
+        todo.priority = "URGENT"
+        todo.save()
+        self.assertEqual(InboxEntry.objects.get().priority, 4)
+        with CaptureQueriesContext(connection) as ctx:
+            todo.save()
+        # Saves leaving the tracked values alone do not touch the inbox.
+        self.assertNotIn("inboxentry", str(ctx.captured_queries))
+        todo.completed = True
+        todo.save()
+        self.assertFalse(InboxEntry.objects.exists())
+        todo.completed = False
+        todo.user = User.objects.create_user("bob")
+        todo.save()
+        self.assertEqual(InboxEntry.objects.get().user, todo.user)
+        todo.delete()
+        self.assertFalse(InboxEntry.objects.exists())
+
+        response = self.client.post(
+            "/api/v1/todos/bulk/",
+            [
+                {
+                    "title": f"Bulk {i}",
+                    "user": f"http://testserver/users/{self.user.pk}/",
+                    "project": f"/api/v1/projects/{self.project.pk}/",
+                    "tags": [f"/api/v1/tags/{tag.pk}/"],
+                }
+                for i in range(3)
+            ],
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(InboxEntry.objects.filter(someday=True).count(), 3)
+        ids = [todo["id"] for todo in response.json()]
+        response = self.client.patch(
+            "/api/v1/todos/bulk/",
+            [{"id": pk, "completed": True} for pk in ids[:2]],
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(list(InboxEntry.objects.values_list("pk", flat=True)), ids[2:])
+
+        # Updates without signals are caught up with by a rebuild.
+        Todo.objects.update(completed=False)
+        call_command("rebuild_inbox", verbosity=0)
+        self.assertEqual(InboxEntry.objects.count(), 3)
+
+    def test_todos_are_bucketed_by_due_date_and_ordered_by_priority(self):
+        self.todo("Someday", priority="URGENT")
+        self.todo("Late", hours=-30, priority="LOW")
+        self.todo("Late urgent", hours=-30, priority="URGENT")
+        self.todo("Tonight", hours=6)
+        self.todo("Soon", hours=1, priority="HIGH")
+        self.todo("Next week", hours=24 * 7)
+        self.todo("Done", hours=1, completed=True)
+        Todo.objects.create(
+            title="Not mine",
+            user=User.objects.create_user("bob"),
+            project=self.project,
+        )
+        data = self.inbox()
+        self.assertEqual(
+            self.titles(data),
+            [
+                ("Late urgent", "overdue"),
+                ("Late", "overdue"),
+                ("Soon", "today"),
+                ("Tonight", "today"),
+                ("Next week", "upcoming"),
+                ("Someday", "someday"),
+            ],
+        )
+        self.assertEqual(data["count"], 6)
+        self.assertEqual(
+            data["buckets"], {"overdue": 2, "today": 2, "upcoming": 1, "someday": 1}
+        )
+        today = self.inbox(bucket="today")
+        self.assertEqual(self.titles(today), [("Soon", "today"), ("Tonight", "today")])
+        # Noon UTC is 22:00 in Brisbane, whose day ends 2 hours later.
+        brisbane = self.inbox(bucket="today", tz="Australia/Brisbane")
+        self.assertEqual(self.titles(brisbane), [("Soon", "today")])
+        self.assertEqual(brisbane["buckets"]["upcoming"], 2)
+        for params in [{"bucket": "later"}, {"tz": "Mars/Olympus"}]:
+            response = self.client.get("/api/v1/me/inbox/", params)
+            self.assertEqual(response.status_code, 400)
+
+        with mock.patch.object(PageNumberPagination, "page_size", 4):
+            page = self.inbox(pagination="cursor")
+            titles = self.titles(page)
+            page = self.client.get(page["next"]).json()
+        self.assertIsNone(page["next"])
+        self.assertEqual(titles + self.titles(page), self.titles(data))
+
+    def test_pages_cost_the_same_queries_for_any_inbox_size(self):
+        for i in range(3):
+            self.todo(f"Todo {i}", hours=i)
+        self.inbox()  # loads the session and the content types
+        with CaptureQueriesContext(connection) as few:
+            self.inbox()
+        for i in range(3, 30):
+            self.todo(f"Todo {i}", hours=i, priority="HIGH")
+        with CaptureQueriesContext(connection) as many:
+            self.inbox()
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+    @skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN output")
+    def test_buckets_are_read_with_an_index_range_scan(self):
+        buckets = Buckets()
+        for bucket in [None, *BUCKETS]:
+            with self.subTest(bucket=bucket):
+                plan = buckets.entries(self.user, bucket)[:10].explain()
+                self.assertIn("inbox_user_order_idx", plan)
+                self.assertNotIn("TEMP B-TREE", plan)
+
+
+class InstrumentationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.staff = User.objects.create_user("root", is_staff=True)
+
+    def sample(self, text, name, **labels):
+        """Return the value of sample ``name`` with ``labels`` in ``text``."""
+        for line in text.splitlines():
+            sample, _, value = line.rpartition(" ")
+            if sample.partition("{")[0] != name:
+                continue
+            if all(f'{key}="{value}"' in sample for key, value in labels.items()):
+                return float(value)
+        self.fail(f"No {name} {labels} sample in:\n{text}")
+
+    def scrape(self):
+        self.client.force_login(self.staff)
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.client.logout()
+        return response.content.decode()
+
+    def test_requests_are_measured_per_route(self):
+        self.create_todos(3)
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/v1/todos/")
+        self.assertEqual(response.status_code, 200)
+        count = len(queries.captured_queries)
+        self.client.get("/api/v1/todos/")
+
+        text = self.scrape()
+        route = {"route": "todo-list", "method": "GET"}
+        self.assertEqual(
+            self.sample(text, "todos_http_requests_total", status="200", **route), 2
+        )
+        self.assertEqual(
+            self.sample(text, "todos_http_request_duration_seconds_count", **route), 2
+        )
+        self.assertEqual(
+            self.sample(text, "todos_http_request_queries_sum", **route),
+            count * 2,
+        )
+        self.assertGreater(
+            self.sample(text, "todos_http_request_query_duration_seconds_sum", **route),
+            0,
+        )
+        self.assertGreater(
+            self.sample(
+                text, "todos_http_request_serializer_duration_seconds_sum", **route
+            ),
+            0,
+        )
+        self.assertEqual(
+            self.sample(text, "todos_http_response_size_bytes_sum", **route),
+            len(response.content) * 2,
+        )
+        self.assertEqual(
+            self.sample(
+                text,
+                "todos_http_request_queries_bucket",
+                le="+Inf",
+                **route,
+            ),
+            2,
+        )
+
+    def test_repeated_queries_are_logged_with_their_route(self):
+        self.create_todos(10)
+        with self.assertLogs("todos.instrumentation", "WARNING") as logs:
+            self.client.get("/n-plus-one/")
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn(
+            "GET n-plus-one (/n-plus-one/) ran a query 20 times", logs.output[0]
+        )
+        self.assertIn('FROM "todos_project"', logs.output[0])
+        text = self.scrape()
+        self.assertEqual(
+            self.sample(text, "todos_http_repeated_queries_total", route="n-plus-one"),
+            1,
+        )
+
+        self.client.force_login(self.user)
+        with self.assertNoLogs("todos.instrumentation", "WARNING"):
+            self.client.get("/api/v1/todos/")
+
+    def test_slow_requests_are_profiled(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.client.force_login(self.user)
+        with override_settings(
+            INSTRUMENTATION_PROFILE_RATE=1.0,
+            INSTRUMENTATION_PROFILE_THRESHOLD=0,
+            INSTRUMENTATION_PROFILE_DIR=directory.name,
+        ):
+            self.client.get("/api/v1/todos/")
+        (name,) = os.listdir(directory.name)
+        self.assertTrue(name.endswith("-todo-list-GET-%d.prof" % os.getpid()))
+
+        with override_settings(
+            INSTRUMENTATION_PROFILE_RATE=1.0, INSTRUMENTATION_PROFILE_THRESHOLD=60
+        ):
+            self.client.get("/api/v1/todos/")
+        self.assertEqual(len(os.listdir(directory.name)), 1)
+        text = self.scrape()
+        self.assertEqual(
+            self.sample(text, "todos_http_profiles_total", route="todo-list"), 1
+        )
+
+    def test_metrics_are_served_to_staff_and_scrapers(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.client.logout()
+
+        with override_settings(METRICS_TOKEN="s3cret"):
+            response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8"
+            )
+            response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer nope")
+            self.assertEqual(response.status_code, 403)
+
+        token = Token.objects.create(user=self.user)
+        for _ in range(2):
+            self.client.get(
+                "/api/v1/projects/", HTTP_AUTHORIZATION=f"Token {token.key}"
+            )
+        text = self.scrape()
+        self.assertEqual(
+            self.sample(text, "todos_token_cache_requests_total", result="hit"),
+            token_cache.stats()["hits"],
+        )
+        self.assertIn("# TYPE todos_response_cache_requests_total counter", text)
+
+    @override_settings(ROOT_URLCONF=ASYNC_URLCONF)
+    def test_async_requests_are_measured(self):
+        self.create_todos(2)
+        token = Token.objects.create(user=self.user)
+        response = async_to_sync(self.async_client.get)(
+            "/api/v1/todos/", headers={"Authorization": f"Token {token.key}"}
+        )
+        self.assertEqual(response.status_code, 200)
+        text = self.scrape()
+        route = {"route": "todo-list", "method": "GET"}
+        self.assertEqual(
+            self.sample(text, "todos_http_requests_total", status="200", **route), 1
+        )
+        self.assertGreater(
+            self.sample(text, "todos_http_request_queries_sum", **route), 0
+        )
+        self.assertGreater(
+            self.sample(
+                text, "todos_http_request_serializer_duration_seconds_sum", **route
+            ),
+            0,
+        )
+
+
+class BenchmarkTests(APITestCase):
+    def test_generated_data_is_consistent(self):
+        user = generate(
+            users=4, projects=3, members=2, todos=30, depth=2, comments=2, tags=5
+        )
+        todos = Todo.objects.exclude(project=self.project)
+        self.assertEqual(todos.count(), 30)
+        self.assertEqual(todos.filter(parent_task=None).count(), 10)
+        self.assertEqual(
+            todos.filter(parent_task__parent_task__isnull=False).count(), 10
+        )
+        self.assertEqual(Comment.objects.count(), 60)
+        self.assertFalse(todos.filter(tags=None).exists())
+        self.assertEqual(user.projects.exclude(pk=self.project.pk).count(), 3)
+        for project in Project.objects.exclude(pk=self.project.pk):
+            self.assertEqual(project.members.count(), 2)
+            self.assertEqual(project.stats.total, project.todos.count())
+        self.assertEqual(
+            InboxEntry.objects.count(), todos.filter(completed=False).count()
+        )
+        titles = list(todos.order_by("pk").values_list("title", flat=True))
+        Todo.objects.all().delete()
+        User.objects.exclude(pk=self.user.pk).delete()
+        generate(users=4, projects=3, members=2, todos=30, depth=2, comments=2, tags=5)
+        self.assertEqual(
+            list(Todo.objects.order_by("pk").values_list("title", flat=True)), titles
+        )
+
+    def test_regressions_against_a_baseline(self):
+        baseline = {"todos list x1": {"queries": 7.0, "p95": 20.0, "rps": 100.0}}
+        same = {"todos list x1": {"queries": 7.2, "p95": 30.0, "rps": 60.0}}
+        self.assertEqual(regressions(same, baseline, None), [])
+        self.assertEqual(
+            regressions(same, baseline, 0.25),
+            [
+                "todos list x1: p95 30.0 ms, 20.0 ms before",
+                "todos list x1: 60 req/s, 100 before",
+            ],
+        )
+        worse = {"todos list x1": {"queries": 17.0, "p95": 20.0, "rps": 100.0}}
+        self.assertEqual(
+            regressions(worse, baseline, None),
+            ["todos list x1: 17.0 queries per request, 7.0 before"],
+        )
+        self.assertEqual(
+            regressions({"new x1": worse["todos list x1"]}, baseline, 0), []
+        )
+
+
+class DatabaseConfigTests(SimpleTestCase):
+    def test_environment_configures_the_database(self):
+        config = databases({}, Path("/srv"))["default"]
+        self.assertEqual(config["NAME"], Path("/srv/db.sqlite3"))
+        self.assertEqual(config["CONN_MAX_AGE"], 60)
+        self.assertTrue(config["CONN_HEALTH_CHECKS"])
+        self.assertEqual(config["OPTIONS"]["transaction_mode"], "IMMEDIATE")
+        self.assertIn("PRAGMA journal_mode=WAL;", config["OPTIONS"]["init_command"])
+
+        config = databases(
+            {
+                "DJANGO_DB_ENGINE": "postgresql",
+                "DJANGO_DB_HOST": "db",
+                "DJANGO_DB_CONN_MAX_AGE": "none",
+            }
+        )["default"]
+        self.assertEqual(config["ENGINE"], "django.db.backends.postgresql")
+        self.assertEqual((config["HOST"], config["CONN_MAX_AGE"]), ("db", None))
+        self.assertEqual(config["OPTIONS"], {})
+
+        config = databases(
+            {
+                "DJANGO_DB_ENGINE": "postgresql",
+                "DJANGO_DB_POOL": "1",
+                "DJANGO_DB_POOL_MAX_SIZE": "50",
+            }
+        )["default"]
+        # Django refuses persistent connections along with a pool.
+        self.assertEqual(config["CONN_MAX_AGE"], 0)
+        self.assertEqual(
+            config["OPTIONS"]["pool"], {"min_size": 2, "max_size": 50, "timeout": 10}
+        )
+
+        with self.assertRaises(ImproperlyConfigured):
+            databases({"DJANGO_DB_ENGINE": "oracle"})
+
+    def test_parallel_writers_do_not_hit_lock_errors(self):
+        # A file database of its own, as the in-memory test database has no WAL.
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        alias = "concurrency"
+        config = databases(
+            {"DJANGO_DB_NAME": os.path.join(directory.name, "db.sqlite3")}
+        )["default"]
+        connections.settings[alias] = connections.configure_settings(
+            {"default": connections.settings["default"], alias: config}
+        )[alias]
+        self.addCleanup(connections.settings.pop, alias)
+        self.addCleanup(lambda: connections[alias].close())
+        allowed = mock.patch.object(type(self), "databases", {alias})
+        allowed.start()
+        self.addCleanup(allowed.stop)
+        with connections[alias].cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone(), ("wal",))
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone(), (1,))
+            cursor.execute("CREATE TABLE counter (id INTEGER PRIMARY KEY, value INT)")
+            cursor.execute("CREATE TABLE event (writer INT)")
+            cursor.execute("INSERT INTO counter VALUES (1, 0)")
+
+        def write(writer):
+            # Each transaction reads, then writes: deferred transactions
+            # would fail to upgrade their lock while another one writes.
+            try:
+                for _ in range(10):
+                    with transaction.atomic(using=alias):
+                        with connections[alias].cursor() as cursor:
+                            cursor.execute("SELECT value FROM counter WHERE id = 1")
+                            (value,) = cursor.fetchone()
+                            time.sleep(0.001)  # while other writers wait
+                            cursor.execute("INSERT INTO event VALUES (%s)", [writer])
+                            cursor.execute(
+                                "UPDATE counter SET value = %s WHERE id = 1",
+                                [value + 1],
+                            )
+            finally:
+                connections[alias].close()
+
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(write, range(8)))
+
+        with connections[alias].cursor() as cursor:
+            cursor.execute("SELECT value FROM counter")
+            self.assertEqual(cursor.fetchone(), (80,))
+            cursor.execute("SELECT COUNT(*) FROM event")
+            self.assertEqual(cursor.fetchone(), (80,))
@@ -0,0 +1,88 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models.expressions import RawSQL
+
+from .models import Todo
+
+# Columns read for each node, enough to render and roll up the tree.
+TREE_FIELDS = [
+    "id",
+    "parent_task_id",
+    "title",
+    "completed",
+    "priority",
+    "due_date",
+    "estimated_time",
+    "actual_time",
+]
+
+
+def max_depth():
+    return getattr(settings, "TODO_TREE_MAX_DEPTH", 100)
+
+
+def subtree(root_pk, depth, using=None):
+    """
+    Return the todos of the subtree under ``root_pk`` down to ``depth``
+    levels below it as lightweight nodes holding ``TREE_FIELDS``.
+
+    The ids come from a recursive CTE walking the ``parent_task`` index, the
+    columns from ``values()``, in one query and without building models.
+    """
+    using = using or router.db_for_read(Todo)
+    qn = connections[using].ops.quote_name
+    table = qn(Todo._meta.db_table)
+    parent = qn(Todo._meta.get_field("parent_task").column)
+    # The root is never visited twice, which bounds a parent_task cycle
+    # through it; any other cycle cannot be reached from the root.
+    ids = RawSQL(
+        f"WITH RECURSIVE tree (id, depth) AS ("
+        f"SELECT id, 0 FROM {table} WHERE id = %s "
+        f"UNION ALL "
+        f"SELECT t.id, tree.depth + 1 FROM {table} t "
+        f"JOIN tree ON t.{parent} = tree.id "
+        f"WHERE tree.depth < %s AND t.id <> %s"
+        f") SELECT id FROM tree",
+        [root_pk, depth, root_pk],
+    )
+    rows = Todo._base_manager.using(using).filter(pk__in=ids).values(*TREE_FIELDS)
+    return [SimpleNamespace(pk=row["id"], **row) for row in rows]
+
+
+def assemble(nodes, root_pk, depth):
+    """
+    Link ``nodes`` of a ``subtree`` into a tree and return its root.
+
+    Every node gets its ``depth``, 0 for the root, a ``rollup`` over all of
+    ``nodes`` below it and, down to ``depth``, its ``children`` ordered by
+    id. Nodes deeper than ``depth`` are cut off: their parents' ``children``
+    is None.
+    """
+    children = {}
+    for node in sorted(nodes, key=lambda node: node.pk):
+        if node.pk != root_pk:
+            children.setdefault(node.parent_task_id, []).append(node)
+    root = next(node for node in nodes if node.pk == root_pk)
+    root.depth = 0
+    # Breadth first, so reversing visits each subtree before its parent.
+    order = [root]
+    for node in order:
+        below = children.get(node.pk, [])
+        for child in below:
+            child.depth = node.depth + 1
+        order.extend(below)
+        node.children = below if node.depth < depth or not below else None
+    for node in reversed(order):
+        node.rollup = {
+            "total": 1,
+            "completed": int(node.completed),
+            "estimated_time": node.estimated_time or timedelta(),
+            "actual_time": node.actual_time or timedelta(),
+        }
+        for child in children.get(node.pk, []):
+            for name, value in child.rollup.items():
+                node.rollup[name] += value
+    return root
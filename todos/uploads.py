@@ -0,0 +1,318 @@
+import hashlib
+import io
+import itertools
+import os
+import re
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.db.models import ProtectedError
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from rest_framework import renderers
+from rest_framework.exceptions import ValidationError
+
+from .models import Attachment, Blob, Upload, UploadPart
+from .streaming import ThreadedIterator, is_asgi, streaming_content
+
+# Bytes read and written at a time while streaming files.
+CHUNK_SIZE = 64 * 1024
+
+
+def max_part_size():
+    return getattr(settings, "UPLOAD_MAX_PART_SIZE", 64 * 1024 * 1024)
+
+
+def max_parts():
+    return getattr(settings, "UPLOAD_MAX_PARTS", 10000)
+
+
+class HashingReader(io.RawIOBase):
+    """
+    Reads a stream through, counting and hashing what is read. With
+    ``limit``, it ends after ``limit + 1`` bytes, so callers can tell a
+    stream exceeds the limit without reading it to the end.
+    """
+
+    def __init__(self, stream, limit=None):
+        self.stream = stream
+        self.limit = limit
+        self.size = 0
+        self.hash = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+        if self.limit is not None:
+            size = min(size, self.limit + 1 - self.size)
+            if size <= 0:
+                return b""
+        data = self.stream.read(size)
+        self.size += len(data)
+        self.hash.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+class PartsReader(io.RawIOBase):
+    """Reads the files of ``parts`` one after the other, as one stream."""
+
+    def __init__(self, parts):
+        self.parts = iter(parts)
+        self.current = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+        while True:
+            if self.current is None:
+                part = next(self.parts, None)
+                if part is None:
+                    return b""
+                self.current = part.file.open("rb")
+            data = self.current.read(size)
+            if data:
+                return data
+            self.current.close()
+            self.current = None
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+        super().close()
+
+
+def delete_files(files, using=None):
+    """Delete the storage files of ``files`` once the transaction commits."""
+    files = [(file.storage, file.name) for file in files if file]
+    transaction.on_commit(
+        lambda: [storage.delete(name) for storage, name in files], using=using
+    )
+
+
+def store_part(upload, number, stream):
+    """
+    Write part ``number`` of ``upload`` from the binary ``stream`` straight
+    to storage, replacing an earlier upload of the part.
+    """
+    limit = max_part_size()
+    reader = HashingReader(stream, limit)
+    part = UploadPart(upload=upload, number=number)
+    part.file.save(f"{upload.pk}-{number}.part", File(reader), save=False)
+    if reader.size > limit:
+        part.file.delete(save=False)
+        raise ValidationError(f"Parts may hold at most {limit} bytes.")
+    part.size, part.sha256 = reader.size, reader.hexdigest()
+    with transaction.atomic():
+        replaced = list(UploadPart.objects.filter(upload=upload, number=number))
+        for old in replaced:
+            old.delete()
+        part.save()
+    return part
+
+
+def complete_upload(upload):
+    """
+    Assemble the parts of ``upload`` into an attachment of its todo.
+
+    Parts are streamed into a new file while hashed; when a blob of the same
+    content exists, the new file is dropped and the attachment shares the
+    blob's file. Content is only matched once it is uploaded, so a client
+    cannot claim a file by its digest alone.
+    """
+    parts = list(upload.parts.order_by("number"))
+    if not parts:
+        raise ValidationError("No parts were uploaded.")
+    last = parts[-1].number
+    if last > len(parts):
+        numbers = {part.number for part in parts}
+        missing = itertools.islice(
+            (number for number in range(1, last) if number not in numbers), 5
+        )
+        listed = ", ".join(map(str, missing))
+        if last - len(parts) > 5:
+            listed += ", ..."
+        raise ValidationError(
+            {"parts": [f"{last - len(parts)} parts are missing: {listed}"]}
+        )
+    size = sum(part.size for part in parts)
+    if upload.size is not None and size != upload.size:
+        raise ValidationError({"size": [f"{size} bytes were uploaded."]})
+
+    reader = HashingReader(PartsReader(parts))
+    blob = Blob(size=size)
+    content = File(reader)
+    content.size = size
+    try:
+        blob.file.save(upload.filename, content, save=False)
+    finally:
+        reader.stream.close()
+    blob.sha256 = reader.hexdigest()
+    if upload.sha256 and blob.sha256 != upload.sha256:
+        blob.file.delete(save=False)
+        raise ValidationError({"sha256": [f"The content's digest is {blob.sha256}."]})
+
+    with transaction.atomic():
+        pending = Upload.objects.select_for_update().filter(
+            pk=upload.pk, status="PENDING"
+        )
+        if not pending.exists():
+            blob.file.delete(save=False)
+            raise ValidationError({"status": ["The upload has completed."]})
+        existing = Blob.objects.select_for_update().filter(sha256=blob.sha256).first()
+        if existing is None:
+            try:
+                with transaction.atomic():
+                    blob.save()
+            except IntegrityError:
+                # Completed concurrently.
+                existing = Blob.objects.get(sha256=blob.sha256)
+        if existing is not None:
+            delete_files([blob.file])
+            blob = existing
+        attachment = Attachment.objects.create(
+            todo=upload.todo, uploaded_by=upload.user, file=blob.file.name, blob=blob
+        )
+        upload.status = "COMPLETED"
+        upload.attachment = attachment
+        upload.save(update_fields=["status", "attachment", "updated_at"])
+        for part in parts:
+            part.delete()
+    return attachment
+
+
+def release(blob_id, using=None):
+    """Delete blob ``blob_id`` and its file unless attachments still use it."""
+
+    def delete():
+        with transaction.atomic(using=using):
+            blob = Blob.objects.using(using).select_for_update().filter(pk=blob_id)
+            blob = blob.first()
+            if blob is None:
+                return
+            try:
+                blob.delete()
+            except ProtectedError:
+                return
+        blob.file.delete(save=False)
+
+    transaction.on_commit(delete, using=using)
+
+
+class DownloadRenderer(renderers.JSONRenderer):
+    """
+    Accepts any media type for downloads, whose files are sent as they are;
+    errors are rendered as JSON.
+    """
+
+    media_type = "*/*"
+    format = ""
+
+
+_range_re = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header, size):
+    """
+    Return the ``(start, end)`` bytes, inclusive, of a single range
+    ``Range`` header, None to send the whole file, or False when the range
+    cannot be satisfied.
+    """
+    match = _range_re.match(header.replace(" ", ""))
+    if match is None:
+        # Malformed and multiple ranges are answered with the whole file.
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+    return start, end
+
+
+def _ranged(file, start, length):
+    try:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+def file_response(request, field_file, etag=None):
+    """
+    Stream ``field_file`` as an attachment, answering ``Range`` requests for
+    one byte range with 206 Partial Content.
+
+    Whole files go through ``FileResponse``, which WSGI servers hand to
+    ``sendfile`` where they can. Under ASGI, files are read ``CHUNK_SIZE``
+    bytes at a time from the event loop, where Django would read them to
+    the end first. ``If-Range`` must carry ``etag``, the validator of the
+    content, for a range to be sent.
+    """
+    filename = os.path.basename(field_file.name)
+    size = field_file.size
+    header = request.META.get("HTTP_RANGE")
+    if_range = request.META.get("HTTP_IF_RANGE")
+    byte_range = None
+    if header and (if_range is None or (etag is not None and if_range == etag)):
+        byte_range = parse_range(header, size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+    elif byte_range is None:
+        response = FileResponse(
+            field_file.open("rb"), as_attachment=True, filename=filename
+        )
+        response["Content-Length"] = size
+        if is_asgi(request):
+            response.block_size = CHUNK_SIZE
+            response.streaming_content = ThreadedIterator(response.streaming_content)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            streaming_content(
+                request, _ranged(field_file.open("rb"), start, end - start + 1)
+            ),
+            status=206,
+            content_type="application/octet-stream",
+        )
+        response["Content-Length"] = end - start + 1
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Disposition"] = content_disposition_header(True, filename)
+    response["Accept-Ranges"] = "bytes"
+    if etag is not None:
+        response["ETag"] = etag
+    return response
@@ -24,6 +24,11 @@ from .views import (
     AttachmentViewSet,
     RecurringTaskViewSet,
     ActivityLogViewSet,
+    ImportJobViewSet,
+    UploadViewSet,
+    SearchView,
+    SyncView,
+    InboxView,
 )
 
 router = DefaultRouter()
@@ -36,10 +41,15 @@ router.register(r"comments", CommentViewSet)
 router.register(r"attachments", AttachmentViewSet)
 router.register(r"recurring-tasks", RecurringTaskViewSet)
 router.register(r"activity-logs", ActivityLogViewSet)
+router.register(r"imports", ImportJobViewSet)
+router.register(r"uploads", UploadViewSet)
 
 urlpatterns = [
     path("", api_root),
     path("", include(router.urls)),
+    path("search/", SearchView.as_view(), name="search"),
+    path("sync/", SyncView.as_view(), name="sync"),
+    path("me/inbox/", InboxView.as_view(), name="inbox"),
     path("auth/register/", RegisterView.as_view(), name="register"),
     path("auth/login/", LoginView.as_view(), name="login"),
     path("auth/logout/", LogoutView.as_view(), name="logout"),
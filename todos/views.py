@@ -1,7 +1,16 @@
-from rest_framework import viewsets, filters, permissions
+import io
+import re
+import zoneinfo
+
+from django.db import transaction
+from django.http import Http404
+from django.utils.cache import quote_etag
+from rest_framework import generics, mixins, viewsets, filters, permissions, status
 from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import (
     Project,
@@ -13,6 +22,8 @@ from .models import (
     Attachment,
     RecurringTask,
     ActivityLog,
+    ImportJob,
+    Upload,
 )
 from .serializers import (
     ProjectSerializer,
@@ -24,8 +35,60 @@ from .serializers import (
     AttachmentSerializer,
     RecurringTaskSerializer,
     ActivityLogSerializer,
+    TodoTreeSerializer,
+    ProjectStatsSerializer,
+    MilestoneStatsSerializer,
+    ImportJobSerializer,
+    UploadSerializer,
+    UploadPartSerializer,
 )
+from .async_views import AsyncReadMixin
+from .compact import CompactMixin
+from .conditional import ConditionalGetMixin
+from .export import ExportMixin
+from .feed import EventStreamRenderer, feed_response
+from .importer import claimable, start_import
+from .inbox import BUCKETS, Buckets
+from .membership import is_project_member, member_project_ids
+from .pagination import KeysetPagination
 from .permissions import IsOwnerOrReadOnly, IsProjectMemberOrReadOnly
+from .planner import PlannedQuerysetMixin, plan_queryset
+from .response_cache import CachedResponseMixin
+from .search import FullTextSearchFilter, search
+from .stats import get_stats
+from .sync import changes, format_token, parse_token
+from .tree import assemble, max_depth, subtree
+from .uploads import (
+    DownloadRenderer,
+    complete_upload,
+    file_response,
+    max_parts,
+    store_part,
+)
+from .signals import todos_bulk_created, todos_bulk_updated
+
+
+class APIModelViewSet(
+    ConditionalGetMixin,
+    PlannedQuerysetMixin,
+    CompactMixin,
+    AsyncReadMixin,
+    viewsets.ModelViewSet,
+):
+    """
+    Base viewset of the API: planned querysets, conditional requests, the
+    compact format and, with ``async_read``, async reads.
+    """
+
+
+class APIReadOnlyModelViewSet(
+    ConditionalGetMixin,
+    PlannedQuerysetMixin,
+    CompactMixin,
+    AsyncReadMixin,
+    viewsets.ReadOnlyModelViewSet,
+):
+    """Read-only counterpart of ``APIModelViewSet``."""
 
 
 @api_view(["GET"])
@@ -45,28 +108,58 @@ def api_root(request, format=None):
             "activity-logs": reverse(
                 "activitylog-list", request=request, format=format
             ),
+            "imports": reverse("importjob-list", request=request, format=format),
+            "uploads": reverse("upload-list", request=request, format=format),
+            "search": reverse("search", request=request, format=format),
+            "sync": reverse("sync", request=request, format=format),
+            "inbox": reverse("inbox", request=request, format=format),
         }
     )
 
 
-class ProjectViewSet(viewsets.ModelViewSet):
+class ProjectViewSet(CachedResponseMixin, APIModelViewSet):
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
     filter_backends = [
         DjangoFilterBackend,
-        filters.SearchFilter,
+        FullTextSearchFilter,
         filters.OrderingFilter,
     ]
     filterset_fields = ["owner", "members"]
     search_fields = ["name", "description"]
     ordering_fields = ["name", "created_at", "updated_at"]
+    async_read = True
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
+    @action(detail=True, serializer_class=ProjectStatsSerializer)
+    def stats(self, request, pk=None):
+        """Counters over the project's todos, read from ``ProjectStats``."""
+        serializer = self.get_serializer(get_stats(self.get_object()))
+        return Response(serializer.data)
 
-class MilestoneViewSet(viewsets.ModelViewSet):
+    @action(
+        detail=True,
+        permission_classes=[permissions.IsAuthenticated],
+        renderer_classes=[EventStreamRenderer],
+    )
+    def events(self, request, pk=None):
+        """
+        Server-Sent Events of the changes to the project's todos, comments,
+        attachments and milestones; ``Last-Event-ID`` or ``?last_event_id=``
+        resumes after an event.
+        """
+        project = self.get_object()
+        if not is_project_member(request, project.pk):
+            self.permission_denied(
+                request, message="You are not a member of this project."
+            )
+        return feed_response(request._request, project.pk)
+
+
+class MilestoneViewSet(CachedResponseMixin, APIModelViewSet):
     queryset = Milestone.objects.all()
     serializer_class = MilestoneSerializer
     permission_classes = [
@@ -77,8 +170,14 @@ class MilestoneViewSet(viewsets.ModelViewSet):
     filterset_fields = ["project"]
     ordering_fields = ["due_date"]
 
+    @action(detail=True, serializer_class=MilestoneStatsSerializer)
+    def stats(self, request, pk=None):
+        """Counters over the milestone's todos, read from ``MilestoneStats``."""
+        serializer = self.get_serializer(get_stats(self.get_object()))
+        return Response(serializer.data)
 
-class CategoryViewSet(viewsets.ModelViewSet):
+
+class CategoryViewSet(CachedResponseMixin, APIModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [
@@ -90,7 +189,7 @@ class CategoryViewSet(viewsets.ModelViewSet):
     search_fields = ["name"]
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(CachedResponseMixin, APIModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
@@ -98,7 +197,7 @@ class TagViewSet(viewsets.ModelViewSet):
     search_fields = ["name"]
 
 
-class TodoViewSet(viewsets.ModelViewSet):
+class TodoViewSet(ExportMixin, APIModelViewSet):
     queryset = Todo.objects.all()
     serializer_class = TodoSerializer
     permission_classes = [
@@ -107,7 +206,7 @@ class TodoViewSet(viewsets.ModelViewSet):
     ]
     filter_backends = [
         DjangoFilterBackend,
-        filters.SearchFilter,
+        FullTextSearchFilter,
         filters.OrderingFilter,
     ]
     filterset_fields = [
@@ -117,9 +216,141 @@ class TodoViewSet(viewsets.ModelViewSet):
         "milestone",
         "completed",
         "priority",
+        "recurrence",
     ]
     search_fields = ["title", "description"]
     ordering_fields = ["due_date", "created_at", "updated_at"]
+    pagination_class = KeysetPagination
+    keyset_ordering = ["-created_at"]
+    async_read = True
+    export_fields = [
+        "id",
+        "title",
+        "description",
+        "completed",
+        "user",
+        "project",
+        "category",
+        "milestone",
+        "parent_task",
+        "priority",
+        "due_date",
+        "estimated_time",
+        "actual_time",
+        "recurrence",
+        "occurrence_at",
+        "created_at",
+        "updated_at",
+    ]
+
+    bulk_max_items = 1000
+
+    @action(detail=False, methods=["post", "patch", "delete"], url_path="bulk")
+    def bulk(self, request):
+        """
+        Create (POST), partially update (PATCH) or delete (DELETE) many todos
+        in one transaction. POST and PATCH take a list of todo payloads, PATCH
+        payloads identify their todo with ``id``; DELETE takes a list of ids.
+        """
+        if request.method == "POST":
+            return self.bulk_create(request)
+        if request.method == "PATCH":
+            return self.bulk_partial_update(request)
+        return self.bulk_destroy(request)
+
+    def bulk_create(self, request):
+        serializer = self.get_serializer(
+            data=request.data, many=True, max_length=self.bulk_max_items
+        )
+        serializer.is_valid(raise_exception=True)
+        self.check_project_membership(
+            request, {attrs["project"].pk for attrs in serializer.validated_data}
+        )
+        with transaction.atomic():
+            todos = serializer.save()
+            todos_bulk_created(todos)
+        return self.bulk_response(todos, status_code=status.HTTP_201_CREATED)
+
+    def bulk_partial_update(self, request):
+        if not isinstance(request.data, list):
+            raise ValidationError("Expected a list of items.")
+        ids = [item.get("id") for item in request.data if isinstance(item, dict)]
+        todos = list(Todo.objects.filter(pk__in=self.clean_ids(ids)))
+        serializer = self.get_serializer(
+            todos,
+            data=request.data,
+            many=True,
+            partial=True,
+            max_length=self.bulk_max_items,
+        )
+        serializer.is_valid(raise_exception=True)
+        self.check_project_membership(
+            request,
+            {todo.project_id for todo in todos}
+            | {
+                attrs["project"].pk
+                for attrs in serializer.validated_data
+                if "project" in attrs
+            },
+        )
+        with transaction.atomic():
+            todos = serializer.save()
+            todos_bulk_updated(todos)
+        return self.bulk_response(todos)
+
+    def bulk_destroy(self, request):
+        if not isinstance(request.data, list):
+            raise ValidationError("Expected a list of ids.")
+        ids = self.clean_ids(request.data)
+        todos = Todo.objects.filter(pk__in=ids)
+        found = dict(todos.values_list("pk", "project_id"))
+        missing = sorted(set(ids) - set(found))
+        if missing:
+            raise ValidationError({"ids": [f"Unknown todo ids: {missing}"]})
+        self.check_project_membership(request, set(found.values()))
+        # Deletion signals still fire; their activity log entries are buffered.
+        todos.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def clean_ids(self, ids):
+        if len(ids) > self.bulk_max_items:
+            raise ValidationError(f"At most {self.bulk_max_items} items.")
+        try:
+            return [int(pk) for pk in ids if pk is not None]
+        except (TypeError, ValueError):
+            raise ValidationError({"ids": ["Ids must be integers."]})
+
+    def check_project_membership(self, request, project_ids):
+        """Bulk counterpart of ``IsProjectMemberOrReadOnly``."""
+        if set(project_ids) - member_project_ids(request, project_ids):
+            self.permission_denied(
+                request, message="You are not a member of every project involved."
+            )
+
+    def bulk_response(self, todos, status_code=status.HTTP_200_OK):
+        queryset = self.get_queryset().filter(pk__in=[todo.pk for todo in todos])
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data, status=status_code)
+
+    @action(detail=True, serializer_class=TodoTreeSerializer)
+    def tree(self, request, pk=None):
+        """
+        The todo and its subtasks, recursively, down to ``?depth=`` levels
+        (``TODO_TREE_MAX_DEPTH`` at most and by default). Every node rolls up
+        the completion and times of its subtree down to
+        ``TODO_TREE_MAX_DEPTH + 1`` levels below the todo; deeper subtasks
+        are left out of the rollups.
+        """
+        todo = self.get_object()
+        try:
+            depth = int(request.query_params.get("depth", max_depth()))
+        except ValueError:
+            raise ValidationError({"depth": ["A valid integer is required."]})
+        depth = max(0, min(depth, max_depth()))
+        # One level more than shown tells leaves from cut off nodes.
+        nodes = subtree(todo.pk, max_depth() + 1, using=todo._state.db)
+        serializer = self.get_serializer(assemble(nodes, todo.pk, depth))
+        return Response(serializer.data)
 
     @action(detail=True, methods=["post"])
     def add_comment(self, request, pk=None):
@@ -142,7 +373,7 @@ class TodoViewSet(viewsets.ModelViewSet):
         return Response(serializer.errors, status=400)
 
 
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(ExportMixin, APIModelViewSet):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [
@@ -152,9 +383,12 @@ class CommentViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ["todo", "user"]
     ordering_fields = ["created_at"]
+    pagination_class = KeysetPagination
+    keyset_ordering = ["-created_at"]
+    export_fields = ["id", "todo", "user", "content", "created_at", "updated_at"]
 
 
-class AttachmentViewSet(viewsets.ModelViewSet):
+class AttachmentViewSet(APIModelViewSet):
     queryset = Attachment.objects.all()
     serializer_class = AttachmentSerializer
     permission_classes = [
@@ -165,8 +399,19 @@ class AttachmentViewSet(viewsets.ModelViewSet):
     filterset_fields = ["todo", "uploaded_by"]
     ordering_fields = ["uploaded_at"]
 
+    @action(detail=True, renderer_classes=[DownloadRenderer])
+    def download(self, request, pk=None):
+        """The attachment's file, streamed, with ``Range`` support."""
+        attachment = self.get_object()
+        if not attachment.file:
+            raise Http404
+        etag = None
+        if attachment.blob_id is not None:
+            etag = quote_etag(attachment.blob.sha256)
+        return file_response(request, attachment.file, etag)
 
-class RecurringTaskViewSet(viewsets.ModelViewSet):
+
+class RecurringTaskViewSet(APIModelViewSet):
     queryset = RecurringTask.objects.all()
     serializer_class = RecurringTaskSerializer
     permission_classes = [
@@ -177,10 +422,261 @@ class RecurringTaskViewSet(viewsets.ModelViewSet):
     filterset_fields = ["todo", "frequency"]
 
 
-class ActivityLogViewSet(viewsets.ReadOnlyModelViewSet):
+class ActivityLogViewSet(ExportMixin, APIReadOnlyModelViewSet):
     queryset = ActivityLog.objects.all()
     serializer_class = ActivityLogSerializer
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ["user", "action"]
     ordering_fields = ["timestamp"]
+    pagination_class = KeysetPagination
+    keyset_ordering = ["-timestamp"]
+    export_fields = ["id", "user", "action", "target", "timestamp"]
+    # Entries are written after their timestamp, by the buffered writer, so
+    # they are extracted in id order. Ids are taken before commit, by
+    # concurrent writers too; the lag on the timestamp keeps the watermark
+    # behind the ids not committed yet.
+    export_watermark = "id"
+    export_lag_field = "timestamp"
+
+
+class ImportJobViewSet(mixins.CreateModelMixin, APIReadOnlyModelViewSet):
+    """
+    Imports of NDJSON or CSV files of todos into a project. Creating one
+    uploads the file and starts the import; see ``todos.importer``.
+    """
+
+    queryset = ImportJob.objects.all()
+    serializer_class = ImportJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ["project", "status"]
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        project = serializer.validated_data["project"]
+        if not is_project_member(self.request, project.pk):
+            self.permission_denied(
+                self.request, message="You are not a member of this project."
+            )
+        start_import(serializer.save(user=self.request.user))
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
+    @action(detail=True, methods=["post"])
+    def resume(self, request, pk=None):
+        """
+        Resume an interrupted or failed import after its last chunk; 409 while
+        a worker still runs it.
+        """
+        job = self.get_object()
+        if job.status == "COMPLETED":
+            raise ValidationError({"status": ["The import has completed."]})
+        if not ImportJob.objects.filter(claimable(), pk=job.pk).exists():
+            return Response(
+                {"status": ["The import is running."]},
+                status=status.HTTP_409_CONFLICT,
+            )
+        start_import(job)
+        job.refresh_from_db()
+        serializer = self.get_serializer(job)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+
+class UploadViewSet(
+    mixins.CreateModelMixin, mixins.DestroyModelMixin, APIReadOnlyModelViewSet
+):
+    """
+    Chunked uploads of attachments. Create an upload for a todo, ``PUT`` the
+    raw bytes of each part to ``parts/{number}/``, numbered from 1 and in
+    any order, then ``complete`` it to create the attachment; see
+    ``todos.uploads``. Deleting a pending upload aborts it.
+    """
+
+    queryset = Upload.objects.all()
+    serializer_class = UploadSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ["todo", "status"]
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        todo = serializer.validated_data["todo"]
+        if not is_project_member(self.request, todo.project_id):
+            self.permission_denied(
+                self.request, message="You are not a member of this project."
+            )
+        serializer.save(user=self.request.user)
+
+    def get_pending_upload(self):
+        upload = self.get_object()
+        if upload.status != "PENDING":
+            raise ValidationError({"status": ["The upload has completed."]})
+        return upload
+
+    @action(detail=True, methods=["put"], url_path=r"parts/(?P<number>[0-9]{1,10})")
+    def parts(self, request, pk=None, number=None):
+        """Store a part from the request body, replacing an earlier one."""
+        upload = self.get_pending_upload()
+        if not 1 <= int(number) <= max_parts():
+            raise ValidationError(
+                {"number": [f"Parts are numbered from 1 to {max_parts()}."]}
+            )
+        # The body is streamed to storage, never parsed into request.data.
+        stream = request.stream or io.BytesIO()
+        part = store_part(upload, int(number), stream)
+        return Response(UploadPartSerializer(part).data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["post"])
+    def complete(self, request, pk=None):
+        """Assemble the parts into an attachment of the upload's todo."""
+        attachment = complete_upload(self.get_pending_upload())
+        serializer = AttachmentSerializer(
+            attachment, context=self.get_serializer_context()
+        )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class SearchView(APIView):
+    """
+    Ranked full-text search over todos, comments and projects.
+
+    ``?q=`` holds the terms, all of which must match, each as the prefix of
+    a word. ``?type=todos,comments`` restricts the searched types and
+    ``?limit=`` the number of results per type.
+    """
+
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    search_types = {
+        "todos": TodoViewSet,
+        "comments": CommentViewSet,
+        "projects": ProjectViewSet,
+    }
+    default_limit = 10
+    max_limit = 50
+
+    def get(self, request, format=None):
+        query = request.query_params.get("q", "")
+        types = request.query_params.get("type")
+        types = types.split(",") if types else list(self.search_types)
+        unknown = sorted(set(types) - set(self.search_types))
+        if unknown:
+            raise ValidationError({"type": [f"Unknown search types: {unknown}"]})
+        try:
+            limit = int(request.query_params.get("limit", self.default_limit))
+        except ValueError:
+            raise ValidationError({"limit": ["A valid integer is required."]})
+        limit = max(1, min(limit, self.max_limit))
+
+        context = {"request": request, "format": format, "view": self}
+        results = {}
+        for name in types:
+            viewset = self.search_types[name]
+            serializer_class = viewset.serializer_class
+            queryset = plan_queryset(
+                search(viewset.queryset.all(), query),
+                serializer_class(context=context),
+            )
+            objs = queryset.order_by("-search_rank", "-pk")[:limit]
+            results[name] = serializer_class(objs, many=True, context=context).data
+        return Response({"query": query, "results": results})
+
+
+class SyncView(APIView):
+    """
+    Changes to the todos, comments, milestones and categories of the user's
+    projects, for clients keeping a local copy.
+
+    ``?since=`` holds the ``next`` token of the previous response, the
+    position reached in each project; without it every object is returned.
+    Deleted objects, and objects moved to another project, come as
+    ``deleted`` tombstones. While ``has_more`` is true the client should
+    sync again right away. ``projects`` lists the user's projects: the data
+    of others should be dropped and new ones synced from scratch with
+    ``?project=``.
+    """
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, format=None):
+        try:
+            since = parse_token(request.query_params.get("since"))
+        except ValueError:
+            raise ValidationError({"since": ["Expected a sync token."]})
+        projects = set(
+            Project.objects.filter(members=request.user).values_list("pk", flat=True)
+        )
+        since = {pk: seq for pk, seq in since.items() if pk in projects}
+        synced = projects
+        project = request.query_params.get("project")
+        if project is not None:
+            if not re.fullmatch(r"[0-9]+", project):
+                raise ValidationError({"project": ["Expected a project id."]})
+            if int(project) not in projects:
+                self.permission_denied(
+                    request, message="You are not a member of this project."
+                )
+            synced = {int(project)}
+        results, next_token, has_more = changes(synced, since)
+        return Response(
+            {
+                "changes": results,
+                "next": format_token(next_token),
+                "has_more": has_more,
+                "projects": sorted(projects),
+            }
+        )
+
+
+class InboxView(generics.GenericAPIView):
+    """
+    The open todos assigned to the user across all projects: overdue, due
+    today, upcoming, then without a due date, each ordered by due date and
+    priority, most urgent first. ``?bucket=`` lists one of them and
+    ``buckets`` counts the todos of each. Days end at midnight in ``?tz=``,
+    an IANA time zone, or in the server's.
+
+    Pages are read from the user's ``InboxEntry`` rows with one index range
+    scan, ``?pagination=cursor`` included; see ``todos.inbox``.
+    """
+
+    serializer_class = TodoSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get_timezone(self, request):
+        name = request.query_params.get("tz")
+        if not name:
+            return None
+        try:
+            return zoneinfo.ZoneInfo(name)
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            raise ValidationError({"tz": ["Unknown time zone."]})
+
+    def get(self, request, format=None):
+        bucket = request.query_params.get("bucket")
+        if bucket is not None and bucket not in BUCKETS:
+            raise ValidationError({"bucket": [f"Expected one of {BUCKETS}."]})
+        buckets = Buckets(tz=self.get_timezone(request))
+        entries = self.paginate_queryset(buckets.entries(request.user, bucket))
+        todos = plan_queryset(Todo.objects.all(), self.get_serializer()).in_bulk(
+            [entry.pk for entry in entries]
+        )
+        # Todos deleted since the page was read are left out.
+        entries = [entry for entry in entries if entry.pk in todos]
+        serializer = self.get_serializer(
+            [todos[entry.pk] for entry in entries], many=True
+        )
+        data = serializer.data
+        for item, entry in zip(data, entries):
+            item["bucket"] = buckets.bucket(entry)
+        response = self.get_paginated_response(data)
+        response.data["buckets"] = buckets.counts(request.user)
+        return response